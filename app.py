@@ -1,854 +1,3367 @@
-import streamlit as st
-import pandas as pd
-import hashlib
-from datetime import datetime
-import time
-import pytz
-import plotly
-
-from google.oauth2 import service_account
-from gspread.exceptions import WorksheetNotFound
-import gspread
-from fpdf import FPDF
-
-# ============================================================
-# CONFIGURAÇÃO INICIAL E FUSO
-# ============================================================
-st.set_page_config(page_title="URB Fiscalização", layout="wide")
-FUSO_BR = pytz.timezone('America/Recife')
-
-# Nomes das abas
-SHEET_DENUNCIAS = "denuncias_registro"
-SHEET_REINCIDENCIAS = "reincidencias"
-SHEET_USUARIOS = "usuarios"
-
-# Listas
-OPCOES_STATUS = ['Pendente', 'Em Monitoramento', 'Concluída', 'Arquivada']
-OPCOES_ORIGEM = ['Pessoalmente', 'Telefone', 'Whatsapp', 'Ministério Publico', 'Administração/Gerência', 'Ouvidoria', 'Disk Denuncia']
-OPCOES_TIPO = ['Urbano', 'Ambiental', 'Urbana e Ambiental', 'Ação Noturna']
-OPCOES_ZONA = ['NORTE', 'SUL', 'LESTE', 'OESTE', 'CENTRO', 'ZONA RURAL', '1° DISTRITO', '2° DISTRITO', 'DISTRITO INDUSTRIAL', '3° DISTRITO', '4° DISTRITO']
-OPCOES_FISCAIS_SELECT = ['Edvaldo Wilson Bezerra da Silva - 000.323', 'PATRICIA MIRELLY BEZERRA CAMPOS - 000.332', 'Raiany Nayara de Lima - 000.362', 'Suellen Bezerra do Nascimeto - 000.417']
-
-# SCHEMAS
-DENUNCIA_SCHEMA = [
-    'id', 'external_id', 'created_at', 'origem', 'tipo', 'num_encaminhamento', 'rua', 
-    'numero', 'bairro', 'zona', 'ponto_referencia', 'latitude', 'longitude', 'link maps', 
-    'descricao', 'quem_recebeu', 'status', 'acao_noturna'
-]
-
-REINCIDENCIA_SCHEMA = [
-    'external_id', 'data_hora', 'origem', 'descricao', 'registrado_por'
-]
-
-# ============================================================
-# CONEXÃO GOOGLE SHEETS
-# ============================================================
-class SheetsClient:
-    _gc = None
-    _spreadsheet_key = None
-
-    @classmethod
-    def get_client(cls):
-        if cls._gc is None:
-            try:
-                secrets = st.secrets["gcp_service_account"]
-                cls._spreadsheet_key = secrets["spreadsheet_key"]
-                
-                info = dict(secrets)
-                if "private_key" in info:
-                    info["private_key"] = info["private_key"].replace("\\n", "\n")
-
-                creds = service_account.Credentials.from_service_account_info(
-                    info,
-                    scopes=["https://www.googleapis.com/auth/spreadsheets"]
-                )
-                cls._gc = gspread.authorize(creds)
-            except Exception as e:
-                st.error(f"Erro no Login do Google Sheets: {e}")
-                return None, None
-        return cls._gc, cls._spreadsheet_key
-
-# ============================================================
-# FUNÇÃO DE SUPORTE (DEVE VIR ANTES DE GERAR_PDF)
-# ============================================================
-def clean_text(text):
-    """Limpa o texto para evitar erros de codificação no PDF."""
-    if text is None: 
-        return ""
-    # Converte para string e remove caracteres que o Latin-1 não suporta
-    text = str(text).replace("–", "-").replace("“", '"').replace("”", '"').replace("’", "'")
-    return text.encode('latin-1', 'replace').decode('latin-1')
-
-from fpdf import FPDF
-import pandas as pd
-
-def clean_text(text):
-    """Limpa o texto para evitar erros de codificação no PDF."""
-    if text is None: 
-        return ""
-    text = str(text).replace("–", "-").replace("“", '"').replace("”", '"').replace("’", "'")
-    return text.encode('latin-1', 'replace').decode('latin-1')
-
-def gerar_pdf(dados):
-    try:
-        class PDF(FPDF):
-            def header(self):
-                try:
-                    self.image('logo.png', x=90, y=8, w=30) 
-                    self.ln(22)
-                except:
-                    self.ln(5)
-                self.set_font('Arial', 'B', 14)
-                self.cell(0, 6, clean_text("Autarquia de Urbanização e Meio Ambiente de Caruaru"), 0, 1, 'C')
-                self.set_font('Arial', 'B', 12)
-                self.cell(0, 6, clean_text("Central de Atendimento"), 0, 1, 'C')
-                self.ln(5)
-        
-        def celula_cinza(texto):
-            pdf.set_fill_color(220, 220, 220)
-            pdf.set_font("Arial", 'B', 9)
-            pdf.cell(0, 6, clean_text(texto), 1, 1, 'L', fill=True)
-
-        # --- INÍCIO DA GERAÇÃO DO PDF ---
-        pdf = PDF()
-        pdf.set_auto_page_break(auto=True, margin=25) 
-        pdf.add_page()
-        pdf.set_line_width(0.3)
-        
-        # Função auxiliar interna para células cinzas
-        def celula_cinza(texto):
-            pdf.set_fill_color(220, 220, 220)
-            pdf.set_font("Arial", 'B', 9)
-            pdf.cell(0, 6, clean_text(texto), 1, 1, 'L', fill=True)
-
-        # 1. TÍTULO DA SEÇÃO
-        celula_cinza("ORDEM DE SERVIÇO - SETOR DE FISCALIZAÇÃO")
-        
-        # Tratamento de Data e Hora
-        raw_date = str(dados.get('created_at', ''))
-        data_fmt, hora_fmt = raw_date, ""
-        try:
-            dt_obj = pd.to_datetime(raw_date)
-            data_fmt = dt_obj.strftime('%d/%m/%Y')
-            hora_fmt = dt_obj.strftime('%H:%M')
-        except:
-            pass
-
-        # Linha 1: Nº, DATA, HORA, ORIGEM
-        pdf.set_font("Arial", 'B', 8)
-        pdf.cell(8, 8, "Nº", 1, 0, 'C')
-        pdf.set_font("Arial", '', 9)
-        pdf.cell(25, 8, clean_text(dados.get('external_id', '')), 1, 0, 'C')
-        
-        pdf.set_font("Arial", 'B', 8)
-        pdf.cell(12, 8, "DATA:", 1, 0, 'C')
-        pdf.set_font("Arial", '', 9)
-        pdf.cell(22, 8, data_fmt, 1, 0, 'C')
-
-        pdf.set_font("Arial", 'B', 8)
-        pdf.cell(12, 8, "HORA:", 1, 0, 'C')
-        pdf.set_font("Arial", '', 9)
-        pdf.cell(15, 8, hora_fmt, 1, 0, 'C')
-
-        origem = dados.get('origem', '')
-        num_encaminhamento = dados.get('num_encaminhamento', '')
-
-        if origem in ["Ouvidoria", "Ministério Publico", "Disk Denuncia"] and num_encaminhamento:
-           origem_texto = f"{origem} - Nº {num_encaminhamento}"
-        else:
-           origem_texto = origem
-
-        pdf.set_font("Arial", 'B', 8)
-        pdf.cell(18, 8, "ORIGEM:", 1, 0, 'L')
-        pdf.set_font("Arial", '', 8)
-        pdf.cell(0, 8, clean_text(origem_texto), 1, 1, 'L')
-
-        # Linha 2: Bairro e Zona (TGS)
-        pdf.set_font("Arial", 'B', 8)
-        pdf.cell(35, 8, "BAIRRO OU DISTRITO:", 1, 0, 'L')
-        pdf.set_font("Arial", '', 9)
-        pdf.cell(120, 8, clean_text(dados.get('bairro', '')), 1, 0, 'L')
-        
-        pdf.set_font("Arial", 'B', 8)
-        pdf.cell(10, 8, "TGS:", 1, 0, 'C')
-        pdf.set_font("Arial", '', 9)
-        pdf.cell(0, 8, clean_text(dados.get('zona', '')), 1, 1, 'C')
-
-        celula_cinza("DESCRIÇÃO DA ORDEM DE SERVIÇO")
-        pdf.set_font("Arial", '', 9)
-        pdf.multi_cell(0, 5, clean_text(dados.get('descricao', '')), 1, 'L')
-        pdf.set_x(10)
-        
-        # 3. ENDEREÇO, GEOLOCALIZAÇÃO E PONTO DE REFERÊNCIA
-        pdf.set_font("Arial", 'B', 8)
-        pdf.cell(30, 8, "LOGRADOURO:", "LTB", 0, 'L')
-        pdf.set_font("Arial", '', 9)
-        pdf.cell(0, 8, clean_text(dados.get('rua', '')), "RB", 1, 'L')
-        
-        pdf.set_font("Arial", 'B', 8)
-        pdf.cell(30, 8, "Nº:", "LB", 0, 'L')
-        pdf.set_font("Arial", '', 9)
-        pdf.cell(0, 8, clean_text(dados.get('numero', '')), "RB", 1, 'L')
-
-       # --- CAMPO GEOLOCALIZAÇÃO E LINK MAPS ---
-        lat = str(dados.get('latitude', ''))
-        lon = str(dados.get('longitude', ''))
-        link = str(dados.get('link_maps', '')) # Puxa o link do banco de dados
-        
-        geo_texto = f"Lat e Lon: {lat} , {lon}" if lat and lon else "Não informada"
-
-        pdf.set_font("Arial", 'B', 8)
-        pdf.cell(35, 8, clean_text("GEOLOCALIZAÇÃO:"), 1, 0, 'L')
-        pdf.set_font("Arial", '', 8)
-        pdf.cell(0, 8, clean_text(geo_texto), 1, 1, 'L')
-
-        if link:
-            pdf.set_font("Arial", 'B', 8)
-            pdf.cell(35, 8, "LINK MAPS:", 1, 0, 'L')
-            pdf.set_font("Arial", '', 7)
-            pdf.set_text_color(0, 0, 255) # Azul para parecer link
-            pdf.cell(0, 8, clean_text(link), 1, 1, 'L', link=link)
-            pdf.set_text_color(0, 0, 0) # Volta para preto
-
-        # --- CAMPO PONTO DE REFERÊNCIA ---
-        pdf.set_font("Arial", 'B', 8)
-        pdf.cell(35, 8, clean_text("PONTO DE REFERÊNCIA: "), 1, 0, 'L')
-        pdf.set_font("Arial", '', 8)
-        pdf.cell(0, 8, clean_text(dados.get('ponto_referencia', '')), 1, 1, 'L')
-
-       # 4. ASSINATURAS
-        pdf.ln(5)
-        y_sig = pdf.get_y()
-        if y_sig > 230: pdf.add_page(); y_sig = pdf.get_y()
-
-        pdf.rect(10, y_sig, 130, 18) 
-        pdf.rect(140, y_sig, 60, 18) 
-        
-        pdf.set_fill_color(220, 220, 220) 
-        pdf.set_xy(140, y_sig)
-        pdf.set_font("Arial", 'B', 8)
-        pdf.cell(60, 6, "Rubrica", 1, 0, 'C', fill=True)
-
-        pdf.set_xy(12, y_sig + 2)
-        pdf.set_font("Arial", 'B', 7)
-        pdf.cell(0, 4, "RECEBIDO POR:", 0, 1)
-        
-        # --- LINHA ADICIONADA PARA PUXAR O NOME ---
-        pdf.set_x(12)
-        pdf.set_font("Arial", '', 9)
-        pdf.cell(125, 8, clean_text(dados.get('quem_recebeu', '')), 0, 0, 'L')
-                
-      # 5. INFORMAÇÕES DA FISCALIZAÇÃO
-        pdf.set_xy(10, y_sig + 22)
-        celula_cinza("INFORMAÇÕES DA FISCALIZAÇÃO")
-        
-        pdf.set_font("Arial", 'B', 8)
-        pdf.cell(90, 10, clean_text("DATA DA VISTORIA:            "), 1, 0, 'L')
-        pdf.cell(0, 10, "HORA:             ", 1, 1, 'L')
-
-        # Cabeçalho do quadro
-        pdf.set_font("Arial", '', 7)
-        pdf.cell(0, 5, clean_text("OBSERVAÇÕES E DESCRIÇÃO DA OCORRÊNCIA"), "LR", 1, 'C')
-        
-        # 1. Espaço superior do quadro (Altura total de 95mm - 30mm da rubrica = 65mm)
-        pdf.cell(0, 75, "", "LR", 1, 'L') 
-
-        # 2. Linha da Rubrica (posicionada a 3cm do fundo)
-        pdf.set_font("Arial", 'B', 9)
-        # "LR" mantém as bordas laterais abertas para continuar o quadro
-        pdf.cell(0, 5, clean_text("  RUBRICA:                       "), "LR", 1, 'L')
-
-        # 3. Espaço inferior final (os últimos 25mm para fechar o quadro)
-        # "LRB" coloca a linha de baixo que fecha o quadro
-        pdf.cell(0, 15, "", "LRB", 1, 'L') 
-
-        pdf_output = pdf.output(dest='S')
-        return bytes(pdf_output) if not isinstance(pdf_output, str) else pdf_output.encode('latin-1')
-
-
-    except Exception as e:
-        return str(e)
-# ============================================================
-# FUNÇÕES DE BANCO DE DADOS
-# ============================================================
-def get_worksheet(sheet_name):
-    gc, key = SheetsClient.get_client()
-    if not gc: return None
-    
-    sh = gc.open_by_key(key)
-    try:
-        ws = sh.worksheet(sheet_name)
-    except WorksheetNotFound:
-        ws = sh.add_worksheet(sheet_name, rows=100, cols=20)
-        if sheet_name == SHEET_DENUNCIAS:
-            ws.append_row(DENUNCIA_SCHEMA)
-        elif sheet_name == SHEET_USUARIOS:
-            ws.append_row(["username", "password", "name", "role"])
-        elif sheet_name == SHEET_REINCIDENCIAS:
-            ws.append_row(REINCIDENCIA_SCHEMA)
-    return ws
-
-def load_data(sheet_name):
-    ws = get_worksheet(sheet_name)
-    if not ws: return pd.DataFrame()
-    data = ws.get_all_records()
-    df = pd.DataFrame(data)
-    return df.fillna('')
-
-def salvar_dados_seguro(sheet_name, row_dict):
-    ws = get_worksheet(sheet_name)
-    headers = ws.row_values(1)
-    if not headers:
-        if sheet_name == SHEET_DENUNCIAS: headers = DENUNCIA_SCHEMA
-        elif sheet_name == SHEET_REINCIDENCIAS: headers = REINCIDENCIA_SCHEMA
-        ws.append_row(headers)
-    
-    values = []
-    for h in headers:
-        val = row_dict.get(h, '') 
-        values.append(str(val))
-    ws.append_row(values)
-
-def update_full_sheet(sheet_name, df):
-    ws = get_worksheet(sheet_name)
-    ws.clear()
-    df_clean = df.fillna('')
-    ws.update([df_clean.columns.tolist()] + df_clean.values.tolist())
-
-def gerar_novo_id():
-    ws = get_worksheet("config")
-
-    # Garante cabeçalho
-    if not ws.row_values(1):
-        ws.append_row(["ultimo_id"])
-        ws.append_row([0])
-
-    valor_atual = ws.acell("A1").value
-    ultimo_id = int(valor_atual) if valor_atual else 0
-
-    novo_id = ultimo_id + 1
-    ws.update("A1", [[novo_id]])
-
-    return novo_id
-
-# ============================================================
-# AUTENTICAÇÃO
-# ============================================================
-def hash_password(password):
-    return hashlib.sha256(str(password).encode()).hexdigest()
-
-def init_users_if_empty():
-    df_users = load_data(SHEET_USUARIOS)
-    if df_users.empty:
-        st.warning("Criando usuários padrão...")
-        default_pwd = hash_password("urb123")
-        users_init = [
-            {"username": "suellen", "password": default_pwd, "name": "Suellen", "role": "admin"},
-            {"username": "edvaldo", "password": default_pwd, "name": "Edvaldo", "role": "user"},
-            {"username": "patricia", "password": default_pwd, "name": "Patricia", "role": "user"},
-            {"username": "raiany", "password": default_pwd, "name": "Raiany", "role": "user"},
-        ]
-        df_new = pd.DataFrame(users_init)
-        update_full_sheet(SHEET_USUARIOS, df_new)
-        return df_new
-    return df_users
-
-def check_login(username, password):
-    df_users = init_users_if_empty()
-    hashed = hash_password(password)
-    user = df_users[(df_users['username'] == username.lower()) & (df_users['password'] == hashed)]
-    return user.iloc[0].to_dict() if not user.empty else None
-
-def change_password(username, new_password):
-    df_users = load_data(SHEET_USUARIOS)
-    new_hash = hash_password(new_password)
-    df_users.loc[df_users['username'] == username, 'password'] = new_hash
-    update_full_sheet(SHEET_USUARIOS, df_users)
-    return True
-
-# ============================================================
-# TELA LOGIN
-# ============================================================
-if 'user' not in st.session_state:
-    st.session_state.user = None
-
-if st.session_state.user is None:
-    col1, col2, col3 = st.columns([1,2,1])
-    with col2:
-        st.title("🔐 URB Fiscalização")
-        with st.form("login"):
-            u = st.text_input("Usuário").strip()
-            p = st.text_input("Senha", type="password")
-            if st.form_submit_button("Entrar"):
-                user_data = check_login(u, p)
-                if user_data:
-                    st.session_state.user = user_data
-                    st.success(f"Olá, {user_data['name']}!")
-                    time.sleep(1)
-                    st.rerun()
-                else:
-                    st.error("Login inválido")
-    st.stop()
-
-# ============================================================
-# APP PRINCIPAL
-# ============================================================
-user_info = st.session_state.user
-st.sidebar.title(f"Fiscal: {user_info['name']}")
-page = st.sidebar.radio("Menu", ["Dashboard", "Registrar Denúncia", "Histórico / Editar", "Reincidências"])
-st.sidebar.divider()
-
-with st.sidebar.expander("🔑 Senha"):
-    with st.form("pwd"):
-        np = st.text_input("Nova Senha", type="password")
-        if st.form_submit_button("Alterar"):
-            if len(np) > 0:
-                change_password(user_info['username'], np)
-                st.success("Senha alterada! Relogue.")
-                st.session_state.user = None
-                time.sleep(2)
-                st.rerun()
-
-if st.sidebar.button("Sair"):
-    st.session_state.user = None
-    st.rerun()
-
-# ============================================================
-# PÁGINA 1: DASHBOARD
-# ============================================================
-if page == "Dashboard":
-    st.title("📊 Visão Geral da Fiscalização")
-    df = load_data(SHEET_DENUNCIAS)
-    
-    if not df.empty:
-        # --- MÉTRICAS PRINCIPAIS ---
-        df['status'] = df['status'].replace({'FALSE': 'Pendente', 'False': 'Pendente'})
-        c1, c2, c3, c4 = st.columns(4)
-        c1.metric("Total de Denúncias", len(df))
-        c2.metric("Pendentes", len(df[df['status'] == 'Pendente']))
-        c3.metric("Em Andamento", len(df[df['status'] == 'Em Monitoramento']))
-        c4.metric("Concluídas", len(df[df['status'] == 'Concluída']))
-
-        st.divider()
-
-        # --- GRÁFICOS: LINHA 1 (TIPO E FONTE) ---
-        col_graf1, col_graf2 = st.columns(2) # Define as colunas aqui
-
-        with col_graf1:
-            st.subheader("Tipo de Denúncia")
-            
-            # 1. Padronização dos Nomes (Limpeza) dentro do bloco identado
-            df_tipo = df.copy()
-            df_tipo['tipo'] = df_tipo['tipo'].replace({
-                'Urbana': 'Urbano', 
-                'urbano': 'Urbano',
-                'urbana': 'Urbano'
-            })
-
-            # 2. Contagem
-            contagem = df_tipo['tipo'].value_counts().reset_index()
-            contagem.columns = ['Tipo', 'Qtd']
-
-            # 3. Gráfico de Rosca (Donut)
-            import plotly.express as px
-            fig = px.pie(
-                contagem, 
-                values='Qtd', 
-                names='Tipo', 
-                hole=0.5,
-                color_discrete_sequence=px.colors.qualitative.Safe
-            )
-            
-            fig.update_traces(textposition='inside', textinfo='percent+label')
-            fig.update_layout(margin=dict(t=30, b=0, l=0, r=0), showlegend=False)
-            st.plotly_chart(fig, use_container_width=True)
-
-        with col_graf2:
-            st.subheader("Fonte da Denúncia")
-            df_origem = df['origem'].value_counts().reset_index()
-            df_origem.columns = ['Fonte', 'Total']
-            fig_origem = px.bar(df_origem, x='Total', y='Fonte', orientation='h', text_auto=True)
-            fig_origem.update_layout(margin=dict(t=30, b=0, l=0, r=0))
-            st.plotly_chart(fig_origem, use_container_width=True)
-
-        st.divider()
-
-        # --- GRÁFICOS: LINHA 2 (RANKINGS) ---
-        col_rank1, col_rank2 = st.columns(2)
-
-        with col_rank1:
-            st.subheader("🏆 Ranking por Bairro")
-            df_bairro = df['bairro'].value_counts().nlargest(10).reset_index()
-            df_bairro.columns = ['Bairro', 'Total']
-            fig_bairro = px.bar(df_bairro, x='Total', y='Bairro', orientation='h',
-                               text='Total', color='Total', color_continuous_scale='Blues')
-            fig_bairro.update_layout(yaxis={'categoryorder':'total ascending'}, showlegend=False)
-            st.plotly_chart(fig_bairro, use_container_width=True)
-
-        with col_rank2:
-            st.subheader("📍 Denúncias por Zona")
-            df_zona = df['zona'].value_counts().reset_index()
-            df_zona.columns = ['Zona', 'Total']
-            fig_zona = px.bar(df_zona, x='Zona', y='Total', color='Zona', text_auto=True)
-            fig_zona.update_layout(showlegend=False)
-            st.plotly_chart(fig_zona, use_container_width=True)
-
-        st.divider()
-
-        # --- TABELA RECENTE ---
-        st.subheader("📅 Últimas Ocorrências")
-        st.dataframe(df.tail(10)[['external_id', 'bairro', 'status', 'created_at']], use_container_width=True)
-
-    else:
-        st.info("Nenhuma denúncia encontrada para gerar estatísticas.")
-# ============================================================
-elif page == "Registrar Denúncia":
-    st.title("📝 Nova Denúncia")
-
-    ORIGENS_EXTERNAS = ["Ouvidoria", "Ministério Publico", "Disk Denuncia"]
-
-    # ---------------- CONTROLE FORA DO FORM ----------------
-    c1, c2 = st.columns(2)
-    origem = c1.selectbox("Origem", OPCOES_ORIGEM)
-    tipo = c2.selectbox("Tipo", OPCOES_TIPO)
-
-    num_encaminhamento = ""
-    if origem in ORIGENS_EXTERNAS:
-        st.info(f"Preencha o número do protocolo vindo do(a) {origem}")
-        num_encaminhamento = st.text_input(
-            "Nº do Encaminhamento / Protocolo"
-        )
-
-    # ---------------- FORM PRINCIPAL ----------------
-    with st.form("form_denuncia"):
-
-        rua = st.text_input("Rua")
-        c3, c4, c5 = st.columns(3)
-        numero = c3.text_input("Número")
-        bairro = c4.text_input("Bairro")
-        zona = c5.selectbox("Zona", OPCOES_ZONA)
-
-        st.markdown("---")
-        col_lat, col_lon = st.columns(2)
-        latitude = col_lat.text_input("Latitude")
-        longitude = col_lon.text_input("Longitude")
-        ponto_ref = st.text_input("Ponto de Referência")
-
-        link_google = ""
-        if latitude and longitude:
-            link_google = f"https://www.google.com/maps?q={latitude},{longitude}"
-            st.caption(link_google)
-
-        st.markdown("---")
-        desc = st.text_area("Descrição da Ocorrência")
-        quem = st.selectbox("Quem recebeu", OPCOES_FISCAIS_SELECT)
-
-        btn_submit = st.form_submit_button("💾 Salvar Denúncia")
-
-    if btn_submit:
-        if not rua:
-            st.error("O campo Rua é obrigatório.")
-        elif origem in ORIGENS_EXTERNAS and not num_encaminhamento:
-            st.error(f"Para {origem}, é obrigatório informar o Nº do Encaminhamento.")
-        else:
-            new_id = gerar_novo_id()
-            ext_id = f"{new_id:04d}/{datetime.now().year}"
-            agora_br = datetime.now(FUSO_BR).strftime("%Y-%m-%d %H:%M:%S")
-
-            record = {
-                "id": new_id,
-                "external_id": ext_id,
-                "created_at": agora_br,
-                "origem": origem,
-                "tipo": tipo,
-                "num_encaminhamento": num_encaminhamento,
-                "rua": rua,
-                "numero": numero,
-                "bairro": bairro,
-                "zona": zona,
-                "latitude": latitude,
-                "longitude": longitude,
-                "ponto_referencia": ponto_ref,
-                "link_maps": link_google,
-                "descricao": desc,
-                "quem_recebeu": quem,
-                "status": "Pendente",
-                "acao_noturna": "FALSE"
-            }
-
-            salvar_dados_seguro(SHEET_DENUNCIAS, record)
-            st.success(f"Denúncia {ext_id} salva!")
-            time.sleep(1)
-            st.rerun()
-
-# ============================================================
-# PÁGINA 3: HISTÓRICO / GERENCIAMENTO
-# ============================================================
-elif page == "Histórico / Editar":
-    st.title("🗂️ Gerenciamento de Ocorrências")
-    
-    # 1. Carregar dados
-    df = load_data(SHEET_DENUNCIAS)
-    
-    if df.empty:
-        st.info("Nenhum registro encontrado.")
-    else:
-        # --- SEÇÃO DE FILTROS ---
-        with st.expander("🔍 Filtros de Busca", expanded=False):
-            c1, c2, c3, c4 = st.columns(4)
-            f_bairro = c1.text_input("Bairro")
-            f_zona = c2.selectbox("Zona", ["Todos"] + OPCOES_ZONA)
-            f_status = c3.selectbox("Status", ["Todos"] + OPCOES_STATUS)
-            f_id = c4.text_input("Nº da OS (Ex: 0001)")
-
-        # Aplicar Filtros
-        df_filtrado = df.copy()
-        if f_bairro:
-            df_filtrado = df_filtrado[df_filtrado['bairro'].str.contains(f_bairro, case=False, na=False)]
-        if f_zona != "Todos":
-            df_filtrado = df_filtrado[df_filtrado['zona'] == f_zona]
-        if f_status != "Todos":
-            df_filtrado = df_filtrado[df_filtrado['status'] == f_status]
-        if f_id:
-            df_filtrado = df_filtrado[df_filtrado['external_id'].str.contains(f_id, na=False)]
-
-        # --- LÓGICA DE EDIÇÃO (APARECE NO TOPO SE CLICAR NO LÁPIS) ---
-        if 'edit_id' in st.session_state:
-            st.markdown("---")
-            st.subheader(f"📝 Editando OS: {st.session_state.edit_id}")
-            
-            # Inicializa trava de edição
-            if 'salvando_edicao' not in st.session_state:
-                st.session_state.salvando_edicao = False
-
-            idx_list = df.index[df['id'] == st.session_state.edit_id].tolist()
-            if idx_list:
-                idx = idx_list[0]
-                row_data = df.iloc[idx]
-                
-                with st.form("form_edicao"):
-                    col_e1, col_e2, col_e3 = st.columns(3)
-                    def get_index(lista, valor):
-                        return lista.index(valor) if valor in lista else 0
-
-                    novo_status = col_e1.selectbox("Status", OPCOES_STATUS, index=get_index(OPCOES_STATUS, row_data['status']))
-                    nova_zona = col_e2.selectbox("Zona", OPCOES_ZONA, index=get_index(OPCOES_ZONA, row_data['zona']))
-                    nova_origem = col_e3.selectbox("Origem", OPCOES_ORIGEM, index=get_index(OPCOES_ORIGEM, row_data['origem']))
-                    
-                    col_e4, col_e5 = st.columns([2, 1])
-                    nova_rua = col_e4.text_input("Rua", value=str(row_data.get('rua', '')))
-                    nova_ref = col_e5.text_input("Ponto de Referência", value=str(row_data.get('ponto_referencia', '')))
-
-                    col_lat, col_lon, col_num = st.columns(3)
-                    nova_lat = col_lat.text_input("Latitude", value=str(row_data.get('latitude', '')))
-                    nova_lon = col_lon.text_input("Longitude", value=str(row_data.get('longitude', '')))
-                    novo_num = col_num.text_input("Número", value=str(row_data.get('numero', '')))
-                    
-                    nova_desc = st.text_area("Descrição", value=str(row_data.get('descricao', '')), height=150)
-                    
-                    # Link dinâmico na edição
-                    link_edit = ""
-                    if nova_lat and nova_lon:
-                        link_edit = f"https://www.google.com/maps?q={nova_lat},{nova_lon}"
-                        st.caption(f"Novo Link: {link_edit}")
-
-                    c_btn1, c_btn2 = st.columns([1, 5])
-                    # BOTÃO ATUALIZAR COM TRAVA
-                    if c_btn1.form_submit_button("💾 Atualizar", disabled=st.session_state.salvando_edicao):
-                        st.session_state.salvando_edicao = True
-                        df.at[idx, 'status'] = novo_status
-                        df.at[idx, 'zona'] = nova_zona
-                        df.at[idx, 'origem'] = nova_origem
-                        df.at[idx, 'rua'] = nova_rua
-                        df.at[idx, 'numero'] = novo_num
-                        df.at[idx, 'latitude'] = nova_lat
-                        df.at[idx, 'longitude'] = nova_lon
-                        df.at[idx, 'ponto_referencia'] = nova_ref
-                        df.at[idx, 'descricao'] = nova_desc
-                        df.at[idx, 'link_maps'] = link_edit
-                        
-                        update_full_sheet(SHEET_DENUNCIAS, df)
-                        st.success("Atualizado com sucesso!")
-                        st.session_state.salvando_edicao = False
-                        del st.session_state.edit_id
-                        time.sleep(1)
-                        st.rerun()
-                    
-                    if c_btn2.form_submit_button("Cancelar"):
-                        del st.session_state.edit_id
-                        st.rerun()
-            st.markdown("---")
-
-        # --- LISTAGEM ÚNICA DE CARDS ---
-        st.write(f"Exibindo **{len(df_filtrado)}** registros")
-        df_filtrado = df_filtrado.sort_values(by='id', ascending=False)
-
-        # O 'i' aqui garante que cada linha do loop tenha um número único
-        for i, row in enumerate(df_filtrado.itertuples()):
-            # Usamos row.id e row.external_id (itertuples é mais rápido e seguro)
-            idx_real = row.id
-            ext_id_limpo = str(row.external_id).replace('/', '_')
-
-            with st.container(border=True):
-                c_info, c_status, c_pdf, c_edit, c_del = st.columns([3, 1, 0.5, 0.5, 0.5])
-                
-                c_info.markdown(f"### OS {row.external_id}")
-                c_info.write(f"📍 **{row.rua}**, {row.numero} - {row.bairro} ({row.zona})")
-                c_info.caption(f"🗓️ {row.created_at} | 👤 {row.quem_recebeu}")
-                
-                st_val = str(row.status)
-                clr = "orange" if st_val == "Pendente" else "green" if st_val == "Concluída" else "blue"
-                c_status.markdown(f"<br>:{clr}[**{st_val.upper()}**]", unsafe_allow_html=True)
-                
-                # 1. BOTÃO PDF (CHAVE ÚNICA)
-                res_pdf = gerar_pdf(row._asdict()) # converte linha para dicionário
-                if isinstance(res_pdf, bytes):
-                    c_pdf.markdown("<br>", unsafe_allow_html=True)
-                    c_pdf.download_button(
-                        "📄", 
-                        res_pdf, 
-                        f"OS_{ext_id_limpo}.pdf", 
-                        "application/pdf", 
-                        key=f"pdf_btn_{idx_real}_{i}"
-                    )
-                
-                # 2. BOTÃO EDITAR (CHAVE ÚNICA)
-                c_edit.markdown("<br>", unsafe_allow_html=True)
-                if c_edit.button("✏️", key=f"ed_btn_{idx_real}_{i}"):
-                    st.session_state.edit_id = idx_real
-                    st.rerun()
-                    
-                # 3. BOTÃO DELETAR (CHAVE ÚNICA)
-                c_del.markdown("<br>", unsafe_allow_html=True)
-                if c_del.button("🗑️", key=f"del_btn_{idx_real}_{i}"):
-                    st.session_state.confirm_del = idx_real
-
-                # Confirmação de exclusão (CHAVE ÚNICA)
-                if 'confirm_del' in st.session_state and st.session_state.confirm_del == idx_real:
-                    st.error(f"Excluir permanentemente OS {row.external_id}?")
-                    ca1, ca2 = st.columns([1, 8])
-                    if ca1.button("Sim", key=f"conf_sim_{idx_real}_{i}"):
-                        # ... lógica de exclusão ...
-                        df_final = df[df['id'] != idx_real]
-                        update_full_sheet(SHEET_DENUNCIAS, df_final)
-                        del st.session_state.confirm_del
-                        st.rerun()
-                    if ca2.button("Não", key=f"conf_nao_{idx_real}_{i}"):
-                        del st.session_state.confirm_del
-                        st.rerun()
-
-# ============================================================
-# PÁGINA 4: REINCIDÊNCIAS
-# ============================================================
-elif page == "Reincidências":
-    st.title("🔄 Reincidência")
-    df_den = load_data(SHEET_DENUNCIAS)
-    if not df_den.empty:
-        df_den['label'] = df_den['external_id'].astype(str) + " - " + df_den['rua'].astype(str)
-        escolha = st.selectbox("Denúncia Original", df_den['label'].tolist())
-        if escolha:
-            real_id = escolha.split(" - ")[0]
-            row_idx = df_den.index[df_den['external_id'] == real_id].tolist()[0]
-            desc_atual = df_den.at[row_idx, 'descricao']
-            with st.expander("Ver Atual"): st.text(desc_atual)
-            with st.form("reinc"):
-                desc_nova = st.text_area("Novo Relato")
-                origem = st.selectbox("Origem", OPCOES_ORIGEM)
-                if st.form_submit_button("Salvar"):
-                    if not desc_nova: st.error("Escreva algo.")
-                    else:
-                        agora_br = datetime.now(FUSO_BR).strftime('%Y-%m-%d %H:%M:%S')
-                        timestamp = datetime.now(FUSO_BR).strftime('%d/%m/%Y %H:%M')
-                        rec = {"external_id": real_id, "data_hora": agora_br, "origem": origem, "descricao": desc_nova, "registrado_por": user_info['name']}
-                        salvar_dados_seguro(SHEET_REINCIDENCIAS, rec)
-                        texto_add = f"\n\n{'='*20}\n[REINCIDÊNCIA - {timestamp}]\nFiscal: {user_info['name']} | Origem: {origem}\n{desc_nova}"
-                        df_den.at[row_idx, 'descricao'] = str(desc_atual) + texto_add
-                        df_den.at[row_idx, 'status'] = 'Pendente'
-                        update_full_sheet(SHEET_DENUNCIAS, df_den)
-                        st.success("Feito!")
-                        time.sleep(2)
-                        st.rerun()
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+import streamlit as st
+import pandas as pd
+import numpy as np
+import hashlib
+import hmac
+from datetime import datetime
+import time
+import threading
+import os
+import socket
+import math
+import re
+import unicodedata
+import json
+import random
+import sqlite3
+import functools
+import copy
+import io
+import zipfile
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import pytz
+import plotly
+import plotly.express as px
+
+from google.oauth2 import service_account
+from gspread.http_client import HTTPClient
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from gspread.exceptions import WorksheetNotFound
+import gspread
+from fpdf import FPDF
+from fpdf.enums import XPos, YPos
+
+# ============================================================
+# CONFIGURAÇÃO INICIAL E FUSO
+# ============================================================
+st.set_page_config(page_title="URB Fiscalização", layout="wide")
+FUSO_BR = pytz.timezone('America/Recife')
+
+# Nomes das abas
+SHEET_DENUNCIAS = "denuncias_registro"
+SHEET_REINCIDENCIAS = "reincidencias"
+SHEET_USUARIOS = "usuarios"
+SHEET_CONFIG = "config"
+SHEET_SEQUENCIA = "sequencia_os"
+
+# Listas
+OPCOES_STATUS = ['Pendente', 'Em Monitoramento', 'Concluída', 'Arquivada']
+OPCOES_ORIGEM = ['Pessoalmente', 'Telefone', 'Whatsapp', 'Ministério Publico', 'Administração/Gerência', 'Ouvidoria', 'Disk Denuncia']
+OPCOES_TIPO = ['Urbano', 'Ambiental', 'Urbana e Ambiental', 'Ação Noturna']
+OPCOES_ZONA = ['NORTE', 'SUL', 'LESTE', 'OESTE', 'CENTRO', 'ZONA RURAL', '1° DISTRITO', '2° DISTRITO', 'DISTRITO INDUSTRIAL', '3° DISTRITO', '4° DISTRITO']
+OPCOES_TAMANHO_PAGINA = [10, 25, 50, 100]
+TAMANHO_PAGINA_PADRAO = 25
+OPCOES_FISCAIS_SELECT = ['Edvaldo Wilson Bezerra da Silva - 000.323', 'PATRICIA MIRELLY BEZERRA CAMPOS - 000.332', 'Raiany Nayara de Lima - 000.362', 'Suellen Bezerra do Nascimeto - 000.417']
+
+# SCHEMAS
+DENUNCIA_SCHEMA = [
+    'id', 'external_id', 'created_at', 'origem', 'tipo', 'num_encaminhamento', 'rua', 
+    'numero', 'bairro', 'zona', 'ponto_referencia', 'latitude', 'longitude', 'link maps', 
+    'descricao', 'quem_recebeu', 'status', 'acao_noturna'
+]
+
+REINCIDENCIA_SCHEMA = [
+    'external_id', 'data_hora', 'origem', 'descricao', 'registrado_por'
+]
+
+# Tipos das colunas ao carregar (o resto fica como veio da planilha).
+# Listas viram categóricas com essas opções primeiro; valores fora da
+# lista (legados, digitados à mão) entram como categorias extras.
+# Coordenadas em float64: float32 guarda só ~7 dígitos e cortava
+# -35.97612345 para -35.976124 no PDF e no card.
+DENUNCIA_TIPOS = {
+    'id': 'Int64', 'created_at': 'datetime', 'latitude': 'float64', 'longitude': 'float64',
+    'origem': OPCOES_ORIGEM, 'tipo': OPCOES_TIPO, 'zona': OPCOES_ZONA, 'status': OPCOES_STATUS,
+    'quem_recebeu': OPCOES_FISCAIS_SELECT,
+}
+REINCIDENCIA_TIPOS = {
+    'data_hora': 'datetime', 'origem': OPCOES_ORIGEM, 'registrado_por': [],
+}
+TIPOS_POR_ABA = {SHEET_DENUNCIAS: DENUNCIA_TIPOS, SHEET_REINCIDENCIAS: REINCIDENCIA_TIPOS}
+
+# ============================================================
+# MÉTRICAS (LATÊNCIA, BYTES, COTA)
+# ============================================================
+# Limites dos baldes do histograma de latência, em segundos
+BALDES_LATENCIA = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MAX_RERUNS_GUARDADOS = 30
+
+class Metricas:
+    """Chamadas, erros, respostas 429, bytes e histograma de latência por
+    operação. Existe uma por processo, uma por sessão e uma por rerun."""
+
+    def __init__(self):
+        self.criado_em = time.time()
+        self._ops = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, operacao, segundos, tamanho=0, erro=False, cota=False):
+        with self._lock:
+            op = self._ops.get(operacao)
+            if op is None:
+                op = self._ops[operacao] = {'chamadas': 0, 'erros': 0, 'cota_429': 0, 'bytes': 0,
+                                            'soma': 0.0, 'maximo': 0.0, 'baldes': [0] * (len(BALDES_LATENCIA) + 1)}
+            op['chamadas'] += 1
+            op['erros'] += bool(erro)
+            op['cota_429'] += bool(cota)
+            op['bytes'] += tamanho
+            op['soma'] += segundos
+            op['maximo'] = max(op['maximo'], segundos)
+            op['baldes'][np.searchsorted(BALDES_LATENCIA, segundos)] += 1
+
+    def operacoes(self):
+        with self._lock:
+            return {nome: dict(op, baldes=list(op['baldes'])) for nome, op in self._ops.items()}
+
+    def tabela(self):
+        """Uma linha por operação, com p50/p95 estimados pelos baldes."""
+        def percentil(baldes, q):
+            alvo, acumulado = q * sum(baldes), 0
+            for limite, quantidade in zip(BALDES_LATENCIA + (float('inf'),), baldes):
+                acumulado += quantidade
+                if acumulado >= alvo: return limite
+            return float('inf')
+        linhas = [{
+            'operacao': nome, 'chamadas': op['chamadas'], 'erros': op['erros'], 'cota_429': op['cota_429'],
+            'bytes': op['bytes'], 'media_ms': round(1000 * op['soma'] / op['chamadas'], 1),
+            'p50_ms_ate': 1000 * percentil(op['baldes'], 0.5), 'p95_ms_ate': 1000 * percentil(op['baldes'], 0.95),
+            'max_ms': round(1000 * op['maximo'], 1),
+        } for nome, op in sorted(self.operacoes().items())]
+        return pd.DataFrame(linhas, columns=['operacao', 'chamadas', 'erros', 'cota_429', 'bytes', 'media_ms',
+                                             'p50_ms_ate', 'p95_ms_ate', 'max_ms'])
+
+    def prometheus(self, extras=None):
+        """Texto no formato de exposição do Prometheus (para o textfile
+        collector do node_exporter ou um scrape)."""
+        saida = []
+        def serie(nome, tipo, ajuda, valores):
+            saida.append(f"# HELP {nome} {ajuda}")
+            saida.append(f"# TYPE {nome} {tipo}")
+            saida.extend(valores)
+        ops = self.operacoes()
+        rotulo = lambda nome: f'operacao="{nome}"'
+        for campo, ajuda in (('chamadas', 'Chamadas por operação'), ('erros', 'Chamadas que terminaram em erro'),
+                             ('cota_429', 'Respostas 429 (cota da API excedida)'), ('bytes', 'Bytes recebidos ou gerados')):
+            serie(f"urb_{campo}_total", 'counter', ajuda,
+                  [f"urb_{campo}_total{{{rotulo(n)}}} {op[campo]}" for n, op in ops.items()])
+        valores = []
+        for nome, op in ops.items():
+            acumulado = 0
+            for limite, quantidade in zip(BALDES_LATENCIA + ('+Inf',), op['baldes']):
+                acumulado += quantidade
+                valores.append(f'urb_latencia_segundos_bucket{{{rotulo(nome)},le="{limite}"}} {acumulado}')
+            valores.append(f"urb_latencia_segundos_sum{{{rotulo(nome)}}} {op['soma']:.6f}")
+            valores.append(f"urb_latencia_segundos_count{{{rotulo(nome)}}} {op['chamadas']}")
+        serie("urb_latencia_segundos", 'histogram', 'Latência por operação', valores)
+        for nome, valor in (extras or {}).items():
+            serie(nome, 'gauge', nome.replace('_', ' '), [f"{nome} {valor}"])
+        return "\n".join(saida) + "\n"
+
+@st.cache_resource
+def get_metricas():
+    return Metricas()
+
+# Cada rerun começa com métricas próprias; os últimos ficam guardados na sessão
+if 'metricas_sessao' not in st.session_state:
+    st.session_state.metricas_sessao = Metricas()
+    st.session_state.metricas_reruns = deque(maxlen=MAX_RERUNS_GUARDADOS)
+st.session_state.metricas_rerun = Metricas()
+st.session_state.metricas_reruns.append(st.session_state.metricas_rerun)
+
+def registrar_metrica(operacao, segundos, tamanho=0, erro=False, cota=False):
+    """Registra no processo e, se chamada da thread de um script, também na
+    sessão e no rerun atual (threads de fundo só contam no processo)."""
+    get_metricas().registrar(operacao, segundos, tamanho, erro, cota)
+    if get_script_run_ctx(suppress_warning=True) is None: return
+    for chave in ('metricas_sessao', 'metricas_rerun'):
+        metricas = st.session_state.get(chave)
+        if metricas is not None:
+            metricas.registrar(operacao, segundos, tamanho, erro, cota)
+
+def medido(operacao, tamanho=None):
+    """Decorador: tempo de cada chamada (e tamanho(resultado), se dado)."""
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def medida(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                resultado = funcao(*args, **kwargs)
+            except Exception as e:
+                registrar_metrica(operacao, time.perf_counter() - inicio, erro=True,
+                                  cota=getattr(e, 'code', None) == 429)
+                raise
+            registrar_metrica(operacao, time.perf_counter() - inicio, tamanho(resultado) if tamanho else 0)
+            return resultado
+        return medida
+    return decorador
+
+_ROTULO_ENDPOINT = re.compile(r"/spreadsheets/[^/:]+(?P<valores>/values)?(?:/[^:]*)?(?::(?P<acao>\w+))?$")
+
+def _rotulo_endpoint(metodo, endpoint):
+    """'GET .../spreadsheets/<id>/values/<faixa>' -> 'api GET values'
+    (a faixa vem codificada na URL, então o último ':' é a ação)."""
+    achado = _ROTULO_ENDPOINT.search(endpoint.split('?')[0])
+    if achado is None: return f"api {metodo.upper()} outro"
+    partes = [p for p in ('values' if achado.group('valores') else '', achado.group('acao') or '') if p]
+    return f"api {metodo.upper()} {':'.join(partes) or 'planilha'}"
+
+class HTTPMedido(HTTPClient):
+    """HTTPClient do gspread que registra cada requisição à API: latência,
+    bytes da resposta e respostas 429 (cota excedida)."""
+
+    def request(self, method, endpoint, *args, **kwargs):
+        inicio = time.perf_counter()
+        rotulo = _rotulo_endpoint(method, endpoint)
+        try:
+            resposta = super().request(method, endpoint, *args, **kwargs)
+        except gspread.exceptions.APIError as e:
+            registrar_metrica(rotulo, time.perf_counter() - inicio, len(e.response.content or b''),
+                              erro=True, cota=e.code == 429)
+            raise
+        registrar_metrica(rotulo, time.perf_counter() - inicio, len(resposta.content or b''))
+        return resposta
+
+# ============================================================
+# CONEXÃO GOOGLE SHEETS
+# ============================================================
+@st.cache_resource
+def _sheets_estado():
+    # O script é reexecutado a cada interação; o estado da conexão precisa
+    # viver em cache_resource para sobreviver entre reruns e sessões.
+    return {"gc": None, "key": None, "sh": None, "abas": {}, "headers": {}, "lock": threading.RLock()}
+
+class SheetsClient:
+    """Cliente gspread com a planilha, as abas e os cabeçalhos já resolvidos.
+
+    Os objetos só são buscados de novo após invalidate(), chamado quando a
+    aba some (WorksheetNotFound ou APIError 400/404) ou o cabeçalho muda.
+    """
+
+    @classmethod
+    def get_client(cls):
+        estado = _sheets_estado()
+        with estado["lock"]:
+            if estado["gc"] is None:
+                try:
+                    secrets = st.secrets["gcp_service_account"]
+                    estado["key"] = secrets["spreadsheet_key"]
+                    
+                    info = dict(secrets)
+                    if "private_key" in info:
+                        info["private_key"] = info["private_key"].replace("\\n", "\n")
+
+                    creds = service_account.Credentials.from_service_account_info(
+                        info,
+                        scopes=["https://www.googleapis.com/auth/spreadsheets"]
+                    )
+                    estado["gc"] = gspread.authorize(creds, http_client=HTTPMedido)
+                except Exception as e:
+                    st.error(f"Erro no Login do Google Sheets: {e}")
+                    return None, None
+            return estado["gc"], estado["key"]
+
+    @classmethod
+    @medido("open_by_key")
+    def get_spreadsheet(cls):
+        estado = _sheets_estado()
+        with estado["lock"]:
+            if estado["sh"] is None:
+                gc, key = cls.get_client()
+                if not gc: return None
+                estado["sh"] = gc.open_by_key(key)
+            return estado["sh"]
+
+    @classmethod
+    @medido("get_worksheet")
+    def get_worksheet(cls, sheet_name):
+        estado = _sheets_estado()
+        with estado["lock"]:
+            ws = estado["abas"].get(sheet_name)
+            if ws is None:
+                sh = cls.get_spreadsheet()
+                if sh is None: return None
+                try:
+                    ws = sh.worksheet(sheet_name)
+                except WorksheetNotFound:
+                    try:
+                        ws = sh.add_worksheet(sheet_name, rows=100, cols=20)
+                    except gspread.exceptions.APIError:
+                        # Outro processo criou a aba ao mesmo tempo
+                        ws = sh.worksheet(sheet_name)
+                    else:
+                        headers = _schema_padrao(sheet_name)
+                        if headers:
+                            ws.append_row(headers)
+                            estado["headers"][sheet_name] = list(headers)
+                estado["abas"][sheet_name] = ws
+            return ws
+
+    @classmethod
+    def get_headers(cls, sheet_name):
+        estado = _sheets_estado()
+        with estado["lock"]:
+            headers = estado["headers"].get(sheet_name)
+            if headers is None:
+                ws = cls.get_worksheet(sheet_name)
+                headers = ws.row_values(1) if ws else []
+                if headers:
+                    estado["headers"][sheet_name] = headers
+            return headers
+
+    @classmethod
+    def set_headers(cls, sheet_name, headers):
+        with _sheets_estado()["lock"]:
+            _sheets_estado()["headers"][sheet_name] = list(headers)
+
+    @classmethod
+    def invalidate(cls, sheet_name=None):
+        estado = _sheets_estado()
+        with estado["lock"]:
+            if sheet_name is None:
+                estado["sh"] = None
+                estado["abas"].clear()
+                estado["headers"].clear()
+            else:
+                estado["abas"].pop(sheet_name, None)
+                estado["headers"].pop(sheet_name, None)
+
+# ============================================================
+# FUNÇÃO DE SUPORTE (DEVE VIR ANTES DE GERAR_PDF)
+# ============================================================
+def clean_text(text):
+    """Limpa o texto para evitar erros de codificação no PDF."""
+    if text is None: 
+        return ""
+    # Converte para string e remove caracteres que o Latin-1 não suporta
+    text = str(text).replace("–", "-").replace("“", '"').replace("”", '"').replace("’", "'")
+    return text.encode('latin-1', 'replace').decode('latin-1')
+
+_PALAVRA = re.compile(r"\w+")
+
+def normalizar_busca(texto):
+    """Minúsculas, sem acentos e com espaços simples: 'São  José' -> 'sao jose'."""
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.lower().split())
+
+# ============================================================
+# MODELO DO PDF DA ORDEM DE SERVIÇO
+# ============================================================
+LOGO_PATH = 'logo.png'
+FONTE_PDF = 'helvetica' # mesma fonte que o fpdf usava no lugar de 'Arial'
+
+# Textos fixos já convertidos para Latin-1
+TXT_AUTARQUIA = clean_text("Autarquia de Urbanização e Meio Ambiente de Caruaru")
+TXT_CENTRAL = clean_text("Central de Atendimento")
+TXT_TITULO_OS = clean_text("ORDEM DE SERVIÇO - SETOR DE FISCALIZAÇÃO")
+TXT_DESCRICAO = clean_text("DESCRIÇÃO DA ORDEM DE SERVIÇO")
+TXT_GEOLOCALIZACAO = clean_text("GEOLOCALIZAÇÃO:")
+TXT_PONTO_REF = clean_text("PONTO DE REFERÊNCIA: ")
+TXT_FISCALIZACAO = clean_text("INFORMAÇÕES DA FISCALIZAÇÃO")
+TXT_DATA_VISTORIA = clean_text("DATA DA VISTORIA:            ")
+TXT_OBSERVACOES = clean_text("OBSERVAÇÕES E DESCRIÇÃO DA OCORRÊNCIA")
+TXT_REINCIDENCIAS = clean_text("HISTÓRICO DE REINCIDÊNCIAS")
+TXT_RUBRICA = clean_text("  RUBRICA:                       ")
+
+@st.cache_resource
+def _logo_parseado():
+    """Logo decodificado e comprimido uma única vez por processo.
+
+    O fpdf refaz esse trabalho a cada documento novo; aqui guardamos o
+    resultado e o reaproveitamos no cache de imagens de cada PDF. Usa o
+    image_cache interno do fpdf2, por isso o requirements.txt fixa a 2.8;
+    se o formato mudar, cai no image() normal (None).
+    """
+    try:
+        pdf = FPDF()
+        pdf.add_page()
+        pdf.image(LOGO_PATH, x=0, y=0, w=30)
+        info = pdf.image_cache.images.get(LOGO_PATH)
+        if info is None or info.get("iccp_i") is not None:
+            return None
+        info = copy.copy(info)
+        info["usages"] = 0
+        info.pop("obj_id", None)
+        return info
+    except Exception:
+        return None
+
+class OSPDF(FPDF):
+    """Layout da OS: cabeçalho com logo e células no padrão da Central."""
+
+    def header(self):
+        try:
+            logo = _logo_parseado()
+            if logo is not None and LOGO_PATH not in self.image_cache.images:
+                self.image_cache.images[LOGO_PATH] = copy.copy(logo)
+            self.image(LOGO_PATH, x=90, y=8, w=30) 
+            self.ln(22)
+        except Exception:
+            self.ln(5)
+        self.set_font(FONTE_PDF, 'B', 14)
+        self.celula(0, 6, TXT_AUTARQUIA, 0, 1, 'C')
+        self.set_font(FONTE_PDF, 'B', 12)
+        self.celula(0, 6, TXT_CENTRAL, 0, 1, 'C')
+        self.ln(5)
+
+    def celula(self, w, h, texto="", borda=0, quebra=0, alinhamento='L', fill=False, link=''):
+        """cell() com a ordem de argumentos antiga (ln posicional), sem os
+        avisos de depreciação que custam caro a cada chamada."""
+        if quebra:
+            return self.cell(w, h, texto, borda, align=alinhamento, fill=fill, link=link,
+                             new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        return self.cell(w, h, texto, borda, align=alinhamento, fill=fill, link=link,
+                         new_x=XPos.RIGHT, new_y=YPos.TOP)
+
+    def celula_cinza(self, texto):
+        self.set_fill_color(220, 220, 220)
+        self.set_font(FONTE_PDF, 'B', 9)
+        self.celula(0, 6, texto, 1, 1, 'L', fill=True)
+
+def data_br(texto):
+    """'2025-03-01 14:05:00' -> '01/03/2025 14:05' (texto como veio se não
+    for uma data)."""
+    try:
+        return datetime.strptime(str(texto), "%Y-%m-%d %H:%M:%S").strftime('%d/%m/%Y %H:%M')
+    except ValueError:
+        return str(texto)
+
+def _desenhar_os(pdf, dados):
+    """Desenha uma OS em uma página nova do documento."""
+    pdf.add_page()
+    pdf.set_line_width(0.3)
+
+    # 1. TÍTULO DA SEÇÃO
+    pdf.celula_cinza(TXT_TITULO_OS)
+    
+    # Tratamento de Data e Hora
+    raw_date = str(dados.get('created_at', ''))
+    data_fmt, hora_fmt = raw_date, ""
+    try:
+        try:
+            # Formato gravado pelo app; evita a inferência de formato do pandas
+            dt_obj = datetime.strptime(raw_date, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            dt_obj = pd.to_datetime(raw_date)
+        data_fmt = dt_obj.strftime('%d/%m/%Y')
+        hora_fmt = dt_obj.strftime('%H:%M')
+    except:
+        pass
+
+    # Linha 1: Nº, DATA, HORA, ORIGEM
+    pdf.set_font(FONTE_PDF, 'B', 8)
+    pdf.celula(8, 8, "Nº", 1, 0, 'C')
+    pdf.set_font(FONTE_PDF, '', 9)
+    pdf.celula(25, 8, clean_text(dados.get('external_id', '')), 1, 0, 'C')
+    
+    pdf.set_font(FONTE_PDF, 'B', 8)
+    pdf.celula(12, 8, "DATA:", 1, 0, 'C')
+    pdf.set_font(FONTE_PDF, '', 9)
+    pdf.celula(22, 8, data_fmt, 1, 0, 'C')
+
+    pdf.set_font(FONTE_PDF, 'B', 8)
+    pdf.celula(12, 8, "HORA:", 1, 0, 'C')
+    pdf.set_font(FONTE_PDF, '', 9)
+    pdf.celula(15, 8, hora_fmt, 1, 0, 'C')
+
+    origem = dados.get('origem', '')
+    num_encaminhamento = dados.get('num_encaminhamento', '')
+
+    if origem in ["Ouvidoria", "Ministério Publico", "Disk Denuncia"] and num_encaminhamento:
+       origem_texto = f"{origem} - Nº {num_encaminhamento}"
+    else:
+       origem_texto = origem
+
+    pdf.set_font(FONTE_PDF, 'B', 8)
+    pdf.celula(18, 8, "ORIGEM:", 1, 0, 'L')
+    pdf.set_font(FONTE_PDF, '', 8)
+    pdf.celula(0, 8, clean_text(origem_texto), 1, 1, 'L')
+
+    # Linha 2: Bairro e Zona (TGS)
+    pdf.set_font(FONTE_PDF, 'B', 8)
+    pdf.celula(35, 8, "BAIRRO OU DISTRITO:", 1, 0, 'L')
+    pdf.set_font(FONTE_PDF, '', 9)
+    pdf.celula(120, 8, clean_text(dados.get('bairro', '')), 1, 0, 'L')
+    
+    pdf.set_font(FONTE_PDF, 'B', 8)
+    pdf.celula(10, 8, "TGS:", 1, 0, 'C')
+    pdf.set_font(FONTE_PDF, '', 9)
+    pdf.celula(0, 8, clean_text(dados.get('zona', '')), 1, 1, 'C')
+
+    pdf.celula_cinza(TXT_DESCRICAO)
+    pdf.set_font(FONTE_PDF, '', 9)
+    pdf.multi_cell(0, 5, clean_text(dados.get('descricao', '')), 1, 'L')
+    pdf.set_x(10)
+
+    # Reincidências juntadas da aba própria, da mais antiga para a mais nova
+    if dados.get('reincidencias'):
+        pdf.celula_cinza(TXT_REINCIDENCIAS)
+        for reinc in dados['reincidencias']:
+            pdf.set_font(FONTE_PDF, 'B', 8)
+            pdf.celula(0, 6, clean_text(f"{data_br(reinc.get('data_hora', ''))} | {reinc.get('origem', '')} | "
+                                        f"Fiscal: {reinc.get('registrado_por', '')}"), "LTR", 1, 'L')
+            pdf.set_font(FONTE_PDF, '', 9)
+            pdf.multi_cell(0, 5, clean_text(reinc.get('descricao', '')), "LRB", 'L')
+            pdf.set_x(10)
+    
+    # 3. ENDEREÇO, GEOLOCALIZAÇÃO E PONTO DE REFERÊNCIA
+    pdf.set_font(FONTE_PDF, 'B', 8)
+    pdf.celula(30, 8, "LOGRADOURO:", "LTB", 0, 'L')
+    pdf.set_font(FONTE_PDF, '', 9)
+    pdf.celula(0, 8, clean_text(dados.get('rua', '')), "RB", 1, 'L')
+    
+    pdf.set_font(FONTE_PDF, 'B', 8)
+    pdf.celula(30, 8, "Nº:", "LB", 0, 'L')
+    pdf.set_font(FONTE_PDF, '', 9)
+    pdf.celula(0, 8, clean_text(dados.get('numero', '')), "RB", 1, 'L')
+
+   # --- CAMPO GEOLOCALIZAÇÃO E LINK MAPS ---
+    lat = str(dados.get('latitude', ''))
+    lon = str(dados.get('longitude', ''))
+    link = str(dados.get('link_maps', '')) # Puxa o link do banco de dados
+    
+    geo_texto = f"Lat e Lon: {lat} , {lon}" if lat and lon else "Não informada"
+
+    pdf.set_font(FONTE_PDF, 'B', 8)
+    pdf.celula(35, 8, TXT_GEOLOCALIZACAO, 1, 0, 'L')
+    pdf.set_font(FONTE_PDF, '', 8)
+    pdf.celula(0, 8, clean_text(geo_texto), 1, 1, 'L')
+
+    if link:
+        pdf.set_font(FONTE_PDF, 'B', 8)
+        pdf.celula(35, 8, "LINK MAPS:", 1, 0, 'L')
+        pdf.set_font(FONTE_PDF, '', 7)
+        pdf.set_text_color(0, 0, 255) # Azul para parecer link
+        pdf.celula(0, 8, clean_text(link), 1, 1, 'L', link=link)
+        pdf.set_text_color(0, 0, 0) # Volta para preto
+
+    # --- CAMPO PONTO DE REFERÊNCIA ---
+    pdf.set_font(FONTE_PDF, 'B', 8)
+    pdf.celula(35, 8, TXT_PONTO_REF, 1, 0, 'L')
+    pdf.set_font(FONTE_PDF, '', 8)
+    pdf.celula(0, 8, clean_text(dados.get('ponto_referencia', '')), 1, 1, 'L')
+
+   # 4. ASSINATURAS
+    pdf.ln(5)
+    y_sig = pdf.get_y()
+    if y_sig > 230: pdf.add_page(); y_sig = pdf.get_y()
+
+    pdf.rect(10, y_sig, 130, 18) 
+    pdf.rect(140, y_sig, 60, 18) 
+    
+    pdf.set_fill_color(220, 220, 220) 
+    pdf.set_xy(140, y_sig)
+    pdf.set_font(FONTE_PDF, 'B', 8)
+    pdf.celula(60, 6, "Rubrica", 1, 0, 'C', fill=True)
+
+    pdf.set_xy(12, y_sig + 2)
+    pdf.set_font(FONTE_PDF, 'B', 7)
+    pdf.celula(0, 4, "RECEBIDO POR:", 0, 1)
+    
+    # --- LINHA ADICIONADA PARA PUXAR O NOME ---
+    pdf.set_x(12)
+    pdf.set_font(FONTE_PDF, '', 9)
+    pdf.celula(125, 8, clean_text(dados.get('quem_recebeu', '')), 0, 0, 'L')
+            
+  # 5. INFORMAÇÕES DA FISCALIZAÇÃO
+    pdf.set_xy(10, y_sig + 22)
+    pdf.celula_cinza(TXT_FISCALIZACAO)
+    
+    pdf.set_font(FONTE_PDF, 'B', 8)
+    pdf.celula(90, 10, TXT_DATA_VISTORIA, 1, 0, 'L')
+    pdf.celula(0, 10, "HORA:             ", 1, 1, 'L')
+
+    # Cabeçalho do quadro
+    pdf.set_font(FONTE_PDF, '', 7)
+    pdf.celula(0, 5, TXT_OBSERVACOES, "LR", 1, 'C')
+    
+    # 1. Espaço superior do quadro (Altura total de 95mm - 30mm da rubrica = 65mm)
+    pdf.celula(0, 75, "", "LR", 1, 'L') 
+
+    # 2. Linha da Rubrica (posicionada a 3cm do fundo)
+    pdf.set_font(FONTE_PDF, 'B', 9)
+    # "LR" mantém as bordas laterais abertas para continuar o quadro
+    pdf.celula(0, 5, TXT_RUBRICA, "LR", 1, 'L')
+
+    # 3. Espaço inferior final (os últimos 25mm para fechar o quadro)
+    # "LRB" coloca a linha de baixo que fecha o quadro
+    pdf.celula(0, 15, "", "LRB", 1, 'L') 
+
+def _novo_documento():
+    pdf = OSPDF()
+    pdf.set_auto_page_break(auto=True, margin=25) 
+    return pdf
+
+@medido("gerar_pdf", tamanho=lambda pdf: len(pdf) if isinstance(pdf, bytes) else 0)
+def gerar_pdf(dados):
+    try:
+        pdf = _novo_documento()
+        _desenhar_os(pdf, dados)
+        return bytes(pdf.output())
+    except Exception as e:
+        return str(e)
+
+# ============================================================
+# CACHE DE PDFs
+# ============================================================
+PDF_CACHE_MAX = 256
+
+class LRUCache:
+    """Dicionário limitado: descarta o item usado há mais tempo."""
+
+    def __init__(self, max_itens):
+        self.max_itens = max_itens
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            if chave not in self._dados: return None
+            self._dados.move_to_end(chave)
+            return self._dados[chave]
+
+    def put(self, chave, valor):
+        with self._lock:
+            self._dados[chave] = valor
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.max_itens:
+                self._dados.popitem(last=False)
+
+@st.cache_resource
+def get_pdf_cache():
+    return LRUCache(PDF_CACHE_MAX)
+
+def gerar_pdf_em_cache(dados):
+    """gerar_pdf com cache por (id, conteúdo): baixar de novo uma OS que
+    não mudou não gera outro PDF."""
+    conteudo = repr(sorted((str(k), str(v)) for k, v in dados.items()))
+    chave = (str(dados.get('id', '')), hashlib.sha1(conteudo.encode()).hexdigest())
+    cache = get_pdf_cache()
+    pdf = cache.get(chave)
+    if pdf is None:
+        pdf = gerar_pdf(dados)
+        if isinstance(pdf, bytes):
+            cache.put(chave, pdf)
+    return pdf
+
+def pdf_para_download(gerar, *args):
+    """Chama gerar(*args) para o download_button. gerar_pdf devolve a
+    mensagem de erro como texto; aqui ela vira exceção, e o Streamlit mostra
+    a falha no download em vez de entregar o texto como .pdf."""
+    pdf = gerar(*args)
+    if not isinstance(pdf, bytes):
+        raise RuntimeError(f"Erro ao gerar o PDF: {pdf}")
+    return pdf
+
+# ============================================================
+# EXPORTAÇÃO EM LOTE
+# ============================================================
+EXPORT_WORKERS = 4
+
+def gerar_pdf_lote(registros):
+    """Um único PDF com todas as OS, cada uma começando em página nova."""
+    try:
+        pdf = _novo_documento()
+        for dados in registros:
+            _desenhar_os(pdf, dados)
+        return bytes(pdf.output())
+    except Exception as e:
+        return str(e)
+
+def gerar_zip_lote(registros, workers=EXPORT_WORKERS):
+    """ZIP com um PDF por OS, renderizados em paralelo.
+
+    No máximo 2 * workers PDFs ficam prontos em memória antes de entrar
+    no ZIP, então o consumo não cresce com o tamanho da seleção.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf, \
+         ThreadPoolExecutor(max_workers=workers) as executor:
+        pendentes = deque()
+
+        def gravar_proximo():
+            dados, futuro = pendentes.popleft()
+            pdf = futuro.result()
+            if isinstance(pdf, bytes):
+                ext_id_limpo = str(dados.get('external_id', dados.get('id', ''))).replace('/', '_')
+                zf.writestr(f"OS_{ext_id_limpo}.pdf", pdf)
+
+        for dados in registros:
+            pendentes.append((dados, executor.submit(gerar_pdf_em_cache, dados)))
+            if len(pendentes) >= 2 * workers:
+                gravar_proximo()
+        while pendentes:
+            gravar_proximo()
+    return buffer.getvalue()
+
+# ============================================================
+# CACHE DE LEITURA
+# ============================================================
+CACHE_TTL_SEGUNDOS = 60
+
+class _EntradaCache:
+    def __init__(self, df, versao):
+        self.criado_em = time.monotonic()
+        self.df = df
+        self.versao = versao
+        self.derivados = {}
+
+class ReadCache:
+    """DataFrames por aba, compartilhados entre sessões até expirar o TTL.
+
+    As abas em sem_ttl não expiram: quem as invalida é o Sincronizador
+    (ao_mudar), só quando a planilha traz algo novo. Expirar sem mudança
+    obrigaria a reler o espelho, retipar e remontar os índices à toa.
+
+    Cada carga ou escrita aplicada incrementa a versão da aba. Estruturas
+    derivadas (agregados, índices) ficam presas à entrada e são descartadas
+    junto com ela; as que têm aplicar(antiga, nova) são atualizadas no lugar
+    quando o próprio app grava uma linha.
+    """
+
+    def __init__(self, ttl, tipar=None, sem_ttl=()):
+        self.ttl = ttl
+        self.sem_ttl = frozenset(sem_ttl)
+        self._tipar = tipar or (lambda sheet_name, df: df)
+        self.hits = 0
+        self.misses = 0
+        self._dados = {}
+        self._versoes = {}
+        self._lock = threading.RLock()
+
+    def _entrada(self, sheet_name):
+        item = self._dados.get(sheet_name)
+        if item is not None and (sheet_name in self.sem_ttl or time.monotonic() - item.criado_em < self.ttl):
+            return item
+        return None
+
+    def get(self, sheet_name):
+        with self._lock:
+            item = self._entrada(sheet_name)
+            if item is not None:
+                self.hits += 1
+                return item.df
+            self.misses += 1
+            return None
+
+    def put(self, sheet_name, df):
+        with self._lock:
+            versao = self._versoes.get(sheet_name, 0) + 1
+            self._versoes[sheet_name] = versao
+            self._dados[sheet_name] = _EntradaCache(df, versao)
+
+    def versao(self, sheet_name):
+        with self._lock:
+            item = self._entrada(sheet_name)
+            return item.versao if item is not None else None
+
+    def derivados(self, sheet_name, fabricas):
+        """(df, [fabrica(df), ...]) da mesma versão da aba, cada derivado
+        calculado uma vez por versão; None se a aba não está no cache."""
+        with self._lock:
+            item = self._entrada(sheet_name)
+            if item is None:
+                return None
+            for nome, fabrica in fabricas.items():
+                if nome not in item.derivados:
+                    item.derivados[nome] = fabrica(item.df)
+            return item.df, [item.derivados[nome] for nome in fabricas]
+
+    def invalidate(self, sheet_name=None):
+        with self._lock:
+            if sheet_name is None:
+                self._dados.clear()
+            else:
+                self._dados.pop(sheet_name, None)
+
+    # --- Escritas feitas pelo próprio app (write-through) ---
+    def aplicar_insercao(self, sheet_name, linha):
+        with self._lock:
+            item = self._entrada(sheet_name)
+            if item is None: return
+            nova = {c: linha.get(c, '') for c in item.df.columns}
+            df = item.df.copy()
+            linha_df = self._linha_tipada(sheet_name, df, nova)
+            df = pd.concat([df, linha_df], ignore_index=True)
+            self._substituir(sheet_name, item, df, [(None, nova)])
+
+    def aplicar_alteracao(self, sheet_name, coluna_chave, valor_chave, alteracoes):
+        with self._lock:
+            item = self._entrada(sheet_name)
+            if item is None: return
+            posicoes = self._posicoes(item.df, coluna_chave, valor_chave)
+            colunas = {str(c).strip().replace(' ', '_'): c for c in item.df.columns}
+            df = item.df.copy()
+            mudancas = []
+            for pos in posicoes:
+                antiga = df.iloc[pos].to_dict()
+                nova = dict(antiga)
+                alteradas = []
+                for campo, valor in alteracoes.items():
+                    coluna = colunas.get(str(campo).strip().replace(' ', '_'))
+                    if coluna is not None:
+                        nova[coluna] = valor
+                        alteradas.append(coluna)
+                linha_df = self._linha_tipada(sheet_name, df, nova)
+                for coluna in alteradas:
+                    j = df.columns.get_loc(coluna)
+                    df.iat[pos, j] = linha_df.iat[0, j]
+                mudancas.append((antiga, df.iloc[pos].to_dict()))
+            self._substituir(sheet_name, item, df, mudancas)
+
+    def aplicar_exclusao(self, sheet_name, coluna_chave, valor_chave):
+        with self._lock:
+            item = self._entrada(sheet_name)
+            if item is None: return
+            posicoes = self._posicoes(item.df, coluna_chave, valor_chave)
+            mudancas = [(item.df.iloc[pos].to_dict(), None) for pos in posicoes]
+            df = item.df.drop(item.df.index[posicoes]).reset_index(drop=True)
+            self._substituir(sheet_name, item, df, mudancas)
+
+    def _linha_tipada(self, sheet_name, df, linha):
+        """Linha como DataFrame com os mesmos tipos de df. Valores novos nas
+        colunas categóricas viram categorias de df (alterado no lugar)."""
+        linha_df = self._tipar(sheet_name, pd.DataFrame([linha], columns=df.columns))
+        for coluna in df.columns:
+            if isinstance(df[coluna].dtype, pd.CategoricalDtype):
+                valor = linha_df[coluna].astype(str)
+                novas = [v for v in valor.unique() if v not in df[coluna].cat.categories]
+                if novas:
+                    df[coluna] = df[coluna].cat.add_categories(novas)
+                linha_df[coluna] = pd.Categorical(valor, categories=df[coluna].cat.categories)
+        return linha_df
+
+    @staticmethod
+    def _posicoes(df, coluna_chave, valor_chave):
+        if coluna_chave not in df.columns: return []
+        mascara = df[coluna_chave].astype(str).str.strip() == str(valor_chave).strip()
+        return list(mascara.to_numpy().nonzero()[0])
+
+    def _substituir(self, sheet_name, item, df, mudancas):
+        versao = self._versoes.get(sheet_name, 0) + 1
+        self._versoes[sheet_name] = versao
+        nova = _EntradaCache(df, versao)
+        nova.criado_em = item.criado_em # não renova o TTL: mudanças externas continuam aparecendo
+        for nome, derivado in item.derivados.items():
+            if hasattr(derivado, 'aplicar'):
+                for antiga, atual in mudancas:
+                    derivado.aplicar(antiga, atual)
+                nova.derivados[nome] = derivado
+        self._dados[sheet_name] = nova
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "abas": sorted(self._dados)}
+
+@st.cache_resource
+def get_read_cache():
+    # cache_resource mantém a mesma instância entre reruns e sessões do processo
+    return ReadCache(float(st.secrets.get("cache_ttl_segundos", CACHE_TTL_SEGUNDOS)), tipar=tipar_df,
+                     sem_ttl=ABAS_ESPELHADAS)
+
+# ============================================================
+# FUNÇÕES DE BANCO DE DADOS
+# ============================================================
+def get_worksheet(sheet_name):
+    return SheetsClient.get_worksheet(sheet_name)
+
+def _aba_obsoleta(erro):
+    """Só WorksheetNotFound e 400/404 (faixa ou aba inexistente) indicam aba
+    em cache obsoleta. 429 e 5xx não: repetir na hora só gasta mais cota, e
+    um append_row que falhou no servidor pode ter sido gravado."""
+    if isinstance(erro, WorksheetNotFound): return True
+    return isinstance(erro, gspread.exceptions.APIError) and erro.code in (400, 404)
+
+def _na_aba(sheet_name, operacao):
+    """Executa operacao(ws). Se a aba em cache estiver obsoleta (apagada ou
+    renomeada na planilha), reabre a aba e tenta mais uma vez."""
+    ws = get_worksheet(sheet_name)
+    if not ws: return None
+    try:
+        return operacao(ws)
+    except (WorksheetNotFound, gspread.exceptions.APIError) as e:
+        if not _aba_obsoleta(e): raise
+        SheetsClient.invalidate(sheet_name)
+        ws = get_worksheet(sheet_name)
+        return operacao(ws) if ws else None
+
+LINHAS_POR_BLOCO = 5000
+
+def ler_blocos(ws, num_colunas, linhas=LINHAS_POR_BLOCO, inicio=2):
+    """Linhas de dados da aba (a partir da linha inicio) em blocos de
+    get_values por faixa (A2:Q5001, A5002:Q10001...), para não montar a aba
+    inteira de uma vez."""
+    ultima = gspread.utils.rowcol_to_a1(1, max(1, num_colunas)).rstrip('0123456789')
+    while True:
+        fim = inicio + linhas - 1
+        bloco = ws.get_values(f"A{inicio}:{ultima}{fim}")
+        if bloco:
+            yield bloco
+        if len(bloco) < linhas: break
+        inicio = fim + 1
+
+def ler_colunas(ws, headers, colunas=None, linhas=LINHAS_POR_BLOCO):
+    """DataFrame só com as colunas pedidas (todas se None), baixadas coluna a
+    coluna por bloco de linhas (batch_get em COLUMNS) e acumuladas direto em
+    listas por coluna, sem passar por uma lista de dicionários."""
+    indices = [i for i, h in enumerate(headers) if h and (colunas is None or h in colunas)]
+    if not indices: return pd.DataFrame()
+    letras = [gspread.utils.rowcol_to_a1(1, i + 1).rstrip('0123456789') for i in indices]
+    dados = {headers[i]: [] for i in indices}
+    inicio = 2
+    while True:
+        fim = inicio + linhas - 1
+        faixas = ws.batch_get([f"{letra}{inicio}:{letra}{fim}" for letra in letras], major_dimension='COLUMNS')
+        valores = [faixa[0] if faixa else [] for faixa in faixas]
+        tamanho = max((len(v) for v in valores), default=0)
+        for i, v in zip(indices, valores):
+            # Células vazias no fim da coluna não vêm na resposta
+            dados[headers[i]].extend(_como_lido(x) for x in v)
+            dados[headers[i]].extend([''] * (tamanho - len(v)))
+        if tamanho < linhas: break
+        inicio = fim + 1
+    return pd.DataFrame(dados)
+
+@medido("carregar_df")
+def _carregar_df(sheet_name):
+    """DataFrame da aba direto do cache (somente leitura)."""
+    cache = get_read_cache()
+    df = cache.get(sheet_name)
+    if df is None:
+        if sheet_name in ABAS_ESPELHADAS:
+            # Lê do espelho local; a planilha só é consultada na primeira vez
+            espelho = get_espelho()
+            df = espelho.ler(sheet_name)
+            if df is None:
+                _na_aba(sheet_name, lambda ws: get_sincronizador().puxar(sheet_name))
+                df = espelho.ler(sheet_name)
+            if df is None: return pd.DataFrame()
+        else:
+            df = _na_aba(sheet_name, lambda ws: ler_colunas(ws, ws.row_values(1)))
+            if df is None: return pd.DataFrame()
+        # Aproveita a leitura para detectar mudança de cabeçalho
+        if len(df.columns) and list(df.columns) != SheetsClient.get_headers(sheet_name):
+            SheetsClient.set_headers(sheet_name, df.columns)
+        df = tipar_df(sheet_name, df)
+        cache.put(sheet_name, df)
+    return df
+
+def _tamanho_df(df):
+    return int(df.memory_usage(deep=False).sum())
+
+@medido("load_data", tamanho=_tamanho_df)
+def load_data(sheet_name, colunas=None):
+    """Cópia do DataFrame da aba, para que as páginas possam alterar o frame
+    sem sujar o cache. Com colunas, traz só essas: do frame em cache se ele
+    existir, senão do espelho ou da planilha, sem carregar o resto."""
+    if colunas is None:
+        return _carregar_df(sheet_name).copy()
+    df = get_read_cache().get(sheet_name)
+    if df is not None:
+        return df[[c for c in colunas if c in df.columns]].copy()
+    if sheet_name in ABAS_ESPELHADAS and get_espelho().headers(sheet_name) is not None:
+        df = get_espelho().ler(sheet_name, colunas)
+    else:
+        headers = SheetsClient.get_headers(sheet_name)
+        df = _na_aba(sheet_name, lambda ws: ler_colunas(ws, headers, colunas)) if headers else None
+    return tipar_df(sheet_name, df) if df is not None else pd.DataFrame()
+
+def obter_derivados(sheet_name, fabricas):
+    """(df, [derivados]): o DataFrame da aba e as estruturas derivadas dele
+    (agregados, índices...) lidos juntos, todos da mesma versão dos dados.
+    fabricas é {nome: fabrica}; cada uma roda uma vez por versão."""
+    df = _carregar_df(sheet_name)
+    achado = get_read_cache().derivados(sheet_name, fabricas)
+    if achado is None:
+        # A aba saiu do cache entre as duas leituras
+        return df, [fabrica(df) for fabrica in fabricas.values()]
+    return achado
+
+def obter_derivado(sheet_name, nome, fabrica):
+    """(df, fabrica(df)) da mesma versão da aba."""
+    df, (derivado,) = obter_derivados(sheet_name, {nome: fabrica})
+    return df, derivado
+
+def tipar_df(sheet_name, df):
+    """Converte as colunas da aba listadas em TIPOS_POR_ABA para tipos
+    compactos (categóricas, Int64, float, datetime). Altera df no lugar."""
+    for coluna, tipo in TIPOS_POR_ABA.get(sheet_name, {}).items():
+        if coluna not in df.columns: continue
+        serie = df[coluna]
+        if isinstance(tipo, list):
+            texto = serie.astype(str)
+            extras = sorted(set(texto.unique()) - set(tipo))
+            df[coluna] = pd.Categorical(texto, categories=list(tipo) + extras)
+        elif tipo == 'datetime':
+            df[coluna] = _parse_datas(serie)
+        else:
+            if tipo.startswith('float'):
+                # Vírgula decimal digitada à mão ("-8,2835"), como em CandidatosDuplicata.buscar
+                serie = serie.astype(str).str.replace(',', '.', regex=False)
+            numeros = pd.to_numeric(serie, errors='coerce')
+            if tipo == 'Int64':
+                numeros = numeros.where(numeros == numeros.round())
+            df[coluna] = numeros.astype(tipo)
+    return df
+
+def registros_de(df):
+    """Linhas do DataFrame tipado como dicionários com os textos da planilha
+    (é o que gerar_pdf e o cache de PDFs esperam): vazio para NaN/NaT e
+    float com todos os dígitos lidos da planilha."""
+    colunas = {}
+    for coluna in df.columns:
+        serie = df[coluna]
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            serie = serie.dt.strftime("%Y-%m-%d %H:%M:%S")
+        elif pd.api.types.is_float_dtype(serie):
+            serie = serie.astype(str).where(serie.notna())
+        colunas[coluna] = serie.astype(object).where(serie.notna(), '')
+    return pd.DataFrame(colunas, index=df.index).to_dict('records')
+
+def _como_lido(valor):
+    """Valor como o get_all_records devolveria depois de gravado."""
+    return gspread.utils.numericise(str(valor), default_blank='')
+
+@medido("salvar_dados_seguro")
+def salvar_dados_seguro(sheet_name, row_dict):
+    """Grava uma linha nova na aba.
+
+    Nas abas espelhadas a linha entra na fila local e volta na hora; o
+    Sincronizador envia as linhas acumuladas num único append_rows.
+    """
+    if sheet_name in ABAS_ESPELHADAS:
+        _carregar_df(sheet_name) # garante o espelho da aba
+    headers = SheetsClient.get_headers(sheet_name)
+    if not headers:
+        headers = _schema_padrao(sheet_name)
+        _na_aba(sheet_name, lambda ws: ws.append_row(headers))
+        SheetsClient.set_headers(sheet_name, headers)
+    
+    values = []
+    for h in headers:
+        val = row_dict.get(h, '') 
+        values.append(str(val))
+    linha = {h: _como_lido(v) for h, v in zip(headers, values)}
+    if sheet_name in ABAS_ESPELHADAS:
+        get_espelho().enfileirar_insercao(sheet_name, values, linha)
+        get_sincronizador().acordar()
+    else:
+        _na_aba(sheet_name, lambda ws: ws.append_row(values))
+    get_read_cache().aplicar_insercao(sheet_name, linha)
+
+@medido("update_full_sheet")
+def update_full_sheet(sheet_name, df):
+    df_clean = df.fillna('')
+    valores = [df_clean.columns.tolist()] + df_clean.values.tolist()
+
+    def _gravar(ws):
+        # Escreve por cima primeiro e só depois limpa as linhas que sobraram,
+        # assim uma falha no meio do caminho nunca deixa a aba vazia.
+        ws.update(valores)
+        if ws.row_count > len(valores):
+            fim = gspread.utils.rowcol_to_a1(ws.row_count, ws.col_count)
+            ws.batch_clear([f"A{len(valores) + 1}:{fim}"])
+
+    _na_aba(sheet_name, _gravar)
+    SheetsClient.set_headers(sheet_name, df_clean.columns)
+    if sheet_name in ABAS_ESPELHADAS:
+        get_espelho().substituir(sheet_name, valores[0], [[[str(v) for v in linha] for linha in valores[1:]]])
+    get_read_cache().invalidate(sheet_name)
+
+# ============================================================
+# ATUALIZAÇÃO POR LINHA (SEM REESCREVER A ABA INTEIRA)
+# ============================================================
+def _schema_padrao(sheet_name):
+    if sheet_name == SHEET_DENUNCIAS: return DENUNCIA_SCHEMA
+    if sheet_name == SHEET_REINCIDENCIAS: return REINCIDENCIA_SCHEMA
+    if sheet_name == SHEET_USUARIOS: return ["username", "password", "name", "role"]
+    return []
+
+def _indice_coluna(headers, campo):
+    """Posição (1-based) do campo no cabeçalho; aceita 'link_maps' para 'link maps'."""
+    normalizados = [str(h).strip().replace(' ', '_') for h in headers]
+    campo = str(campo).strip().replace(' ', '_')
+    return normalizados.index(campo) + 1 if campo in normalizados else None
+
+class MapaLinhas:
+    """Valor da coluna chave -> número da linha na planilha, por aba e
+    coluna, montado a partir de um col_values. Quem usa confere a célula
+    antes de gravar: se a linha mudou de lugar, a coluna é relida."""
+
+    def __init__(self):
+        self._mapas = {}
+        self._lock = threading.Lock()
+
+    def obter(self, aba, col, valor):
+        with self._lock:
+            return self._mapas.get((aba, col), {}).get(valor)
+
+    def montar(self, aba, col, valores):
+        mapa = {}
+        for i, valor in enumerate(valores[1:], start=2):
+            mapa.setdefault(str(valor).strip(), i)
+        with self._lock:
+            self._mapas[(aba, col)] = mapa
+        return mapa
+
+    def invalidar(self, aba):
+        with self._lock:
+            for chave in [c for c in self._mapas if c[0] == aba]:
+                del self._mapas[chave]
+
+@st.cache_resource
+def get_mapa_linhas():
+    return MapaLinhas()
+
+def localizar_linha(ws, headers, valor_chave, coluna_chave='id'):
+    """Número da linha (1-based) cujo valor na coluna chave é igual a valor_chave.
+
+    Usa o MapaLinhas: uma leitura de célula para conferir a posição em vez
+    de baixar a coluna inteira a cada gravação.
+    """
+    col = _indice_coluna(headers, coluna_chave)
+    if col is None: return None
+    alvo = str(valor_chave).strip()
+    mapa = get_mapa_linhas()
+    linha = mapa.obter(ws.title, col, alvo)
+    if linha is not None and str(ws.cell(linha, col).value or '').strip() == alvo:
+        return linha
+    return mapa.montar(ws.title, col, ws.col_values(col)).get(alvo)
+
+def _mesmo_valor(a, b):
+    return str(_como_lido(a)) == str(_como_lido(b))
+
+def _conferir_esperado(linha, esperado, descricao):
+    """ConflitoEscrita se algum campo de linha ({campo: valor}) não tem
+    mais o valor esperado."""
+    atual = {str(c).strip().replace(' ', '_'): v for c, v in linha.items()}
+    for campo, valor in esperado.items():
+        if not _mesmo_valor(atual.get(str(campo).strip().replace(' ', '_'), ''), valor):
+            raise ConflitoEscrita(f"{descricao} foi alterado por outra pessoa ({campo})")
+
+class ConflitoEscrita(Exception):
+    """A linha mudou na planilha desde que a alteração local foi feita."""
+
+def _gravar_alteracao(ws, headers, valor_chave, alteracoes, coluna_chave='id', versao_base=None, esperado=None):
+    """Grava só as células alteradas da linha da chave.
+
+    Com versao_base, confere antes se a linha na planilha ainda é a mesma;
+    com esperado ({campo: valor}), se esses campos ainda têm esses valores
+    (ConflitoEscrita se não for). Retorna a versão da linha depois da
+    gravação, ou None se a chave não existir.
+    """
+    linha = localizar_linha(ws, headers, valor_chave, coluna_chave)
+    if linha is None: return None
+
+    atual = None
+    if versao_base or esperado:
+        atual = ws.row_values(linha)
+        if versao_base and _versao_linha(atual) != versao_base:
+            raise ConflitoEscrita(f"{coluna_chave}={valor_chave} foi alterado por outra pessoa")
+        if esperado:
+            _conferir_esperado(dict(zip(headers, atual + [''] * (len(headers) - len(atual)))),
+                               esperado, f"{coluna_chave}={valor_chave}")
+
+    lote = []
+    for campo, valor in alteracoes.items():
+        col = _indice_coluna(headers, campo)
+        if col is None: continue
+        lote.append({"range": gspread.utils.rowcol_to_a1(linha, col), "values": [[str(valor)]]})
+        if atual is not None:
+            atual += [''] * (col - len(atual))
+            atual[col - 1] = str(valor)
+    if lote:
+        ws.batch_update(lote)
+    return _versao_linha(atual) if atual is not None else ''
+
+def _gravar_exclusao(ws, headers, valor_chave, coluna_chave='id', versao_base=None):
+    linha = localizar_linha(ws, headers, valor_chave, coluna_chave)
+    if linha is None: return False
+    if versao_base and _versao_linha(ws.row_values(linha)) != versao_base:
+        raise ConflitoEscrita(f"{coluna_chave}={valor_chave} foi alterado por outra pessoa")
+    ws.delete_rows(linha)
+    get_mapa_linhas().invalidar(ws.title) # as linhas de baixo subiram
+    return True
+
+def atualizar_registro(sheet_name, valor_chave, alteracoes, coluna_chave='id', esperado=None, direto=False):
+    """Altera apenas os campos informados da linha identificada pela chave.
+
+    Nas abas espelhadas a alteração vale na hora para o app e vai para a
+    planilha pela fila do Sincronizador. Retorna False se o registro não
+    for encontrado.
+
+    esperado ({campo: valor como foi lido}) torna a alteração otimista: se
+    a linha já não tem esses valores, nada é gravado e sobe ConflitoEscrita.
+    Assim duas edições da mesma linha não se sobrescrevem.
+
+    direto=True grava (e confere esperado) na planilha na hora, mesmo numa
+    aba espelhada: na fila, a conferência seria contra o espelho, que pode
+    estar um intervalo de sincronização atrás, e o conflito só apareceria
+    depois de o usuário ver a gravação como feita.
+    """
+    if sheet_name in ABAS_ESPELHADAS and not direto:
+        _carregar_df(sheet_name) # garante o espelho da aba
+        conferir = (lambda linha: _conferir_esperado(linha, esperado, f"{coluna_chave}={valor_chave}")) \
+            if esperado else None
+        if not get_espelho().enfileirar(sheet_name, 'alterar', coluna_chave, valor_chave,
+                                        {k: _como_lido(v) for k, v in alteracoes.items()}, conferir):
+            return False
+        get_sincronizador().acordar()
+    else:
+        headers = SheetsClient.get_headers(sheet_name) or _schema_padrao(sheet_name)
+        versao = _na_aba(sheet_name, lambda ws: _gravar_alteracao(ws, headers, valor_chave, alteracoes,
+                                                                   coluna_chave, esperado=esperado))
+        if versao is None:
+            return False
+        if sheet_name in ABAS_ESPELHADAS:
+            get_espelho().aplicar_alteracao(sheet_name, coluna_chave, valor_chave,
+                                            {k: _como_lido(v) for k, v in alteracoes.items()}, versao)
+    get_read_cache().aplicar_alteracao(sheet_name, coluna_chave, valor_chave,
+                                       {k: _como_lido(v) for k, v in alteracoes.items()})
+    return True
+
+def excluir_registro(sheet_name, valor_chave, coluna_chave='id'):
+    """Remove uma única linha da aba. Retorna False se a chave não existir."""
+    if sheet_name in ABAS_ESPELHADAS:
+        _carregar_df(sheet_name)
+        if not get_espelho().enfileirar(sheet_name, 'excluir', coluna_chave, valor_chave):
+            return False
+        get_sincronizador().acordar()
+    else:
+        ws = get_worksheet(sheet_name)
+        headers = SheetsClient.get_headers(sheet_name) or _schema_padrao(sheet_name)
+        if not _gravar_exclusao(ws, headers, valor_chave, coluna_chave):
+            return False
+    get_read_cache().aplicar_exclusao(sheet_name, coluna_chave, valor_chave)
+    return True
+
+# ============================================================
+# ESPELHO LOCAL (SQLITE) E SINCRONIZAÇÃO
+# ============================================================
+ESPELHO_PATH_PADRAO = "urb_espelho.db"
+SYNC_INTERVALO_SEGUNDOS = 30
+SYNC_COMPLETO_SEGUNDOS = 600 # entre cargas completas (edições feitas direto na planilha)
+MAX_TENTATIVAS_FILA = 8
+BACKOFF_BASE_SEGUNDOS = 2
+BACKOFF_MAX_SEGUNDOS = 300
+LOTE_INSERCAO_MAX = 500
+ABAS_ESPELHADAS = [SHEET_DENUNCIAS, SHEET_REINCIDENCIAS, SHEET_USUARIOS]
+INDICES_ESPELHO = {
+    SHEET_DENUNCIAS: ['id', 'external_id', 'status', 'zona'],
+    SHEET_REINCIDENCIAS: ['external_id'],
+    SHEET_USUARIOS: ['username'],
+}
+# Colunas de texto livre com busca FTS5 (mantida por triggers no espelho)
+BUSCA_TEXTO = {
+    SHEET_DENUNCIAS: ['descricao', 'ponto_referencia', 'rua'],
+    SHEET_REINCIDENCIAS: ['descricao'],
+}
+
+def _versao_linha(valores):
+    """Versão de uma linha: hash do conteúdo bruto (texto) das células."""
+    valores = [str(v) for v in valores]
+    while valores and valores[-1] == '':
+        valores.pop()
+    return hashlib.sha1('\x1f'.join(valores).encode()).hexdigest()
+
+def _encadear(assinatura, versao):
+    """Assinatura da aba até esta linha. Encadeada, pode ser continuada a
+    partir da última linha conhecida quando só chegam linhas novas."""
+    return hashlib.sha1((assinatura + versao).encode()).hexdigest()
+
+def _sql_nome(nome):
+    return '"' + str(nome).replace('"', '""') + '"'
+
+class LocalMirror:
+    """Cópia local das abas em SQLite e fila das escritas ainda não enviadas.
+
+    Cada aba vira uma tabela com as colunas do cabeçalho e mais _versao
+    (hash da linha como estava na planilha na última sincronização), usada
+    para detectar conflitos ao enviar a fila.
+    """
+
+    def __init__(self, caminho):
+        self._conn = sqlite3.connect(caminho, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._lock_carga = threading.Lock() # uma carga completa por vez (tabela _carga_*)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS _sync (aba TEXT PRIMARY KEY, headers TEXT, "
+                               "assinatura TEXT, sincronizado_em REAL)")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS _fila (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, aba TEXT, operacao TEXT, coluna_chave TEXT,
+                valor_chave TEXT, dados TEXT, versao_base TEXT, criado_em REAL,
+                tentativas INTEGER DEFAULT 0, status TEXT DEFAULT 'pendente', erro TEXT,
+                proxima_tentativa REAL DEFAULT 0)""")
+            colunas_sync = [c[1] for c in self._conn.execute("PRAGMA table_info(_sync)")]
+            for coluna, tipo in (('linhas', 'INTEGER'), ('ultima_versao', 'TEXT'), ('completo_em', 'REAL')):
+                if coluna not in colunas_sync:
+                    # Espelhos criados antes da sincronização incremental
+                    self._conn.execute(f"ALTER TABLE _sync ADD COLUMN {coluna} {tipo}")
+            colunas_fila = [c[1] for c in self._conn.execute("PRAGMA table_info(_fila)")]
+            if 'proxima_tentativa' not in colunas_fila:
+                # Espelhos criados antes do backoff
+                self._conn.execute("ALTER TABLE _fila ADD COLUMN proxima_tentativa REAL DEFAULT 0")
+            for aba in BUSCA_TEXTO:
+                # Espelhos criados antes da busca de texto
+                headers = self.headers(aba)
+                existe = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?",
+                                            (f"_busca_{aba}",)).fetchone()
+                if headers is not None and not existe:
+                    self._criar_busca(aba, headers)
+
+    # --- Tabelas espelhadas ---
+    def headers(self, aba):
+        with self._lock:
+            linha = self._conn.execute("SELECT headers FROM _sync WHERE aba = ?", (aba,)).fetchone()
+            return json.loads(linha[0]) if linha else None
+
+    def substituir(self, aba, headers, blocos, forcar=False, conhecidas=()):
+        """Troca o conteúdo da tabela pelas linhas brutas (texto) da planilha.
+
+        blocos é um iterável de listas de linhas (ver ler_blocos): cada bloco
+        vai para uma tabela de carga assim que chega, então a aba inteira
+        nunca fica na memória.
+
+        Retorna None se a planilha não mudou desde a última sincronização (a
+        tabela fica como está, a não ser com forcar). Senão troca a tabela e
+        retorna False quando a planilha só difere do espelho pelas escritas do
+        próprio app (as mesmas versões, na mesma ordem, mais as inserções
+        enviadas cujas versões estão em conhecidas), True quando mudou algo
+        que o app ainda não tem.
+        """
+        headers = [str(h) for h in headers]
+        carga = _sql_nome(f"_carga_{aba}")
+        colunas = ", ".join(_sql_nome(h) for h in headers + ['_versao'])
+        marcas = ", ".join("?" * (len(headers) + 1))
+        with self._lock_carga:
+            return self._carregar(aba, headers, blocos, carga, colunas, marcas, forcar, conhecidas)
+
+    @staticmethod
+    def _preparar(headers, bloco, marca):
+        """Linhas brutas -> registros da tabela, continuando a marca d'água
+        (quantidade de linhas, versão da última e assinatura encadeada)."""
+        linhas, ultima_versao, assinatura = marca
+        registros = []
+        for valores in bloco:
+            valores = list(valores) + [''] * (len(headers) - len(valores))
+            ultima_versao = _versao_linha(valores)
+            assinatura = _encadear(assinatura, ultima_versao)
+            registros.append([_como_lido(v) for v in valores[:len(headers)]] + [ultima_versao])
+        return registros, (linhas + len(registros), ultima_versao, assinatura)
+
+    def _carregar(self, aba, headers, blocos, carga, colunas, marcas, forcar, conhecidas):
+        with self._lock, self._conn:
+            self._conn.execute(f"DROP TABLE IF EXISTS {carga}")
+            self._conn.execute(f"CREATE TEMP TABLE {carga} ({colunas})")
+        marca = (0, None, hashlib.sha1(json.dumps(headers).encode()).hexdigest())
+        for bloco in blocos:
+            registros, marca = self._preparar(headers, bloco, marca)
+            # Um bloco por vez: leituras de outras sessões não esperam o download inteiro
+            with self._lock, self._conn:
+                self._conn.executemany(f"INSERT INTO {carga} ({colunas}) VALUES ({marcas})", registros)
+        linhas, ultima_versao, assinatura = marca
+        agora = time.time()
+
+        with self._lock, self._conn:
+            atual = self._conn.execute("SELECT headers, assinatura FROM _sync WHERE aba = ?", (aba,)).fetchone()
+            if atual and atual[1] == assinatura and not forcar:
+                self._conn.execute(f"DROP TABLE {carga}")
+                self._conn.execute("UPDATE _sync SET sincronizado_em = ?, completo_em = ?, linhas = ?, "
+                                   "ultima_versao = ? WHERE aba = ?", (agora, agora, linhas, ultima_versao, aba))
+                return None
+            mudou = forcar or not atual or json.loads(atual[0]) != headers
+            if mudou:
+                self._criar_tabela(aba, headers)
+            else:
+                mudou = not self._so_escritas_proprias(aba, carga, conhecidas)
+            # Carga completa: a busca é refeita de uma vez no fim, sem os triggers linha a linha
+            self._remover_busca(aba)
+            self._conn.execute(f"DELETE FROM {_sql_nome(aba)}")
+            self._conn.execute(f"INSERT INTO {_sql_nome(aba)} ({colunas}) SELECT {colunas} FROM {carga} ORDER BY rowid")
+            self._conn.execute(f"DROP TABLE {carga}")
+            if aba in BUSCA_TEXTO:
+                self._criar_busca(aba, headers)
+            self._conn.execute("INSERT OR REPLACE INTO _sync (aba, headers, assinatura, sincronizado_em, "
+                               "linhas, ultima_versao, completo_em) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (aba, json.dumps(headers), assinatura, agora, linhas, ultima_versao, agora))
+        return mudou
+
+    def _so_escritas_proprias(self, aba, carga, conhecidas):
+        """Se a carga é o espelho atual: as linhas com versão na mesma ordem
+        (alterações e exclusões do app já estão aplicadas nele) e, a mais,
+        só as inserções enviadas pelo app (no espelho ainda sem versão)."""
+        enviadas = Counter(conhecidas)
+        planilha = []
+        for (versao,) in self._conn.execute(f"SELECT _versao FROM {carga} ORDER BY rowid"):
+            if enviadas[versao] > 0:
+                enviadas[versao] -= 1
+            else:
+                planilha.append(versao)
+        espelho = [versao for (versao,) in self._conn.execute(
+            f"SELECT _versao FROM {_sql_nome(aba)} WHERE _versao IS NOT NULL ORDER BY rowid")]
+        return planilha == espelho
+
+    def marca_dagua(self, aba):
+        """Estado da última sincronização da aba (None se nunca sincronizou)."""
+        with self._lock:
+            linha = self._conn.execute("SELECT headers, linhas, ultima_versao, assinatura, completo_em "
+                                       "FROM _sync WHERE aba = ?", (aba,)).fetchone()
+        if not linha or linha[1] is None: return None
+        return {"headers": json.loads(linha[0]), "linhas": linha[1], "ultima_versao": linha[2],
+                "assinatura": linha[3], "completo_em": linha[4] or 0}
+
+    def acrescentar(self, aba, headers, bloco, marca):
+        """Delta: linhas novas do fim da aba, depois da marca d'água.
+
+        As cópias locais de inserções (linhas sem _versao) saem: as já
+        enviadas voltam aqui com a versão da planilha, e as ainda na fila
+        são recolocadas por reaplicar_pendentes().
+        """
+        headers = [str(h) for h in headers]
+        registros, (linhas, ultima_versao, assinatura) = self._preparar(
+            headers, bloco, (marca["linhas"], marca["ultima_versao"], marca["assinatura"]))
+        colunas = ", ".join(_sql_nome(h) for h in headers + ['_versao'])
+        marcas = ", ".join("?" * (len(headers) + 1))
+        with self._lock_carga, self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {_sql_nome(aba)} WHERE _versao IS NULL")
+            self._conn.executemany(f"INSERT INTO {_sql_nome(aba)} ({colunas}) VALUES ({marcas})", registros)
+            self._conn.execute("UPDATE _sync SET assinatura = ?, sincronizado_em = ?, linhas = ?, ultima_versao = ? "
+                               "WHERE aba = ?", (assinatura, time.time(), linhas, ultima_versao, aba))
+
+    def marcar_sincronizado(self, aba):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE _sync SET sincronizado_em = ? WHERE aba = ?", (time.time(), aba))
+
+    def _criar_tabela(self, aba, headers):
+        self._conn.execute(f"DROP TABLE IF EXISTS {_sql_nome(aba)}")
+        # Colunas sem tipo: o SQLite guarda int/float/texto como vieram
+        colunas = ", ".join(_sql_nome(h) for h in headers + ['_versao'])
+        self._conn.execute(f"CREATE TABLE {_sql_nome(aba)} ({colunas})")
+        for coluna in INDICES_ESPELHO.get(aba, []):
+            if coluna in headers:
+                self._conn.execute(f"CREATE INDEX {_sql_nome(f'ix_{aba}_{coluna}')} "
+                                   f"ON {_sql_nome(aba)} ({_sql_nome(coluna)})")
+
+    def _remover_busca(self, aba):
+        for nome in ('ai', 'ad', 'au'):
+            self._conn.execute(f"DROP TRIGGER IF EXISTS {_sql_nome(f'_busca_{aba}_{nome}')}")
+        self._conn.execute(f"DROP TABLE IF EXISTS {_sql_nome(f'_busca_{aba}')}")
+
+    def _criar_busca(self, aba, headers):
+        """Tabela FTS5 sobre as colunas de texto da aba. Os triggers a mantêm
+        em dia a cada INSERT/UPDATE/DELETE feito pela fila ou pelo app, sem
+        reconstruir o índice."""
+        self._remover_busca(aba)
+        busca = _sql_nome(f"_busca_{aba}")
+        colunas = [c for c in BUSCA_TEXTO[aba] if c in headers]
+        if not colunas: return
+        lista = ", ".join(_sql_nome(c) for c in colunas)
+        novos = ", ".join(f"new.{_sql_nome(c)}" for c in colunas)
+        antigos = ", ".join(f"old.{_sql_nome(c)}" for c in colunas)
+        self._conn.execute(f"CREATE VIRTUAL TABLE {busca} USING fts5({lista}, content={_sql_nome(aba)}, "
+                           f"tokenize='unicode61 remove_diacritics 2')")
+        inserir = f"INSERT INTO {busca} (rowid, {lista}) VALUES (new.rowid, {novos});"
+        remover = f"INSERT INTO {busca} ({busca}, rowid, {lista}) VALUES ('delete', old.rowid, {antigos});"
+        for nome, evento, corpo in (('ai', 'INSERT', inserir), ('ad', 'DELETE', remover),
+                                    ('au', 'UPDATE', remover + inserir)):
+            self._conn.execute(f"CREATE TRIGGER {_sql_nome(f'_busca_{aba}_{nome}')} AFTER {evento} "
+                               f"ON {_sql_nome(aba)} BEGIN {corpo} END")
+        self._conn.execute(f"INSERT INTO {busca} ({busca}) VALUES ('rebuild')")
+
+    def pesquisar(self, consulta):
+        """Busca de texto nas denúncias e nas reincidências.
+
+        Cada palavra digitada vale como prefixo (sem acento/maiúscula) e todas
+        precisam aparecer no mesmo registro. Retorna os external_ids da
+        denúncia mais relevante para a menos relevante (bm25); uma
+        reincidência conta para a denúncia de mesmo external_id. Vêm todos,
+        sem corte: os outros filtros do Histórico são aplicados depois, e um
+        limite aqui esconderia registros que passam neles. O destaque de
+        cada um sai de trechos(), só para a página exibida.
+        """
+        melhores = self._buscar_texto(consulta, "", ())
+        return sorted(melhores, key=lambda chave: melhores[chave][0])
+
+    def trechos(self, consulta, external_ids):
+        """{external_id: trecho com as palavras destacadas} da busca, só
+        para os external_ids pedidos."""
+        chaves = {str(e).strip() for e in external_ids}
+        if not chaves: return {}
+        valores = list(chaves) + [v for v in map(_como_lido, chaves) if not isinstance(v, str)]
+        filtro = f" AND t.external_id IN ({', '.join('?' * len(valores))})"
+        return {chave: trecho for chave, (_, trecho) in self._buscar_texto(consulta, filtro, valores).items()}
+
+    def _buscar_texto(self, consulta, filtro, parametros):
+        """{external_id: (bm25, trecho)} com a melhor nota de cada OS; só
+        monta o trecho (snippet) quando há filtro, que limita as linhas."""
+        palavras = _PALAVRA.findall(normalizar_busca(consulta))
+        if not palavras: return {}
+        expressao = " ".join(f'"{p}"*' for p in palavras)
+        melhores = {}
+        with self._lock:
+            for aba in BUSCA_TEXTO:
+                headers = self.headers(aba)
+                existe = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?",
+                                            (f"_busca_{aba}",)).fetchone()
+                if headers is None or 'external_id' not in headers or not existe: continue
+                busca = _sql_nome(f"_busca_{aba}")
+                trecho = f"snippet({busca}, -1, '**', '**', '…', 12)" if filtro else "NULL"
+                linhas = self._conn.execute(
+                    f"SELECT t.external_id, bm25({busca}), {trecho} "
+                    f"FROM {busca} JOIN {_sql_nome(aba)} AS t ON t.rowid = {busca}.rowid "
+                    f"WHERE {busca} MATCH ?{filtro}", [expressao, *parametros]).fetchall()
+                for external_id, nota, texto in linhas:
+                    chave = str(external_id).strip()
+                    if chave not in melhores or nota < melhores[chave][0]:
+                        melhores[chave] = (nota, texto)
+        return melhores
+
+    def ler(self, aba, colunas=None):
+        """DataFrame da aba (ou só das colunas pedidas), ou None se ela ainda
+        não foi sincronizada."""
+        headers = self.headers(aba)
+        if headers is None: return None
+        if colunas is not None:
+            headers = [h for h in headers if h in colunas]
+        with self._lock:
+            colunas = ", ".join(_sql_nome(h) for h in headers)
+            df = pd.read_sql_query(f"SELECT {colunas} FROM {_sql_nome(aba)} ORDER BY rowid", self._conn)
+        return df.fillna('')
+
+    def buscar(self, aba, coluna, valor):
+        """Linhas cuja coluna é igual ao valor (consulta pelo índice)."""
+        headers = self.headers(aba)
+        if headers is None or coluna not in headers: return []
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT * FROM {_sql_nome(aba)} WHERE {_sql_nome(coluna)} IN (?, ?)",
+                (str(valor).strip(), _como_lido(str(valor).strip())))
+            nomes = [d[0] for d in cursor.description]
+            return [dict(zip(nomes, linha)) for linha in cursor.fetchall()]
+
+    def _aplicar(self, aba, operacao, coluna_chave, valor_chave, dados):
+        headers = self.headers(aba)
+        if headers is None or coluna_chave not in headers: return
+        filtro = f"WHERE {_sql_nome(coluna_chave)} IN (?, ?)"
+        chave = (str(valor_chave).strip(), _como_lido(str(valor_chave).strip()))
+        if operacao == 'alterar':
+            por_nome = {h.strip().replace(' ', '_'): h for h in headers}
+            campos = [(por_nome[c.strip().replace(' ', '_')], v) for c, v in dados.items()
+                      if c.strip().replace(' ', '_') in por_nome]
+            if not campos: return
+            atribuicoes = ", ".join(f"{_sql_nome(c)} = ?" for c, _ in campos)
+            self._conn.execute(f"UPDATE {_sql_nome(aba)} SET {atribuicoes} {filtro}",
+                               [v for _, v in campos] + list(chave))
+        elif operacao == 'excluir':
+            self._conn.execute(f"DELETE FROM {_sql_nome(aba)} {filtro}", chave)
+
+    def aplicar_insercao(self, aba, linha):
+        """Linha gravada pelo próprio app; a versão chega na próxima sincronização."""
+        headers = self.headers(aba)
+        if headers is None: return
+        with self._lock, self._conn:
+            colunas = ", ".join(_sql_nome(h) for h in headers)
+            marcas = ", ".join("?" * len(headers))
+            self._conn.execute(f"INSERT INTO {_sql_nome(aba)} ({colunas}) VALUES ({marcas})",
+                               [linha.get(h, '') for h in headers])
+
+    def aplicar_alteracao(self, aba, coluna_chave, valor_chave, dados, versao=None):
+        """Alteração que o app já gravou direto na planilha (fora da fila);
+        versao é a da linha depois da gravação."""
+        with self._lock, self._conn:
+            self._aplicar(aba, 'alterar', coluna_chave, valor_chave, dados)
+            headers = self.headers(aba)
+            if versao and headers and coluna_chave in headers:
+                self._conn.execute(
+                    f"UPDATE {_sql_nome(aba)} SET _versao = ? WHERE {_sql_nome(coluna_chave)} IN (?, ?)",
+                    (versao, str(valor_chave).strip(), _como_lido(str(valor_chave).strip())))
+
+    # --- Fila de escritas ---
+    def enfileirar_insercao(self, aba, valores, linha):
+        """Guarda uma linha nova (valores na ordem do cabeçalho) para envio
+        em lote e já a mostra na cópia local."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO _fila (aba, operacao, dados, criado_em) VALUES (?, 'inserir', ?, ?)",
+                (aba, json.dumps(valores), time.time()))
+            self.aplicar_insercao(aba, linha)
+
+    def enfileirar(self, aba, operacao, coluna_chave, valor_chave, dados=None, conferir=None):
+        """Guarda a operação na fila e já aplica na cópia local.
+
+        Retorna False se a chave não existe no espelho. conferir(linha), se
+        dado, roda sob o mesmo lock da gravação e pode levantar exceção para
+        cancelá-la (o espelho é compartilhado entre reruns, então a exceção
+        vem de quem chama).
+        """
+        with self._lock, self._conn:
+            existentes = self.buscar(aba, coluna_chave, valor_chave)
+            if not existentes: return False
+            if conferir is not None:
+                conferir(existentes[0])
+            self._conn.execute(
+                "INSERT INTO _fila (aba, operacao, coluna_chave, valor_chave, dados, versao_base, criado_em) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (aba, operacao, coluna_chave, str(valor_chave), json.dumps(dados or {}),
+                 existentes[0].get('_versao'), time.time()))
+            self._aplicar(aba, operacao, coluna_chave, valor_chave, dados or {})
+        return True
+
+    def pendentes(self, depois_de=0, limite=-1):
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT * FROM _fila WHERE status = 'pendente' AND id > ? ORDER BY id LIMIT ?", (depois_de, limite))
+            nomes = [d[0] for d in cursor.description]
+            return [dict(zip(nomes, linha)) for linha in cursor.fetchall()]
+
+    def concluir(self, op, versao_nova=None):
+        """Remove a operação enviada. Se a linha ganhou versão nova, as
+        próximas operações da mesma linha passam a esperar essa versão."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM _fila WHERE id = ?", (op['id'],))
+            if versao_nova and op['versao_base']:
+                self._conn.execute(
+                    "UPDATE _fila SET versao_base = ? WHERE aba = ? AND valor_chave = ? "
+                    "AND versao_base = ? AND status = 'pendente'",
+                    (versao_nova, op['aba'], op['valor_chave'], op['versao_base']))
+                headers = self.headers(op['aba'])
+                if headers and op['coluna_chave'] in headers:
+                    self._conn.execute(
+                        f"UPDATE {_sql_nome(op['aba'])} SET _versao = ? WHERE {_sql_nome(op['coluna_chave'])} IN (?, ?)",
+                        (versao_nova, op['valor_chave'], _como_lido(op['valor_chave'])))
+
+    def concluir_lote(self, ops):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM _fila WHERE id = ?", [(op['id'],) for op in ops])
+
+    def registrar_falha(self, op, erro, status=None):
+        """Conta uma tentativa falha e agenda a próxima com backoff
+        exponencial. Depois de MAX_TENTATIVAS_FILA (ou com status explícito,
+        como 'conflito') a operação sai da fila ativa."""
+        with self._lock, self._conn:
+            tentativas = op['tentativas'] + 1
+            if status is None:
+                status = 'falhou' if tentativas >= MAX_TENTATIVAS_FILA else 'pendente'
+            espera = min(BACKOFF_MAX_SEGUNDOS, BACKOFF_BASE_SEGUNDOS * 2 ** (tentativas - 1))
+            self._conn.execute(
+                "UPDATE _fila SET tentativas = ?, status = ?, erro = ?, proxima_tentativa = ? WHERE id = ?",
+                (tentativas, status, str(erro)[:500], time.time() + espera * random.uniform(0.8, 1.2), op['id']))
+
+    def reenviar_falhas(self):
+        """Devolve as operações que falharam para a fila."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE _fila SET status = 'pendente', tentativas = 0, proxima_tentativa = 0 "
+                               "WHERE status = 'falhou'")
+
+    def descartar_conflitos(self):
+        """Apaga as operações recusadas por conflito (o espelho já foi
+        recarregado da planilha quando elas foram recusadas)."""
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM _fila WHERE status = 'conflito'").rowcount
+
+    def proxima_tentativa(self):
+        """Quando a primeira operação pendente pode ser enviada (None se a fila está vazia)."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT MIN(proxima_tentativa) FROM _fila WHERE status = 'pendente'").fetchone()[0]
+
+    def reaplicar_pendentes(self, aba):
+        """Depois de puxar a planilha, reaplica o que ainda não foi enviado."""
+        with self._lock, self._conn:
+            headers = self.headers(aba)
+            for op in self.pendentes():
+                if op['aba'] != aba: continue
+                if op['operacao'] == 'inserir':
+                    if headers:
+                        self.aplicar_insercao(aba, {h: _como_lido(v) for h, v in zip(headers, json.loads(op['dados']))})
+                else:
+                    self._aplicar(aba, op['operacao'], op['coluna_chave'], op['valor_chave'], json.loads(op['dados']))
+
+    def contagem_fila(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM _fila GROUP BY status").fetchall())
+
+class Sincronizador:
+    """Thread que envia a fila de escritas e puxa as abas espelhadas a cada
+    intervalo (ou logo após acordar()).
+
+    abrir_aba e cabecalhos são injetados para poder rodar contra um
+    worksheet falso, sem gspread.
+    """
+
+    def __init__(self, espelho, abrir_aba, cabecalhos, intervalo=SYNC_INTERVALO_SEGUNDOS,
+                 abas=ABAS_ESPELHADAS, ao_mudar=None, completo_a_cada=SYNC_COMPLETO_SEGUNDOS):
+        self.espelho = espelho
+        self.abrir_aba = abrir_aba
+        self.cabecalhos = cabecalhos
+        self.intervalo = intervalo
+        self.completo_a_cada = completo_a_cada
+        self.abas = list(abas)
+        self.ao_mudar = ao_mudar or (lambda aba: None)
+        self.ultimo_erro = None
+        self._enviadas = defaultdict(Counter) # aba -> versões das linhas enviadas por append_rows
+        self._recarregar = set() # abas com conflito, para a carga completa forçada
+        self._acordar = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def iniciar(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="urb-sync", daemon=True)
+            self._thread.start()
+        return self
+
+    def acordar(self):
+        self._acordar.set()
+
+    def _espera(self):
+        proxima = self.espelho.proxima_tentativa()
+        if proxima is None:
+            return self.intervalo
+        return min(self.intervalo, max(0.5, proxima - time.time()))
+
+    def _loop(self):
+        while True:
+            self._acordar.wait(self._espera())
+            self._acordar.clear()
+            try:
+                self.ciclo()
+                self.ultimo_erro = None
+            except Exception as e:
+                self.ultimo_erro = str(e)
+
+    def ciclo(self):
+        with self._lock:
+            self.enviar_fila()
+            for aba in self.abas:
+                self.puxar(aba, completo=aba in self._recarregar)
+                self._recarregar.discard(aba)
+
+    def puxar(self, aba, completo=False):
+        """Atualiza o espelho da aba. Normalmente só busca as linhas depois da
+        marca d'água; carga completa na primeira vez, a cada completo_a_cada
+        segundos ou quando a marca não confere (linhas excluídas ou alteradas).
+
+        completo=True troca a tabela mesmo sem mudança na planilha: depois de
+        um conflito o espelho ainda tem o valor local recusado.
+
+        ao_mudar só é chamado se a planilha trouxe algo além das escritas do
+        próprio app, que já estão no cache de leitura.
+        """
+        ws = self.abrir_aba(aba)
+        headers = ws.row_values(1)
+        if not headers: return
+        if not completo and self._puxar_novas(ws, aba, headers): return
+        enviadas = self._enviadas.pop(aba, Counter())
+        mudou = self.espelho.substituir(aba, headers, ler_blocos(ws, len(headers)),
+                                        forcar=completo, conhecidas=enviadas.elements())
+        if mudou is not None:
+            self.espelho.reaplicar_pendentes(aba)
+        if mudou:
+            self.ao_mudar(aba)
+
+    def _puxar_novas(self, ws, aba, headers):
+        """Delta pela marca d'água. Lê a partir da última linha conhecida: se
+        ela continua igual, o que vem depois é novo; se mudou (exclusão ou
+        edição no fim), devolve False para forçar a carga completa."""
+        marca = self.espelho.marca_dagua(aba)
+        if (marca is None or not marca["linhas"] or marca["headers"] != [str(h) for h in headers]
+                or time.time() - marca["completo_em"] >= self.completo_a_cada):
+            return False
+        blocos = ler_blocos(ws, len(headers), inicio=marca["linhas"] + 1)
+        primeiro = next(blocos, [])
+        if not primeiro:
+            return False # a aba encolheu
+        conhecida = list(primeiro[0]) + [''] * (len(headers) - len(primeiro[0]))
+        if _versao_linha(conhecida) != marca["ultima_versao"]:
+            return False
+        novas = primeiro[1:] + [linha for bloco in blocos for linha in bloco]
+        if novas:
+            self.espelho.acrescentar(aba, headers, novas, marca)
+            self.espelho.reaplicar_pendentes(aba)
+            if self._externas(aba, novas):
+                self.ao_mudar(aba)
+        else:
+            self.espelho.marcar_sincronizado(aba)
+        return True
+
+    def _externas(self, aba, linhas):
+        """Se alguma das linhas novas não é inserção enviada por este processo
+        (essas já estão no cache de leitura desde a gravação)."""
+        enviadas = self._enviadas[aba]
+        externa = False
+        for linha in linhas:
+            versao = _versao_linha(linha)
+            if enviadas[versao] > 0:
+                enviadas[versao] -= 1
+            else:
+                externa = True
+        return externa
+
+    def enviar_fila(self):
+        ultimo = 0
+        while True:
+            # Relê a cada passo: concluir() pode ter atualizado a versao_base das próximas
+            proximas = self.espelho.pendentes(depois_de=ultimo, limite=LOTE_INSERCAO_MAX)
+            if not proximas: break
+            op = proximas[0]
+            if op['proxima_tentativa'] > time.time():
+                break # em backoff; a ordem da fila é preservada
+            lote = [op]
+            if op['operacao'] == 'inserir':
+                # Inserções seguidas na mesma aba vão num único append_rows
+                for outra in proximas[1:]:
+                    if outra['operacao'] != 'inserir' or outra['aba'] != op['aba']: break
+                    lote.append(outra)
+            ultimo = lote[-1]['id']
+            try:
+                if op['operacao'] == 'inserir':
+                    linhas = [json.loads(o['dados']) for o in lote]
+                    self.abrir_aba(op['aba']).append_rows(linhas)
+                    self._enviadas[op['aba']].update(_versao_linha(linha) for linha in linhas)
+                    self.espelho.concluir_lote(lote)
+                else:
+                    self._enviar(op)
+            except ConflitoEscrita as e:
+                self.espelho.registrar_falha(op, e, status='conflito')
+                # O espelho e o cache ainda têm o valor recusado: a aba é
+                # recarregada por inteiro no puxar() deste mesmo ciclo
+                self._recarregar.add(op['aba'])
+            except Exception as e:
+                # Mantém a ordem: o resto da fila espera a próxima rodada
+                for item in lote:
+                    self.espelho.registrar_falha(item, e)
+                break
+
+    def _enviar(self, op):
+        ws = self.abrir_aba(op['aba'])
+        headers = self.cabecalhos(op['aba'])
+        if op['operacao'] == 'alterar':
+            versao = _gravar_alteracao(ws, headers, op['valor_chave'], json.loads(op['dados']),
+                                       op['coluna_chave'], op['versao_base'])
+            if versao is None:
+                raise ConflitoEscrita(f"{op['coluna_chave']}={op['valor_chave']} não existe mais na planilha")
+            self.espelho.concluir(op, versao)
+        elif op['operacao'] == 'excluir':
+            _gravar_exclusao(ws, headers, op['valor_chave'], op['coluna_chave'], op['versao_base'])
+            self.espelho.concluir(op)
+
+@st.cache_resource
+def get_espelho():
+    return LocalMirror(st.secrets.get("espelho_path", ESPELHO_PATH_PADRAO))
+
+@st.cache_resource
+def get_sincronizador():
+    return Sincronizador(
+        get_espelho(),
+        abrir_aba=get_worksheet,
+        cabecalhos=lambda aba: SheetsClient.get_headers(aba) or _schema_padrao(aba),
+        intervalo=float(st.secrets.get("sync_intervalo_segundos", SYNC_INTERVALO_SEGUNDOS)),
+        ao_mudar=lambda aba: get_read_cache().invalidate(aba),
+        completo_a_cada=float(st.secrets.get("sync_completo_segundos", SYNC_COMPLETO_SEGUNDOS)),
+    ).iniciar()
+
+# ============================================================
+# NUMERAÇÃO DAS OS
+# ============================================================
+BLOCO_IDS_PADRAO = 1
+
+class IdAllocator:
+    """Distribui números de OS em blocos arrendados na aba SHEET_SEQUENCIA.
+
+    Cada arrendamento é um append_row: o Sheets serializa os appends, então
+    a linha devolvida é única mesmo com várias sessões salvando ao mesmo
+    tempo. A linha r (r >= 2) reserva os ids
+    base + (r - 2) * bloco + 1 ... base + (r - 1) * bloco.
+    Com bloco = 1 não há buracos na numeração e cada OS custa uma chamada;
+    blocos maiores dispensam a chamada, mas ids não usados se perdem quando
+    o processo reinicia.
+    """
+
+    def __init__(self, bloco_padrao):
+        self.bloco_padrao = bloco_padrao
+        self._lock = threading.Lock()
+        self._base = None
+        self._bloco = None
+        self._proximo = 0
+        self._fim = -1
+
+    def novo_id(self):
+        with self._lock:
+            if self._proximo > self._fim:
+                self._arrendar_bloco()
+            novo_id = self._proximo
+            self._proximo += 1
+            return novo_id
+
+    def _carregar_cabecalho(self, ws):
+        cabecalho = ws.row_values(1)
+        if not cabecalho:
+            # Primeira execução: parte do maior id já usado. O cabeçalho entra
+            # por append_row, como os arrendamentos: se dois processos chegarem
+            # aqui juntos, só um fica na linha 1 (o outro vira um arrendamento
+            # perdido) e os dois usam a base gravada lá.
+            ws.append_row(["base", _ultimo_id_legado(), "bloco", self.bloco_padrao], table_range="A1")
+            cabecalho = ws.row_values(1)
+        if len(cabecalho) < 4 or cabecalho[0] != "base":
+            raise ValueError(f"Cabeçalho inválido em {SHEET_SEQUENCIA}!A1:D1: {cabecalho}")
+        self._base, self._bloco = int(cabecalho[1]), int(cabecalho[3])
+
+    def _arrendar_bloco(self):
+        ws = get_worksheet(SHEET_SEQUENCIA)
+        if self._base is None:
+            self._carregar_cabecalho(ws)
+        while True:
+            resp = ws.append_row(
+                [datetime.now(FUSO_BR).strftime("%Y-%m-%d %H:%M:%S"), f"{socket.gethostname()}:{os.getpid()}"],
+                table_range="A1",
+            )
+            celula = resp["updates"]["updatedRange"].split("!")[-1].split(":")[0]
+            linha, _ = gspread.utils.a1_to_rowcol(celula)
+            # Linha 1 só acontece se a aba foi esvaziada depois que o
+            # cabeçalho foi lido; descarta e tenta de novo.
+            if linha >= 2: break
+        self._proximo = self._base + (linha - 2) * self._bloco + 1
+        self._fim = self._base + (linha - 1) * self._bloco
+
+def _ultimo_id_legado():
+    """Maior id entre o contador antigo (config!A1) e as denúncias já salvas."""
+    ultimo = 0
+    try:
+        valor = get_worksheet(SHEET_CONFIG).acell("A1").value
+        ultimo = int(valor)
+    except (TypeError, ValueError, gspread.exceptions.APIError):
+        pass
+    df = load_data(SHEET_DENUNCIAS, colunas=['id'])
+    if not df.empty and 'id' in df.columns:
+        maior = pd.to_numeric(df['id'], errors='coerce').max()
+        if pd.notna(maior):
+            ultimo = max(ultimo, int(maior))
+    return ultimo
+
+@st.cache_resource
+def get_id_allocator():
+    return IdAllocator(int(st.secrets.get("bloco_ids", BLOCO_IDS_PADRAO)))
+
+def gerar_novo_id():
+    return get_id_allocator().novo_id()
+
+# ============================================================
+# AGREGADOS DO DASHBOARD
+# ============================================================
+class AgregadosDashboard:
+    """Contagens do Dashboard para uma versão de denuncias_registro.
+
+    Fica guardado no ReadCache junto com o DataFrame; quando o app grava
+    uma linha, aplicar() ajusta as contagens sem recalcular tudo.
+    """
+
+    CAMPOS = ('status', 'tipo', 'origem', 'bairro', 'zona')
+
+    def __init__(self, df):
+        self.total = len(df)
+        self.contagens = {}
+        for campo in self.CAMPOS:
+            self.contagens[campo] = Counter()
+            if campo in df.columns:
+                # Conta os valores distintos e só então normaliza (categóricas
+                # trazem também as categorias sem nenhuma linha)
+                for valor, qtd in df[campo].value_counts().items():
+                    if qtd:
+                        self.contagens[campo][self._normalizar(campo, valor)] += int(qtd)
+        self._figuras = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalizar_serie(campo, serie):
+        if campo == 'status':
+            return serie.replace({'FALSE': 'Pendente', 'False': 'Pendente'})
+        if campo == 'tipo':
+            return serie.replace({'Urbana': 'Urbano', 'urbano': 'Urbano', 'urbana': 'Urbano'})
+        return serie
+
+    @staticmethod
+    def _normalizar(campo, valor):
+        if campo == 'status' and valor in ('FALSE', 'False'):
+            return 'Pendente'
+        if campo == 'tipo' and valor in ('Urbana', 'urbano', 'urbana'):
+            return 'Urbano'
+        return valor
+
+    def aplicar(self, antiga, nova):
+        """Ajusta as contagens para uma linha inserida, editada ou excluída."""
+        with self._lock:
+            self.total += (nova is not None) - (antiga is not None)
+            for campo in self.CAMPOS:
+                contagem = self.contagens[campo]
+                if antiga is not None and campo in antiga:
+                    valor = self._normalizar(campo, antiga[campo])
+                    contagem[valor] -= 1
+                    if contagem[valor] <= 0: del contagem[valor]
+                if nova is not None and campo in nova:
+                    contagem[self._normalizar(campo, nova[campo])] += 1
+            self._figuras.clear()
+
+    def _tabela(self, campo, colunas, limite=None):
+        return pd.DataFrame(self.contagens[campo].most_common(limite), columns=colunas)
+
+    def figura(self, nome):
+        """Figura plotly do gráfico pedido, montada uma vez por versão."""
+        with self._lock:
+            if nome not in self._figuras:
+                self._figuras[nome] = getattr(self, f"_figura_{nome}")()
+            return self._figuras[nome]
+
+    def _figura_tipo(self):
+        # Gráfico de Rosca (Donut)
+        contagem = self._tabela('tipo', ['Tipo', 'Qtd'])
+        fig = px.pie(
+            contagem, 
+            values='Qtd', 
+            names='Tipo', 
+            hole=0.5,
+            color_discrete_sequence=px.colors.qualitative.Safe
+        )
+        fig.update_traces(textposition='inside', textinfo='percent+label')
+        fig.update_layout(margin=dict(t=30, b=0, l=0, r=0), showlegend=False)
+        return fig
+
+    def _figura_origem(self):
+        df_origem = self._tabela('origem', ['Fonte', 'Total'])
+        fig_origem = px.bar(df_origem, x='Total', y='Fonte', orientation='h', text_auto=True)
+        fig_origem.update_layout(margin=dict(t=30, b=0, l=0, r=0))
+        return fig_origem
+
+    def _figura_bairro(self):
+        df_bairro = self._tabela('bairro', ['Bairro', 'Total'], limite=10)
+        fig_bairro = px.bar(df_bairro, x='Total', y='Bairro', orientation='h',
+                           text='Total', color='Total', color_continuous_scale='Blues')
+        fig_bairro.update_layout(yaxis={'categoryorder':'total ascending'}, showlegend=False)
+        return fig_bairro
+
+    def _figura_zona(self):
+        df_zona = self._tabela('zona', ['Zona', 'Total'])
+        fig_zona = px.bar(df_zona, x='Zona', y='Total', color='Zona', text_auto=True)
+        fig_zona.update_layout(showlegend=False)
+        return fig_zona
+
+# ============================================================
+# SÉRIE TEMPORAL
+# ============================================================
+FREQUENCIAS_SERIE = {"Dia": "D", "Semana": "W", "Mês": "MS"}
+STATUS_ABERTOS = ['Pendente', 'Em Monitoramento']
+
+def _parse_datas(serie):
+    """Converte datas em texto (formato do app) em datetime sem fuso, vetorizado."""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    texto = serie.astype(str).str.strip()
+    datas = pd.to_datetime(texto, format="%Y-%m-%d %H:%M:%S", errors='coerce')
+    faltando = datas.isna() & (texto != '')
+    if faltando.any():
+        # Linhas antigas ou editadas à mão em outro formato
+        datas[faltando] = pd.to_datetime(texto[faltando], errors='coerce', dayfirst=True, format='mixed')
+    return datas
+
+def _parse_created_at(serie):
+    """created_at em datetime no fuso FUSO_BR."""
+    return _parse_datas(serie).dt.tz_localize(FUSO_BR, ambiguous='NaT', nonexistent='NaT')
+
+class SerieTemporal:
+    """Denúncias indexadas por created_at, calculado uma vez por versão.
+
+    frame tem o índice datetime ordenado e as colunas pos (posição da linha
+    no DataFrame carregado), status (normalizado) e zona.
+    """
+
+    def __init__(self, df):
+        if 'created_at' not in df.columns:
+            self.frame = pd.DataFrame(columns=['pos', 'status', 'zona'], index=pd.DatetimeIndex([], tz=FUSO_BR))
+            return
+        datas = _parse_created_at(df['created_at'])
+        frame = pd.DataFrame({
+            'pos': np.arange(len(df)),
+            'status': AgregadosDashboard._normalizar_serie('status', df['status']) if 'status' in df.columns else '',
+            'zona': df['zona'] if 'zona' in df.columns else '',
+        })
+        frame.index = pd.DatetimeIndex(datas, name='created_at')
+        self.frame = frame[frame.index.notna()].sort_index()
+
+    def recorte(self, inicio, fim):
+        """Linhas entre as datas inicio e fim (inclusive), por busca no índice."""
+        inicio = pd.Timestamp(inicio).tz_localize(FUSO_BR)
+        fim = pd.Timestamp(fim).tz_localize(FUSO_BR) + pd.Timedelta(days=1) - pd.Timedelta(1, 'ns')
+        return self.frame.loc[inicio:fim]
+
+    @staticmethod
+    def volume(recorte, freq, coluna):
+        """Quantidade de denúncias por período (freq) e por valor da coluna."""
+        if recorte.empty:
+            return pd.DataFrame()
+        return recorte.groupby([pd.Grouper(freq=freq), coluna]).size().unstack(fill_value=0)
+
+    @staticmethod
+    def idade_backlog(recorte, agora):
+        """Idade em dias das OS ainda abertas."""
+        abertas = recorte[recorte['status'].isin(STATUS_ABERTOS)]
+        return pd.Series((pd.Timestamp(agora) - abertas.index).total_seconds() / 86400, dtype=float)
+
+# ============================================================
+# ÍNDICE DE BUSCA DO HISTÓRICO
+# ============================================================
+_SEM_POSICOES = np.array([], dtype=np.intp)
+MAX_SUGESTOES = 20
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+def _agrupar_posicoes(codigos, quantidade):
+    """Para cada código 0..quantidade-1, as posições (ordenadas) onde ele aparece."""
+    ordem = np.argsort(codigos, kind='stable')
+    limites = np.searchsorted(codigos[ordem], np.arange(quantidade + 1))
+    return [ordem[limites[i]:limites[i + 1]] for i in range(quantidade)]
+
+class _IndiceTrecho:
+    """Busca por trecho, sem acento nem maiúscula, numa coluna de poucos
+    valores distintos (bairro, rua). Os trigramas apontam para os valores
+    distintos, e cada valor para as linhas em que aparece."""
+
+    def __init__(self, serie):
+        codigos, valores = pd.factorize(serie.astype(str), use_na_sentinel=False)
+        self.valores = [normalizar_busca(v) for v in valores]
+        self.posicoes = _agrupar_posicoes(codigos, len(valores))
+        self.trigramas = defaultdict(set)
+        for i, valor in enumerate(self.valores):
+            for trigrama in _trigramas(valor):
+                self.trigramas[trigrama].add(i)
+
+    def buscar(self, trecho):
+        trecho = normalizar_busca(trecho)
+        if len(trecho) >= 3:
+            conjuntos = sorted((self.trigramas.get(t, set()) for t in _trigramas(trecho)), key=len)
+            candidatos = set.intersection(*conjuntos)
+        else:
+            candidatos = range(len(self.valores))
+        achados = [self.posicoes[i] for i in candidatos if trecho in self.valores[i]]
+        return np.sort(np.concatenate(achados)) if achados else _SEM_POSICOES
+
+def _chaves_os(numero):
+    """Formas aceitas para o Nº da OS: '0001/2025', '0001' e '1'."""
+    numero = str(numero).strip().lower()
+    chaves = {numero}
+    parte = numero.split('/')[0]
+    if parte:
+        chaves.add(parte)
+        chaves.add(parte.lstrip('0') or '0')
+    return chaves
+
+class IndiceHistorico:
+    """Índices dos filtros do Histórico para uma versão de denuncias_registro.
+
+    Montado uma vez por versão (obter_derivado); cada filtro vira uma
+    consulta no índice em vez de uma varredura do DataFrame, e filtrar()
+    devolve as posições já na ordem da listagem (id decrescente).
+    """
+
+    CATEGORICAS = ('zona', 'status')
+    TRECHOS = ('bairro', 'rua')
+
+    def __init__(self, df):
+        self.total = len(df)
+        coluna = lambda c: df[c] if c in df.columns else pd.Series([''] * self.total, dtype=object)
+
+        # Códigos categóricos: comparar inteiros é mais barato que comparar textos
+        self.codigos, self.categorias = {}, {}
+        for campo in self.CATEGORICAS:
+            categorias = pd.Categorical(coluna(campo).astype(str))
+            self.codigos[campo] = categorias.codes
+            self.categorias[campo] = {v: i for i, v in enumerate(categorias.categories)}
+
+        self.trechos = {campo: _IndiceTrecho(coluna(campo)) for campo in self.TRECHOS}
+
+        self.por_os = defaultdict(list)
+        self.por_external_id = {}
+        for pos, numero in enumerate(coluna('external_id').astype(str)):
+            self.por_external_id.setdefault(numero, pos)
+            for chave in _chaves_os(numero):
+                self.por_os[chave].append(pos)
+
+        ids = pd.to_numeric(coluna('id'), errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        self.ordem = np.argsort(-np.nan_to_num(ids, nan=-np.inf), kind='stable')
+        self.rank = np.empty(self.total, dtype=np.intp)
+        self.rank[self.ordem] = np.arange(self.total)
+
+    def filtrar(self, bairro='', rua='', zona=None, status=None, numero_os=''):
+        """Posições das linhas que passam em todos os filtros, em id decrescente."""
+        partes = []
+        for campo, valor in (('zona', zona), ('status', status)):
+            if valor:
+                codigo = self.categorias[campo].get(valor)
+                partes.append(np.flatnonzero(self.codigos[campo] == codigo) if codigo is not None else _SEM_POSICOES)
+        for campo, trecho in (('bairro', bairro), ('rua', rua)):
+            if trecho.strip():
+                partes.append(self.trechos[campo].buscar(trecho))
+        if numero_os.strip():
+            partes.append(np.array(sorted(self.por_os.get(numero_os.strip().lower(), ())), dtype=np.intp))
+
+        if not partes:
+            return self.ordem
+        partes.sort(key=len)
+        posicoes = partes[0]
+        for parte in partes[1:]:
+            if not len(posicoes): break
+            posicoes = np.intersect1d(posicoes, parte, assume_unique=True)
+        return posicoes[np.argsort(self.rank[posicoes], kind='stable')]
+
+    def sugerir(self, consulta, limite=MAX_SUGESTOES):
+        """Até `limite` posições para a busca digitada: primeiro as OS com
+        esse número, depois as com o trecho na rua ou no bairro, cada grupo
+        em id decrescente. Sem consulta, as mais recentes."""
+        consulta = consulta.strip()
+        if not consulta:
+            return self.ordem[:limite]
+        grupos = [np.array(sorted(self.por_os.get(consulta.lower(), ())), dtype=np.intp),
+                  np.union1d(self.trechos['rua'].buscar(consulta), self.trechos['bairro'].buscar(consulta))]
+        sugestoes, vistos = [], set()
+        for grupo in grupos:
+            for pos in grupo[np.argsort(self.rank[grupo], kind='stable')].tolist():
+                if pos not in vistos:
+                    vistos.add(pos)
+                    sugestoes.append(pos)
+                    if len(sugestoes) == limite:
+                        return np.array(sugestoes, dtype=np.intp)
+        return np.array(sugestoes, dtype=np.intp)
+
+# ============================================================
+# ÍNDICE ESPACIAL (MAPA)
+# ============================================================
+CELULA_GRAUS = 0.01 # ~1,1 km de lado
+RAIO_TERRA_METROS = 6371000
+RAIO_PROXIMAS_PADRAO = 300
+
+def coordenadas_validas(lat, lon):
+    """Máscara vetorizada das coordenadas utilizáveis: números finitos, dentro
+    dos limites da Terra e diferentes de (0, 0), que é o que sobra de
+    campos preenchidos com zero."""
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    return (np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+            & ~((lat == 0) & (lon == 0)))
+
+def distancia_metros(lat1, lon1, lat2, lon2):
+    """Haversine vetorizado."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RAIO_TERRA_METROS * np.arcsin(np.sqrt(a))
+
+class IndiceEspacial:
+    """Grade regular sobre as coordenadas válidas de denuncias_registro,
+    montada uma vez por versão (obter_derivado).
+
+    Os pontos ficam ordenados pela célula (linha, coluna) da grade; uma
+    consulta por retângulo só olha as faixas de células que ele cobre, e a
+    consulta por raio é um retângulo seguido do filtro exato por distância.
+    """
+
+    def __init__(self, df, celula=CELULA_GRAUS):
+        self.celula = celula
+        lat = pd.to_numeric(df['latitude'], errors='coerce').to_numpy(dtype=float, na_value=np.nan) \
+            if 'latitude' in df.columns else np.full(len(df), np.nan)
+        lon = pd.to_numeric(df['longitude'], errors='coerce').to_numpy(dtype=float, na_value=np.nan) \
+            if 'longitude' in df.columns else np.full(len(df), np.nan)
+        validas = coordenadas_validas(lat, lon)
+        self.total = len(df)
+        self.invalidas = int((~validas).sum())
+
+        pos = np.flatnonzero(validas)
+        linha = np.floor(lat[pos] / celula).astype(np.int64)
+        coluna = np.floor(lon[pos] / celula).astype(np.int64)
+        self._desloc = int(coluna.min()) if len(coluna) else 0
+        self._largura = int(coluna.max()) - self._desloc + 1 if len(coluna) else 1
+        chave = linha * self._largura + (coluna - self._desloc)
+        ordem = np.argsort(chave, kind='stable')
+        self.chaves = chave[ordem]
+        self.pos = pos[ordem]
+        self.lat = lat[pos][ordem]
+        self.lon = lon[pos][ordem]
+
+    def retangulo(self, lat_min, lat_max, lon_min, lon_max):
+        """Índices (nos arrays do índice) dos pontos dentro do retângulo."""
+        if not len(self.pos): return np.array([], dtype=np.intp)
+        c0 = max(int(np.floor(lon_min / self.celula)) - self._desloc, 0)
+        c1 = min(int(np.floor(lon_max / self.celula)) - self._desloc, self._largura - 1)
+        if c1 < c0: return np.array([], dtype=np.intp)
+        linhas = np.arange(int(np.floor(lat_min / self.celula)), int(np.floor(lat_max / self.celula)) + 1)
+        inicios = np.searchsorted(self.chaves, linhas * self._largura + c0, side='left')
+        fins = np.searchsorted(self.chaves, linhas * self._largura + c1, side='right')
+        faixas = [np.arange(a, b) for a, b in zip(inicios, fins) if b > a]
+        if not faixas: return np.array([], dtype=np.intp)
+        candidatos = np.concatenate(faixas)
+        dentro = ((self.lat[candidatos] >= lat_min) & (self.lat[candidatos] <= lat_max)
+                  & (self.lon[candidatos] >= lon_min) & (self.lon[candidatos] <= lon_max))
+        return candidatos[dentro]
+
+    def no_retangulo(self, lat_min, lat_max, lon_min, lon_max):
+        """Posições das linhas do DataFrame dentro do retângulo."""
+        return self.pos[self.retangulo(lat_min, lat_max, lon_min, lon_max)]
+
+    def no_raio(self, lat, lon, metros):
+        """(posições, distâncias em metros) das linhas a até `metros` do
+        ponto, da mais próxima para a mais distante."""
+        dlat = np.degrees(metros / RAIO_TERRA_METROS)
+        dlon = dlat / max(np.cos(np.radians(lat)), 1e-6)
+        candidatos = self.retangulo(lat - dlat, lat + dlat, lon - dlon, lon + dlon)
+        distancias = distancia_metros(lat, lon, self.lat[candidatos], self.lon[candidatos])
+        perto = distancias <= metros
+        candidatos, distancias = candidatos[perto], distancias[perto]
+        ordem = np.argsort(distancias, kind='stable')
+        return self.pos[candidatos[ordem]], distancias[ordem]
+
+# ============================================================
+# DUPLICATAS E REINCIDÊNCIAS
+# ============================================================
+RAIO_DUPLICATA_METROS = 150
+LIMIAR_DUPLICATA = 0.35
+MAX_CANDIDATOS = 5
+# Pesos da nota (somam 1): endereço, distância e descrição
+PESO_RUA, PESO_NUMERO, PESO_BAIRRO = 0.15, 0.25, 0.10
+PESO_DISTANCIA, PESO_DESCRICAO = 0.25, 0.25
+_TIPOS_LOGRADOURO = {'rua', 'r', 'avenida', 'av', 'travessa', 'tv', 'trav', 'estrada', 'rodovia',
+                     'praca', 'pc', 'alameda', 'al', 'beco', 'vila', 'loteamento', 'sitio'}
+_PALAVRAS_VAZIAS = {'de', 'da', 'do', 'das', 'dos', 'e', 'a', 'o', 'as', 'os', 'em', 'na', 'no',
+                    'nas', 'nos', 'com', 'para', 'por', 'um', 'uma', 'que'}
+
+def normalizar_logradouro(rua):
+    """'R. São João, ' e 'rua sao joao' -> 'sao joao'."""
+    palavras = _PALAVRA.findall(normalizar_busca(rua))
+    while palavras and palavras[0] in _TIPOS_LOGRADOURO:
+        palavras = palavras[1:]
+    return ' '.join(p for p in palavras if p not in _PALAVRAS_VAZIAS)
+
+def normalizar_numero(numero):
+    """Primeiro número do campo, sem zeros à esquerda ('s/n' -> '')."""
+    digitos = re.findall(r"\d+", str(numero))
+    return (digitos[0].lstrip('0') or '0') if digitos else ''
+
+def _palavras_relevantes(texto):
+    return {p for p in _PALAVRA.findall(normalizar_busca(texto)) if len(p) > 2 and p not in _PALAVRAS_VAZIAS}
+
+class CandidatosDuplicata:
+    """Blocos por logradouro normalizado de denuncias_registro, montados uma
+    vez por versão (obter_derivado). Uma denúncia nova só é comparada com as
+    da mesma rua e com as que estão a até RAIO_DUPLICATA_METROS dela."""
+
+    def __init__(self, df):
+        self.total = len(df)
+        coluna = lambda c: df[c].astype(str) if c in df.columns else pd.Series([''] * self.total)
+        # Normaliza cada valor distinto uma vez só
+        codigos, ruas = pd.factorize(coluna('rua'))
+        ruas = [normalizar_logradouro(r) for r in ruas]
+        self.por_rua = defaultdict(list)
+        for pos, codigo in enumerate(codigos):
+            if ruas[codigo]:
+                self.por_rua[ruas[codigo]].append(pos)
+        codigos, numeros = pd.factorize(coluna('numero'))
+        self.numeros = np.array([normalizar_numero(n) for n in numeros] or [''], dtype=object)[codigos]
+        codigos, bairros = pd.factorize(coluna('bairro'))
+        self.bairros = np.array([normalizar_busca(b) for b in bairros] or [''], dtype=object)[codigos]
+
+    def buscar(self, df, espacial, dados, limite=MAX_CANDIDATOS):
+        """[(posição, nota, motivos)] das denúncias parecidas com dados, da
+        nota maior para a menor, só as com nota >= LIMIAR_DUPLICATA."""
+        notas = defaultdict(float)
+        motivos = defaultdict(list)
+
+        rua = normalizar_logradouro(dados.get('rua', ''))
+        numero = normalizar_numero(dados.get('numero', ''))
+        bairro = normalizar_busca(dados.get('bairro', ''))
+        for pos in self.por_rua.get(rua, ()):
+            notas[pos] += PESO_RUA
+            if numero and self.numeros[pos] == numero:
+                notas[pos] += PESO_NUMERO
+                motivos[pos].append("mesmo endereço")
+            else:
+                motivos[pos].append("mesma rua")
+            if bairro and self.bairros[pos] == bairro:
+                notas[pos] += PESO_BAIRRO
+
+        lat = pd.to_numeric(pd.Series([str(dados.get('latitude', '')).replace(',', '.')]), errors='coerce')[0]
+        lon = pd.to_numeric(pd.Series([str(dados.get('longitude', '')).replace(',', '.')]), errors='coerce')[0]
+        if coordenadas_validas([lat], [lon])[0]:
+            posicoes, distancias = espacial.no_raio(lat, lon, RAIO_DUPLICATA_METROS)
+            for pos, distancia in zip(posicoes.tolist(), distancias.tolist()):
+                notas[pos] += PESO_DISTANCIA * (1 - distancia / RAIO_DUPLICATA_METROS)
+                motivos[pos].append(f"a {distancia:.0f} m")
+
+        palavras = _palavras_relevantes(dados.get('descricao', ''))
+        if palavras and 'descricao' in df.columns:
+            descricoes = df['descricao']
+            for pos in list(notas):
+                outras = _palavras_relevantes(descricoes.iat[pos])
+                if outras:
+                    semelhanca = len(palavras & outras) / len(palavras | outras)
+                    notas[pos] += PESO_DESCRICAO * semelhanca
+                    if semelhanca >= 0.3:
+                        motivos[pos].append("descrição parecida")
+
+        melhores = sorted((pos for pos in notas if notas[pos] >= LIMIAR_DUPLICATA), key=lambda pos: -notas[pos])
+        return [(pos, round(notas[pos], 2), motivos[pos]) for pos in melhores[:limite]]
+
+def buscar_candidatos(dados, limite=MAX_CANDIDATOS):
+    """Denúncias já registradas que podem ser a mesma ocorrência de dados."""
+    df, (candidatos, espacial) = obter_derivados(
+        SHEET_DENUNCIAS, {'candidatos_duplicata': CandidatosDuplicata, 'indice_espacial': IndiceEspacial})
+    if df.empty: return []
+    achados = candidatos.buscar(df, espacial, dados, limite)
+    registros = registros_de(df.iloc[[pos for pos, _, _ in achados]])
+    return [dict(registro, nota=nota, motivos=motivos) for registro, (_, nota, motivos) in zip(registros, achados)]
+
+class ReincidenciasPorOS:
+    """Linhas de reincidencias (já como dicionários com os textos da
+    planilha) agrupadas por external_id, em ordem de data_hora. Montado uma
+    vez por versão (obter_derivado): registros_de roda uma vez para a aba
+    inteira, não uma vez por OS no lote de PDFs."""
+
+    def __init__(self, df):
+        self.total = len(df)
+        self.por_os = {}
+        if df.empty or 'external_id' not in df.columns: return
+        chaves = df['external_id'].astype(str).str.strip().tolist()
+        linhas = registros_de(df)
+        ordem = np.argsort(df['data_hora'].to_numpy(), kind='stable') if 'data_hora' in df.columns else range(self.total)
+        for pos in ordem:
+            self.por_os.setdefault(chaves[pos], []).append(linhas[pos])
+
+    def contagem(self, external_id):
+        return len(self.por_os.get(str(external_id).strip(), ()))
+
+    def registros(self, external_id):
+        """Reincidências da OS como dicionários com os textos da planilha."""
+        return list(self.por_os.get(str(external_id).strip(), ()))
+
+def obter_reincidencias():
+    return obter_derivado(SHEET_REINCIDENCIAS, 'reincidencias_por_os', ReincidenciasPorOS)[1]
+
+def com_reincidencias(registros, reincidencias=None):
+    """Os registros com a lista 'reincidencias' de cada OS, para o cartão e
+    o PDF. A lista entra na chave do cache de PDFs, então uma reincidência
+    nova gera outro PDF."""
+    if reincidencias is None:
+        reincidencias = obter_reincidencias()
+    return [dict(dados, reincidencias=reincidencias.registros(dados.get('external_id', ''))) for dados in registros]
+
+def exportar_lote(df, posicoes, reincidencias, zip_por_os=False):
+    """PDF único (ou ZIP) das linhas de df nas posições dadas. Vai para o
+    download_button: os registros só são montados no clique."""
+    registros = com_reincidencias(registros_de(df.iloc[posicoes]), reincidencias)
+    return gerar_zip_lote(registros) if zip_por_os else pdf_para_download(gerar_pdf_lote, registros)
+
+def exibir_linha_do_tempo(dados):
+    """Registro original seguido das reincidências, em ordem de data."""
+    st.markdown(f"**{data_br(dados.get('created_at', ''))}** — registro original "
+                f"({dados.get('origem', '')} | {dados.get('quem_recebeu', '')})")
+    st.text(dados.get('descricao', ''))
+    for reinc in dados.get('reincidencias', []):
+        st.markdown(f"**{data_br(reinc.get('data_hora', ''))}** — 🔄 reincidência "
+                    f"({reinc.get('origem', '')} | {reinc.get('registrado_por', '')})")
+        st.text(reinc.get('descricao', ''))
+
+def registrar_reincidencia(real_id, desc_nova, origem, registrado_por):
+    """Grava a reincidência na aba própria e reabre a denúncia original.
+
+    A descrição original não muda: o histórico é juntado na leitura por
+    com_reincidencias. Na denúncia só a célula de status é alterada, e só
+    se ela ainda não estiver Pendente.
+    """
+    agora_br = datetime.now(FUSO_BR).strftime('%Y-%m-%d %H:%M:%S')
+    rec = {"external_id": real_id, "data_hora": agora_br, "origem": origem, "descricao": desc_nova, "registrado_por": registrado_por}
+    salvar_dados_seguro(SHEET_REINCIDENCIAS, rec)
+    encontrados = get_espelho().buscar(SHEET_DENUNCIAS, 'external_id', real_id)
+    if not encontrados or str(encontrados[0].get('status', '')) != 'Pendente':
+        atualizar_registro(SHEET_DENUNCIAS, real_id, {'status': 'Pendente'}, coluna_chave='external_id')
+
+# ============================================================
+# AUTENTICAÇÃO
+# ============================================================
+# Senhas: PBKDF2-SHA256 com sal por usuário, gravado como
+# "pbkdf2_sha256$iterações$sal$hash". Hashes SHA-256 antigos (64 hex, sem
+# sal) ainda entram e são regravados no formato novo no próximo login.
+SENHA_ALGORITMO = "pbkdf2_sha256"
+SENHA_ITERACOES_PADRAO = 200_000
+MAX_TENTATIVAS_LOGIN = 5
+JANELA_TENTATIVAS_SEGUNDOS = 300
+VARRER_TENTATIVAS_MIN = 1000 # usuários com falhas antes de varrer os que já saíram da janela
+
+def _iteracoes_senha():
+    return int(st.secrets.get("senha_iteracoes", SENHA_ITERACOES_PADRAO))
+
+def _pbkdf2(password, sal, iteracoes):
+    return hashlib.pbkdf2_hmac('sha256', str(password).encode(), sal, iteracoes)
+
+def hash_password(password, iteracoes=None):
+    iteracoes = iteracoes or _iteracoes_senha()
+    sal = os.urandom(16)
+    return f"{SENHA_ALGORITMO}${iteracoes}${sal.hex()}${_pbkdf2(password, sal, iteracoes).hex()}"
+
+def _hash_legado(password):
+    return hashlib.sha256(str(password).encode()).hexdigest()
+
+def verificar_senha(password, armazenada):
+    """(confere, precisa_atualizar). precisa_atualizar é True para hashes
+    SHA-256 antigos e para PBKDF2 com menos iterações que o configurado."""
+    armazenada = str(armazenada)
+    partes = armazenada.split('$')
+    if len(partes) == 4 and partes[0] == SENHA_ALGORITMO:
+        try:
+            iteracoes, sal = int(partes[1]), bytes.fromhex(partes[2])
+        except ValueError:
+            return False, False
+        confere = hmac.compare_digest(_pbkdf2(password, sal, iteracoes).hex(), partes[3])
+        return confere, confere and iteracoes < _iteracoes_senha()
+    confere = hmac.compare_digest(_hash_legado(password), armazenada)
+    return confere, confere
+
+@st.cache_resource
+def get_executor_senhas():
+    # O KDF roda fora da thread do script; o hashlib solta o GIL enquanto calcula
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="senhas")
+
+@st.cache_resource
+def get_hash_ficticio():
+    # Para usuário inexistente: um PBKDF2 por processo, e a tentativa só paga
+    # a verificação, como a de um usuário real
+    return hash_password(os.urandom(16).hex())
+
+class LimiteTentativas:
+    """Conta falhas de login por usuário numa janela deslizante; passando de
+    max_falhas, o usuário fica bloqueado até a falha mais antiga sair da
+    janela."""
+
+    def __init__(self, max_falhas=MAX_TENTATIVAS_LOGIN, janela=JANELA_TENTATIVAS_SEGUNDOS):
+        self.max_falhas = max_falhas
+        self.janela = janela
+        self._falhas = {}
+        self._varrer_em = VARRER_TENTATIVAS_MIN
+        self._lock = threading.Lock()
+
+    def _recentes(self, chave, agora):
+        """Falhas da chave ainda na janela; a chave sai do dicionário quando
+        não sobra nenhuma."""
+        falhas = self._falhas.get(chave)
+        if falhas is None: return ()
+        while falhas and agora - falhas[0] >= self.janela:
+            falhas.popleft()
+        if not falhas:
+            del self._falhas[chave]
+        return falhas
+
+    def espera(self, chave):
+        """Segundos até poder tentar de novo (0 se liberado)."""
+        with self._lock:
+            agora = time.monotonic()
+            falhas = self._recentes(chave, agora)
+            if len(falhas) < self.max_falhas: return 0
+            return math.ceil(falhas[0] + self.janela - agora)
+
+    def falhou(self, chave):
+        with self._lock:
+            agora = time.monotonic()
+            self._recentes(chave, agora)
+            self._falhas.setdefault(chave, deque()).append(agora)
+            if len(self._falhas) >= self._varrer_em:
+                # Nomes tentados uma vez e nunca mais: a varredura roda quando
+                # o dicionário dobra, então custa O(1) por falha
+                for outra in list(self._falhas):
+                    self._recentes(outra, agora)
+                self._varrer_em = max(VARRER_TENTATIVAS_MIN, 2 * len(self._falhas))
+
+    def limpar(self, chave):
+        with self._lock:
+            self._falhas.pop(chave, None)
+
+@st.cache_resource
+def get_limite_login():
+    return LimiteTentativas()
+
+class UsuariosPorNome:
+    """usuarios como dicionário username (minúsculo) -> registro. Montado
+    uma vez por versão da aba (obter_derivado): é refeito quando o
+    Sincronizador traz mudança da planilha ou quando o app grava na aba."""
+
+    def __init__(self, df):
+        self.total = len(df)
+        self.por_nome = {str(r.get('username', '')).strip().lower(): r for r in registros_de(df)} \
+            if 'username' in df.columns else {}
+
+    def obter(self, username):
+        return self.por_nome.get(str(username).strip().lower())
+
+class LoginBloqueado(Exception):
+    def __init__(self, espera):
+        super().__init__(f"Muitas tentativas. Tente de novo em {espera} s.")
+        self.espera = espera
+
+def init_users_if_empty():
+    df_users = load_data(SHEET_USUARIOS)
+    if df_users.empty:
+        st.warning("Criando usuários padrão...")
+        # Um sal por usuário, mesmo com a senha padrão igual
+        users_init = [
+            {"username": "suellen", "password": hash_password("urb123"), "name": "Suellen", "role": "admin"},
+            {"username": "edvaldo", "password": hash_password("urb123"), "name": "Edvaldo", "role": "user"},
+            {"username": "patricia", "password": hash_password("urb123"), "name": "Patricia", "role": "user"},
+            {"username": "raiany", "password": hash_password("urb123"), "name": "Raiany", "role": "user"},
+        ]
+        df_new = pd.DataFrame(users_init)
+        update_full_sheet(SHEET_USUARIOS, df_new)
+        return df_new
+    return df_users
+
+def check_login(username, password):
+    """Registro do usuário se a senha confere, senão None. Levanta
+    LoginBloqueado depois de MAX_TENTATIVAS_LOGIN falhas na janela."""
+    chave = username.strip().lower()
+    limite = get_limite_login()
+    espera = limite.espera(chave)
+    if espera:
+        raise LoginBloqueado(espera)
+
+    _, usuarios = obter_derivado(SHEET_USUARIOS, 'usuarios_por_nome', UsuariosPorNome)
+    if not usuarios.total:
+        init_users_if_empty()
+        usuarios = UsuariosPorNome(_carregar_df(SHEET_USUARIOS))
+    user = usuarios.obter(chave)
+    # Sem usuário, compara com um hash qualquer para o tempo de resposta não denunciar
+    armazenada = user['password'] if user else get_hash_ficticio()
+    confere, atualizar = get_executor_senhas().submit(verificar_senha, password, armazenada).result()
+    if not (user and confere):
+        limite.falhou(chave)
+        return None
+    limite.limpar(chave)
+    user = dict(user)
+    if atualizar:
+        novo = get_executor_senhas().submit(hash_password, password).result()
+        # Direto na planilha, como a troca de senha: um hash ainda na fila faria
+        # a troca logo depois do login conferir contra a senha antiga
+        try:
+            if atualizar_registro(SHEET_USUARIOS, user['username'], {'password': novo}, coluna_chave='username',
+                                  esperado={'password': armazenada}, direto=True):
+                user['password'] = novo
+        except ConflitoEscrita:
+            pass # trocada em outra sessão; atualiza no próximo login
+    return user
+
+def change_password(username, new_password, hash_atual):
+    """Troca só a célula de senha do usuário. hash_atual é a senha como a
+    sessão a leu no login: se ela mudou desde então (outra sessão ou outro
+    processo trocou antes), nada é gravado e retorna False. A conferência e
+    a gravação vão direto à planilha, para o True só sair com a senha gravada."""
+    novo = get_executor_senhas().submit(hash_password, new_password).result()
+    try:
+        return atualizar_registro(SHEET_USUARIOS, username, {'password': novo},
+                                  coluna_chave='username', esperado={'password': hash_atual}, direto=True)
+    except ConflitoEscrita:
+        return False
+
+# ============================================================
+# TELA LOGIN
+# ============================================================
+if 'user' not in st.session_state:
+    st.session_state.user = None
+
+if st.session_state.user is None:
+    col1, col2, col3 = st.columns([1,2,1])
+    with col2:
+        st.title("🔐 URB Fiscalização")
+        with st.form("login"):
+            u = st.text_input("Usuário").strip()
+            p = st.text_input("Senha", type="password")
+            if st.form_submit_button("Entrar"):
+                try:
+                    user_data = check_login(u, p)
+                except LoginBloqueado as e:
+                    st.error(str(e))
+                    st.stop()
+                if user_data:
+                    st.session_state.user = user_data
+                    st.success(f"Olá, {user_data['name']}!")
+                    time.sleep(1)
+                    st.rerun()
+                else:
+                    st.error("Login inválido")
+    st.stop()
+
+# ============================================================
+# APP PRINCIPAL
+# ============================================================
+user_info = st.session_state.user
+st.sidebar.title(f"Fiscal: {user_info['name']}")
+paginas = ["Dashboard", "Mapa", "Registrar Denúncia", "Histórico / Editar", "Reincidências"]
+if user_info.get('role') == 'admin':
+    paginas.append("Métricas")
+page = st.sidebar.radio("Menu", paginas)
+st.session_state.metricas_rerun.pagina = page
+st.sidebar.divider()
+
+with st.sidebar.expander("🔑 Senha"):
+    with st.form("pwd"):
+        nova_senha = st.text_input("Nova Senha", type="password")
+        if st.form_submit_button("Alterar"):
+            if len(nova_senha) > 0:
+                if change_password(user_info['username'], nova_senha, user_info['password']):
+                    st.success("Senha alterada! Relogue.")
+                else:
+                    st.error("A senha foi alterada em outra sessão. Entre de novo.")
+                st.session_state.user = None
+                time.sleep(2)
+                st.rerun()
+
+# Situação da fila de gravação (espelho local -> Google Sheets)
+fila = get_espelho().contagem_fila()
+if fila.get('pendente'):
+    st.sidebar.caption(f"⏳ {fila['pendente']} gravação(ões) aguardando envio")
+if fila.get('conflito'):
+    st.sidebar.warning(f"{fila['conflito']} alteração(ões) descartada(s): o registro mudou na planilha")
+    if st.sidebar.button("Dispensar aviso"):
+        get_espelho().descartar_conflitos()
+        st.rerun()
+if fila.get('falhou'):
+    st.sidebar.error(f"{fila['falhou']} gravação(ões) falharam")
+    if st.sidebar.button("Tentar novamente"):
+        get_espelho().reenviar_falhas()
+        get_sincronizador().acordar()
+        st.rerun()
+erro_sync = get_sincronizador().ultimo_erro
+if erro_sync:
+    st.sidebar.error(f"Sincronização com a planilha falhou: {erro_sync}")
+
+if st.sidebar.button("Sair"):
+    st.session_state.user = None
+    st.rerun()
+
+# ============================================================
+# PÁGINA 1: DASHBOARD
+# ============================================================
+if page == "Dashboard":
+    st.title("📊 Visão Geral da Fiscalização")
+    df_dash, (agg, serie) = obter_derivados(SHEET_DENUNCIAS, {"dashboard": AgregadosDashboard,
+                                                             "serie_temporal": SerieTemporal})
+    recorte = serie.frame
+
+    # --- FILTRO DE PERÍODO ---
+    if agg.total and not serie.frame.empty:
+        primeira, ultima = serie.frame.index[0].date(), serie.frame.index[-1].date()
+        periodo = st.date_input("Período", value=(primeira, ultima), min_value=primeira, max_value=ultima,
+                                format="DD/MM/YYYY", key="dash_periodo")
+        if isinstance(periodo, (tuple, list)) and len(periodo) == 2 and (periodo[0], periodo[1]) != (primeira, ultima):
+            recorte = serie.recorte(periodo[0], periodo[1])
+            # Agregados do período saem do recorte; o período inteiro usa os memoizados
+            agg = AgregadosDashboard(df_dash.iloc[recorte['pos'].to_numpy()])
+    
+    if agg.total:
+        # --- MÉTRICAS PRINCIPAIS ---
+        status = agg.contagens['status']
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Total de Denúncias", agg.total)
+        c2.metric("Pendentes", status.get('Pendente', 0))
+        c3.metric("Em Andamento", status.get('Em Monitoramento', 0))
+        c4.metric("Concluídas", status.get('Concluída', 0))
+
+        st.divider()
+
+        # --- GRÁFICOS: LINHA 1 (TIPO E FONTE) ---
+        col_graf1, col_graf2 = st.columns(2) # Define as colunas aqui
+
+        with col_graf1:
+            st.subheader("Tipo de Denúncia")
+            st.plotly_chart(agg.figura('tipo'), use_container_width=True)
+
+        with col_graf2:
+            st.subheader("Fonte da Denúncia")
+            st.plotly_chart(agg.figura('origem'), use_container_width=True)
+
+        st.divider()
+
+        # --- GRÁFICOS: LINHA 2 (RANKINGS) ---
+        col_rank1, col_rank2 = st.columns(2)
+
+        with col_rank1:
+            st.subheader("🏆 Ranking por Bairro")
+            st.plotly_chart(agg.figura('bairro'), use_container_width=True)
+
+        with col_rank2:
+            st.subheader("📍 Denúncias por Zona")
+            st.plotly_chart(agg.figura('zona'), use_container_width=True)
+
+        st.divider()
+
+        # --- EVOLUÇÃO NO TEMPO ---
+        st.subheader("📈 Evolução no Tempo")
+        c_freq, c_por = st.columns(2)
+        freq = c_freq.radio("Agrupar por", list(FREQUENCIAS_SERIE), horizontal=True, index=1, key="dash_freq")
+        por = c_por.radio("Separar por", ["Status", "Zona"], horizontal=True, key="dash_por")
+        volume = serie.volume(recorte, FREQUENCIAS_SERIE[freq], por.lower())
+        if not volume.empty:
+            fig_tempo = px.bar(volume, x=volume.index, y=volume.columns, labels={'x': '', 'value': 'Denúncias', 'variable': por})
+            fig_tempo.update_layout(margin=dict(t=30, b=0, l=0, r=0), xaxis_title=None)
+            st.plotly_chart(fig_tempo, use_container_width=True)
+
+        # Idade das OS ainda abertas (Pendente / Em Monitoramento)
+        idades = serie.idade_backlog(recorte, datetime.now(FUSO_BR))
+        b1, b2, b3 = st.columns(3)
+        b1.metric("OS em aberto", len(idades))
+        b2.metric("Idade mediana (dias)", f"{idades.median():.0f}" if len(idades) else "-")
+        b3.metric("Abertas há mais de 30 dias", int((idades > 30).sum()))
+
+        st.divider()
+
+        # --- TABELA RECENTE ---
+        st.subheader("📅 Últimas Ocorrências")
+        st.dataframe(_carregar_df(SHEET_DENUNCIAS).tail(10)[['external_id', 'bairro', 'status', 'created_at']], use_container_width=True)
+
+    else:
+        st.info("Nenhuma denúncia encontrada para gerar estatísticas.")
+# ============================================================
+elif page == "Registrar Denúncia":
+    st.title("📝 Nova Denúncia")
+
+    ORIGENS_EXTERNAS = ["Ouvidoria", "Ministério Publico", "Disk Denuncia"]
+
+    # ---------------- CONTROLE FORA DO FORM ----------------
+    c1, c2 = st.columns(2)
+    origem = c1.selectbox("Origem", OPCOES_ORIGEM)
+    tipo = c2.selectbox("Tipo", OPCOES_TIPO)
+
+    num_encaminhamento = ""
+    if origem in ORIGENS_EXTERNAS:
+        st.info(f"Preencha o número do protocolo vindo do(a) {origem}")
+        num_encaminhamento = st.text_input(
+            "Nº do Encaminhamento / Protocolo"
+        )
+
+    # ---------------- FORM PRINCIPAL ----------------
+    with st.form("form_denuncia"):
+
+        rua = st.text_input("Rua")
+        c3, c4, c5 = st.columns(3)
+        numero = c3.text_input("Número")
+        bairro = c4.text_input("Bairro")
+        zona = c5.selectbox("Zona", OPCOES_ZONA)
+
+        st.markdown("---")
+        col_lat, col_lon = st.columns(2)
+        latitude = col_lat.text_input("Latitude")
+        longitude = col_lon.text_input("Longitude")
+        ponto_ref = st.text_input("Ponto de Referência")
+
+        link_google = ""
+        if latitude and longitude:
+            link_google = f"https://www.google.com/maps?q={latitude},{longitude}"
+            st.caption(link_google)
+
+        st.markdown("---")
+        desc = st.text_area("Descrição da Ocorrência")
+        quem = st.selectbox("Quem recebeu", OPCOES_FISCAIS_SELECT)
+
+        btn_submit = st.form_submit_button("💾 Salvar Denúncia")
+
+    def salvar_nova_denuncia(dados):
+        new_id = gerar_novo_id()
+        ext_id = f"{new_id:04d}/{datetime.now().year}"
+        agora_br = datetime.now(FUSO_BR).strftime("%Y-%m-%d %H:%M:%S")
+        record = {"id": new_id, "external_id": ext_id, "created_at": agora_br, **dados}
+        salvar_dados_seguro(SHEET_DENUNCIAS, record)
+        st.session_state.pop('registro_pendente', None)
+        st.success(f"Denúncia {ext_id} salva!")
+        time.sleep(1)
+        st.rerun()
+
+    if btn_submit:
+        if not rua:
+            st.error("O campo Rua é obrigatório.")
+        elif origem in ORIGENS_EXTERNAS and not num_encaminhamento:
+            st.error(f"Para {origem}, é obrigatório informar o Nº do Encaminhamento.")
+        else:
+            record = {
+                "origem": origem,
+                "tipo": tipo,
+                "num_encaminhamento": num_encaminhamento,
+                "rua": rua,
+                "numero": numero,
+                "bairro": bairro,
+                "zona": zona,
+                "latitude": latitude,
+                "longitude": longitude,
+                "ponto_referencia": ponto_ref,
+                "link_maps": link_google,
+                "descricao": desc,
+                "quem_recebeu": quem,
+                "status": "Pendente",
+                "acao_noturna": "FALSE"
+            }
+
+            # Antes de salvar, procura OS que podem ser a mesma ocorrência
+            candidatos = buscar_candidatos(record)
+            if candidatos:
+                st.session_state.registro_pendente = {"dados": record, "candidatos": candidatos}
+            else:
+                salvar_nova_denuncia(record)
+
+    if 'registro_pendente' in st.session_state:
+        pendente = st.session_state.registro_pendente
+        st.warning("Encontramos OS parecidas. Se for a mesma ocorrência, registre como reincidência.")
+        for cand in pendente["candidatos"]:
+            with st.container(border=True):
+                c_info, c_nota, c_acao = st.columns([4, 1, 1.5])
+                c_info.markdown(f"**OS {cand['external_id']}** — {cand['rua']}, {cand['numero']} - {cand['bairro']}")
+                c_info.caption(f"{cand['status']} | {cand['created_at']} | {', '.join(cand['motivos'])}")
+                c_nota.metric("Semelhança", f"{cand['nota']:.0%}")
+                if c_acao.button("É reincidência desta", key=f"dup_reinc_{cand['external_id']}"):
+                    # Mesma exigência do formulário de Reincidências: relato não pode ser vazio
+                    if not str(pendente["dados"]["descricao"]).strip():
+                        st.error("Escreva a descrição no formulário e envie de novo para registrar a reincidência.")
+                    else:
+                        registrar_reincidencia(cand['external_id'], pendente["dados"]["descricao"],
+                                               pendente["dados"]["origem"], user_info['name'])
+                        del st.session_state.registro_pendente
+                        st.success(f"Reincidência registrada na OS {cand['external_id']}.")
+                        time.sleep(1)
+                        st.rerun()
+        c_nova, c_cancela = st.columns([1, 4])
+        if c_nova.button("Salvar como nova OS", key="dup_salvar_nova"):
+            salvar_nova_denuncia(pendente["dados"])
+        if c_cancela.button("Cancelar", key="dup_cancelar"):
+            del st.session_state.registro_pendente
+            st.rerun()
+
+# ============================================================
+# PÁGINA 3: HISTÓRICO / GERENCIAMENTO
+# ============================================================
+elif page == "Histórico / Editar":
+    st.title("🗂️ Gerenciamento de Ocorrências")
+    
+    # 1. Carregar dados (somente leitura: a listagem trabalha sobre recortes
+    # por posição) junto com o índice dos filtros, da mesma versão
+    df, indice = obter_derivado(SHEET_DENUNCIAS, 'indice_historico', IndiceHistorico)
+    
+    if df.empty:
+        st.info("Nenhum registro encontrado.")
+    else:
+        # --- SEÇÃO DE FILTROS ---
+        with st.expander("🔍 Filtros de Busca", expanded=False):
+            c1, c2, c3, c4 = st.columns(4)
+            f_bairro = c1.text_input("Bairro")
+            f_zona = c2.selectbox("Zona", ["Todos"] + OPCOES_ZONA)
+            f_status = c3.selectbox("Status", ["Todos"] + OPCOES_STATUS)
+            f_id = c4.text_input("Nº da OS (Ex: 0001)")
+            c5, c6 = st.columns(2)
+            f_rua = c5.text_input("Rua")
+            f_texto = c6.text_input("Busca livre (descrição, referência, rua, reincidências)")
+
+        # Aplicar Filtros no índice da versão atual dos dados
+        posicoes = indice.filtrar(
+            bairro=f_bairro, rua=f_rua,
+            zona=None if f_zona == "Todos" else f_zona,
+            status=None if f_status == "Todos" else f_status,
+            numero_os=f_id,
+        )
+        if f_texto.strip():
+            # Busca FTS no espelho: todas as OS que casam, em ordem de
+            # relevância, cruzadas com os outros filtros
+            aceitas = set(posicoes.tolist())
+            posicoes = np.array([pos for ext_id in get_espelho().pesquisar(f_texto)
+                                 for pos in indice.por_os.get(ext_id.lower(), ()) if pos in aceitas], dtype=np.intp)
+
+        # --- LÓGICA DE EDIÇÃO (APARECE NO TOPO SE CLICAR NO LÁPIS) ---
+        if 'edit_id' in st.session_state:
+            st.markdown("---")
+            st.subheader(f"📝 Editando OS: {st.session_state.edit_id}")
+            
+            # Inicializa trava de edição
+            if 'salvando_edicao' not in st.session_state:
+                st.session_state.salvando_edicao = False
+
+            # Consulta indexada no espelho local em vez de varrer o DataFrame
+            encontrados = get_espelho().buscar(SHEET_DENUNCIAS, 'id', st.session_state.edit_id)
+            if encontrados:
+                row_data = encontrados[0]
+                # Valores de quando a edição abriu: base da conferência otimista
+                if st.session_state.get('edit_base_id') != st.session_state.edit_id:
+                    st.session_state.edit_base_id = st.session_state.edit_id
+                    st.session_state.edit_base = row_data
+                base = st.session_state.edit_base
+                
+                with st.form("form_edicao"):
+                    col_e1, col_e2, col_e3 = st.columns(3)
+                    def get_index(lista, valor):
+                        return lista.index(valor) if valor in lista else 0
+
+                    novo_status = col_e1.selectbox("Status", OPCOES_STATUS, index=get_index(OPCOES_STATUS, row_data['status']))
+                    nova_zona = col_e2.selectbox("Zona", OPCOES_ZONA, index=get_index(OPCOES_ZONA, row_data['zona']))
+                    nova_origem = col_e3.selectbox("Origem", OPCOES_ORIGEM, index=get_index(OPCOES_ORIGEM, row_data['origem']))
+                    
+                    col_e4, col_e5 = st.columns([2, 1])
+                    nova_rua = col_e4.text_input("Rua", value=str(row_data.get('rua', '')))
+                    nova_ref = col_e5.text_input("Ponto de Referência", value=str(row_data.get('ponto_referencia', '')))
+
+                    col_lat, col_lon, col_num = st.columns(3)
+                    nova_lat = col_lat.text_input("Latitude", value=str(row_data.get('latitude', '')))
+                    nova_lon = col_lon.text_input("Longitude", value=str(row_data.get('longitude', '')))
+                    novo_num = col_num.text_input("Número", value=str(row_data.get('numero', '')))
+                    
+                    nova_desc = st.text_area("Descrição", value=str(row_data.get('descricao', '')), height=150)
+                    
+                    # Link dinâmico na edição
+                    link_edit = ""
+                    if nova_lat and nova_lon:
+                        link_edit = f"https://www.google.com/maps?q={nova_lat},{nova_lon}"
+                        st.caption(f"Novo Link: {link_edit}")
+
+                    c_btn1, c_btn2 = st.columns([1, 5])
+                    # BOTÃO ATUALIZAR COM TRAVA
+                    if c_btn1.form_submit_button("💾 Atualizar", disabled=st.session_state.salvando_edicao):
+                        st.session_state.salvando_edicao = True
+                        novos_valores = {
+                            'status': novo_status,
+                            'zona': nova_zona,
+                            'origem': nova_origem,
+                            'rua': nova_rua,
+                            'numero': novo_num,
+                            'latitude': nova_lat,
+                            'longitude': nova_lon,
+                            'ponto_referencia': nova_ref,
+                            'descricao': nova_desc,
+                            'link_maps': link_edit,
+                        }
+                        # Só envia o que realmente mudou
+                        alteracoes = {k: v for k, v in novos_valores.items() if str(base.get(k, '')) != str(v)}
+                        # Só grava se ninguém mudou esses campos desde que o formulário abriu
+                        esperado = {k: base[k] for k in alteracoes if k in base}
+                        try:
+                            atualizar_registro(SHEET_DENUNCIAS, st.session_state.edit_id, alteracoes, esperado=esperado)
+                        except ConflitoEscrita:
+                            st.session_state.salvando_edicao = False
+                            st.error("Esta OS foi alterada por outra pessoa enquanto você editava. Cancele e abra de novo.")
+                        else:
+                            st.success("Atualizado com sucesso!")
+                            st.session_state.salvando_edicao = False
+                            del st.session_state.edit_id
+                            st.session_state.pop('edit_base_id', None)
+                            time.sleep(1)
+                            st.rerun()
+                    
+                    if c_btn2.form_submit_button("Cancelar"):
+                        del st.session_state.edit_id
+                        st.session_state.pop('edit_base_id', None)
+                        st.rerun()
+            st.markdown("---")
+
+        # --- LISTAGEM PAGINADA ---
+        # As posições já vêm ordenadas (id decrescente, ou relevância na
+        # busca livre); só a página visível vira widget.
+        df_filtrado = df.iloc[posicoes]
+        total_paginas = max(1, math.ceil(len(df_filtrado) / st.session_state.get('hist_tam_pagina', TAMANHO_PAGINA_PADRAO)))
+        if st.session_state.get('hist_pagina', 1) > total_paginas:
+            st.session_state.hist_pagina = 1
+
+        c_modo, c_tam, c_pag = st.columns([2, 1, 1])
+        modo = c_modo.radio("Exibição", ["Cartões", "Tabela compacta"], horizontal=True, key="hist_modo")
+        tam_pagina = c_tam.selectbox("Por página", OPCOES_TAMANHO_PAGINA,
+                                     index=OPCOES_TAMANHO_PAGINA.index(TAMANHO_PAGINA_PADRAO), key="hist_tam_pagina")
+        pagina = c_pag.number_input("Página", min_value=1, max_value=total_paginas, step=1, key="hist_pagina")
+
+        inicio = (pagina - 1) * tam_pagina
+        df_pagina = df_filtrado.iloc[inicio:inicio + tam_pagina]
+        # Trechos destacados da busca livre só para a página visível
+        trechos = get_espelho().trechos(f_texto, df_pagina['external_id']) if f_texto.strip() else {}
+        st.write(f"Exibindo **{len(df_pagina)}** de **{len(df_filtrado)}** registros (página {pagina} de {total_paginas})")
+
+        def exibir_card(row, dados, i):
+            # Usamos row.id e row.external_id (itertuples é mais rápido e seguro);
+            # dados é a mesma linha com os textos da planilha, para o PDF
+            idx_real = dados['id']
+            ext_id_limpo = str(row.external_id).replace('/', '_')
+
+            with st.container(border=True):
+                c_info, c_status, c_pdf, c_edit, c_del = st.columns([3, 1, 0.5, 0.5, 0.5])
+                
+                c_info.markdown(f"### OS {row.external_id}")
+                c_info.write(f"📍 **{row.rua}**, {row.numero} - {row.bairro} ({row.zona})")
+                c_info.caption(f"🗓️ {dados['created_at']} | 👤 {row.quem_recebeu}")
+                if str(row.external_id).strip() in trechos:
+                    c_info.caption(f"🔎 {trechos[str(row.external_id).strip()]}")
+                if dados['reincidencias']:
+                    c_info.caption(f"🔄 {len(dados['reincidencias'])} reincidência(s)")
+                
+                st_val = str(row.status)
+                clr = "orange" if st_val == "Pendente" else "green" if st_val == "Concluída" else "blue"
+                c_status.markdown(f"<br>:{clr}[**{st_val.upper()}**]", unsafe_allow_html=True)
+                
+                # 1. BOTÃO PDF (CHAVE ÚNICA) - o PDF só é gerado no clique
+                c_pdf.markdown("<br>", unsafe_allow_html=True)
+                c_pdf.download_button(
+                    "📄", 
+                    functools.partial(pdf_para_download, gerar_pdf_em_cache, dados),
+                    f"OS_{ext_id_limpo}.pdf", 
+                    "application/pdf", 
+                    key=f"pdf_btn_{idx_real}_{i}",
+                    on_click="ignore"
+                )
+                
+                # 2. BOTÃO EDITAR (CHAVE ÚNICA)
+                c_edit.markdown("<br>", unsafe_allow_html=True)
+                if c_edit.button("✏️", key=f"ed_btn_{idx_real}_{i}"):
+                    st.session_state.edit_id = idx_real
+                    st.rerun()
+                    
+                # 3. BOTÃO DELETAR (CHAVE ÚNICA)
+                c_del.markdown("<br>", unsafe_allow_html=True)
+                if c_del.button("🗑️", key=f"del_btn_{idx_real}_{i}"):
+                    st.session_state.confirm_del = idx_real
+
+                # Confirmação de exclusão (CHAVE ÚNICA)
+                if 'confirm_del' in st.session_state and st.session_state.confirm_del == idx_real:
+                    st.error(f"Excluir permanentemente OS {row.external_id}?")
+                    ca1, ca2 = st.columns([1, 8])
+                    if ca1.button("Sim", key=f"conf_sim_{idx_real}_{i}"):
+                        excluir_registro(SHEET_DENUNCIAS, idx_real)
+                        del st.session_state.confirm_del
+                        st.rerun()
+                    if ca2.button("Não", key=f"conf_nao_{idx_real}_{i}"):
+                        del st.session_state.confirm_del
+                        st.rerun()
+
+                if dados['reincidencias']:
+                    with st.expander("Linha do tempo"):
+                        exibir_linha_do_tempo(dados)
+
+        # --- EXPORTAÇÃO EM LOTE ---
+        with st.expander("📦 Exportar OS em lote", expanded=False):
+            c_esc, c_fmt = st.columns(2)
+            escopo = c_esc.radio("Quais OS", ["Filtro atual", "Página atual", "Escolher"], horizontal=True, key="exp_escopo")
+            formato = c_fmt.radio("Formato", ["PDF único", "ZIP (um PDF por OS)"], horizontal=True, key="exp_formato")
+            if escopo == "Filtro atual":
+                pos_export = posicoes
+            elif escopo == "Página atual":
+                pos_export = posicoes[inicio:inicio + tam_pagina]
+            else:
+                # Busca como na página de Reincidências: o multiselect recebe só
+                # as OS já escolhidas e as sugestões, não o filtro inteiro. As
+                # escolhidas ficam na sessão porque trocar as opções recria o widget.
+                consulta = st.text_input("Buscar OS (nº ou endereço)", key="exp_busca",
+                                         placeholder="Ex: 0001/2025, 15 ou nome da rua")
+                escolhidas = st.session_state.get('exp_escolhidas', [])
+                sugestoes = df['external_id'].iloc[indice.sugerir(consulta)].astype(str).tolist()
+                escolhidas = st.multiselect("OS", list(dict.fromkeys(escolhidas + sugestoes)), default=escolhidas)
+                st.session_state.exp_escolhidas = escolhidas
+                pos_export = np.array([indice.por_external_id[e] for e in escolhidas if e in indice.por_external_id],
+                                      dtype=np.intp)
+
+            if len(pos_export):
+                hoje = datetime.now(FUSO_BR).strftime('%Y%m%d')
+                zip_por_os = formato != "PDF único"
+                nome, mime = (f"OS_{hoje}.zip", "application/zip") if zip_por_os else (f"OS_{hoje}.pdf", "application/pdf")
+                # Só as posições vão para o botão; registros e PDFs são montados
+                # no clique, em thread separada, com a mesma conversão dos cartões
+                dados_export = functools.partial(exportar_lote, df, pos_export, obter_reincidencias(), zip_por_os)
+                st.download_button(f"⬇️ Baixar {len(pos_export)} OS", dados_export, nome, mime,
+                                   key="exp_download", on_click="ignore")
+            else:
+                st.caption("Nenhuma OS selecionada.")
+
+        if modo == "Tabela compacta":
+            colunas_tabela = ['external_id', 'created_at', 'rua', 'numero', 'bairro', 'zona', 'status', 'quem_recebeu']
+            selecao = st.dataframe(
+                df_pagina[[c for c in colunas_tabela if c in df_pagina.columns]],
+                use_container_width=True, hide_index=True,
+                on_select="rerun", selection_mode="single-row", key="hist_tabela",
+            )
+            linhas = selecao.selection.rows
+            if linhas:
+                # Ações só para a OS selecionada
+                selecionada = df_pagina.iloc[[linhas[0]]]
+                exibir_card(next(selecionada.itertuples()), com_reincidencias(registros_de(selecionada))[0], inicio + linhas[0])
+            else:
+                st.caption("Selecione uma linha para ver as ações da OS.")
+        else:
+            # O 'i' aqui garante que cada linha do loop tenha um número único
+            for i, (row, dados) in enumerate(zip(df_pagina.itertuples(), com_reincidencias(registros_de(df_pagina))), start=inicio):
+                exibir_card(row, dados, i)
+
+# ============================================================
+# PÁGINA 4: REINCIDÊNCIAS
+# ============================================================
+elif page == "Reincidências":
+    st.title("🔄 Reincidência")
+    df_den, indice = obter_derivado(SHEET_DENUNCIAS, 'indice_historico', IndiceHistorico)
+    if not df_den.empty:
+        # Só as melhores sugestões vão para o dropdown, não a lista inteira
+        consulta = st.text_input("Buscar OS (nº ou endereço)", key="reinc_busca",
+                                 placeholder="Ex: 0001/2025, 15 ou nome da rua")
+        sugestoes = df_den.iloc[indice.sugerir(consulta)]
+        rotulos = dict(zip(sugestoes['external_id'].astype(str),
+                           sugestoes['external_id'].astype(str) + " - " + sugestoes['rua'].astype(str)
+                           + ", " + sugestoes['numero'].astype(str) + " - " + sugestoes['bairro'].astype(str)))
+        if not rotulos:
+            st.info("Nenhuma OS encontrada.")
+        real_id = st.selectbox("Denúncia Original", list(rotulos), format_func=rotulos.get)
+        if real_id:
+            pos = indice.por_external_id[real_id]
+            with st.expander("Ver Atual"):
+                exibir_linha_do_tempo(com_reincidencias(registros_de(df_den.iloc[[pos]]))[0])
+            with st.form("reinc"):
+                desc_nova = st.text_area("Novo Relato")
+                origem = st.selectbox("Origem", OPCOES_ORIGEM)
+                if st.form_submit_button("Salvar"):
+                    if not desc_nova: st.error("Escreva algo.")
+                    else:
+                        registrar_reincidencia(real_id, desc_nova, origem, user_info['name'])
+                        st.success("Feito!")
+                        time.sleep(2)
+                        st.rerun()
+
+# ============================================================
+# PÁGINA 5: MAPA
+# ============================================================
+elif page == "Mapa":
+    st.title("🗺️ Mapa das Denúncias")
+    df, espacial = obter_derivado(SHEET_DENUNCIAS, "indice_espacial", IndiceEspacial)
+
+    if not len(espacial.pos):
+        st.info("Nenhuma denúncia com coordenadas válidas.")
+    else:
+        c_zona, c_status, c_modo = st.columns([2, 2, 1])
+        f_zonas = c_zona.multiselect("Zona", OPCOES_ZONA, key="mapa_zonas")
+        f_status = c_status.multiselect("Status", OPCOES_STATUS, key="mapa_status")
+        modo = c_modo.radio("Exibição", ["Pontos", "Densidade"], key="mapa_modo")
+
+        # Filtros sobre os pontos já indexados (arrays alinhados ao índice)
+        manter = np.ones(len(espacial.pos), dtype=bool)
+        if f_zonas:
+            manter &= df['zona'].iloc[espacial.pos].isin(f_zonas).to_numpy()
+        if f_status:
+            manter &= df['status'].iloc[espacial.pos].isin(f_status).to_numpy()
+        pontos = pd.DataFrame({
+            'lat': espacial.lat[manter], 'lon': espacial.lon[manter],
+            'OS': df['external_id'].iloc[espacial.pos[manter]].astype(str).to_numpy(),
+            'status': df['status'].iloc[espacial.pos[manter]].astype(str).to_numpy(),
+            'zona': df['zona'].iloc[espacial.pos[manter]].astype(str).to_numpy(),
+        })
+        st.caption(f"{len(pontos)} denúncia(s) no mapa; {espacial.invalidas} sem coordenadas válidas.")
+
+        if len(pontos):
+            centro = dict(lat=float(pontos['lat'].median()), lon=float(pontos['lon'].median()))
+            if modo == "Pontos":
+                fig_mapa = px.scatter_map(pontos, lat='lat', lon='lon', color='status', hover_name='OS',
+                                          hover_data={'zona': True, 'lat': False, 'lon': False},
+                                          center=centro, zoom=12, height=600)
+                # Agrupa pontos próximos conforme o zoom
+                fig_mapa.update_traces(cluster=dict(enabled=True, maxzoom=15))
+            else:
+                fig_mapa = px.density_map(pontos, lat='lat', lon='lon', radius=15, hover_name='OS',
+                                          center=centro, zoom=12, height=600)
+            fig_mapa.update_layout(margin=dict(t=0, b=0, l=0, r=0), map_style="open-street-map")
+            st.plotly_chart(fig_mapa, use_container_width=True)
+
+        # --- OS PRÓXIMAS ---
+        st.divider()
+        st.subheader("📍 OS próximas")
+        c_os, c_raio, c_abertas = st.columns([2, 1, 1])
+        f_os = c_os.text_input("Nº da OS (Ex: 0001)", key="mapa_os")
+        raio = c_raio.number_input("Raio (m)", min_value=50, max_value=5000, value=RAIO_PROXIMAS_PADRAO, step=50, key="mapa_raio")
+        so_abertas = c_abertas.checkbox("Só abertas", value=True, key="mapa_abertas")
+        if f_os:
+            # Índice das OS, índice espacial e linhas da mesma versão
+            df, (espacial, indice) = obter_derivados(
+                SHEET_DENUNCIAS, {'indice_espacial': IndiceEspacial, 'indice_historico': IndiceHistorico})
+            origem = indice.por_os.get(f_os.strip().lower(), [])
+            lat_os = pd.to_numeric(df['latitude'].iloc[origem], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+            lon_os = pd.to_numeric(df['longitude'].iloc[origem], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+            if not origem:
+                st.warning("OS não encontrada.")
+            elif not coordenadas_validas(lat_os[:1], lon_os[:1])[0]:
+                st.warning("Esta OS não tem coordenadas válidas.")
+            else:
+                posicoes, distancias = espacial.no_raio(lat_os[0], lon_os[0], raio)
+                vizinhas = df.iloc[posicoes].assign(distancia_m=np.round(distancias).astype(int))
+                vizinhas = vizinhas[vizinhas.index != df.index[origem[0]]]
+                if so_abertas:
+                    vizinhas = vizinhas[vizinhas['status'].isin(STATUS_ABERTOS)]
+                st.write(f"**{len(vizinhas)}** OS a até {raio} m de {f_os}.")
+                colunas_viz = ['external_id', 'distancia_m', 'rua', 'numero', 'bairro', 'status', 'created_at']
+                st.dataframe(vizinhas[[c for c in colunas_viz if c in vizinhas.columns]],
+                             use_container_width=True, hide_index=True)
+
+# ============================================================
+# PÁGINA 6: MÉTRICAS (SÓ ADMIN)
+# ============================================================
+elif page == "Métricas" and user_info.get('role') == 'admin':
+    st.title("⏱️ Métricas de Desempenho")
+    cache = get_read_cache()
+    fila = get_espelho().contagem_fila()
+    extras = {
+        'urb_cache_leitura_hits': cache.hits, 'urb_cache_leitura_misses': cache.misses,
+        'urb_fila_pendentes': fila.get('pendente', 0), 'urb_fila_falhas': fila.get('falhou', 0),
+        'urb_fila_conflitos': fila.get('conflito', 0),
+    }
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Cache de leitura (acertos)", cache.hits)
+    c2.metric("Cache de leitura (faltas)", cache.misses)
+    c3.metric("Fila pendente", fila.get('pendente', 0))
+    c4.metric("Fila com falha", fila.get('falhou', 0))
+    sincronizador = get_sincronizador()
+    if sincronizador.ultimo_erro:
+        st.error(f"Último ciclo do Sincronizador falhou: {sincronizador.ultimo_erro}")
+    st.caption("Operações 'api ...' são requisições HTTP à API do Google Sheets (inclusive as do "
+               "Sincronizador, que só contam no processo); as demais são funções do app. "
+               "p50/p95 indicam o limite do balde do histograma em que o percentil cai.")
+
+    escopo = st.radio("Escopo", ["Processo", "Sessão", "Reruns recentes"], horizontal=True, key="met_escopo")
+    if escopo == "Reruns recentes":
+        # O último é o rerun atual, ainda em andamento
+        reruns = list(st.session_state.metricas_reruns)[:-1][::-1]
+        resumo = []
+        for metricas in reruns:
+            tabela = metricas.tabela()
+            api = tabela[tabela['operacao'].str.startswith('api ')]
+            resumo.append({
+                'inicio': datetime.fromtimestamp(metricas.criado_em, FUSO_BR).strftime('%H:%M:%S'),
+                'pagina': getattr(metricas, 'pagina', ''),
+                'chamadas_api': int(api['chamadas'].sum()), 'bytes_api': int(api['bytes'].sum()),
+                'cota_429': int(tabela['cota_429'].sum()),
+                'load_data_ms': float(tabela.loc[tabela['operacao'] == 'load_data', 'media_ms'].sum()),
+            })
+        st.dataframe(pd.DataFrame(resumo), use_container_width=True, hide_index=True)
+        if not reruns:
+            st.info("Nenhum rerun anterior nesta sessão.")
+            st.stop()
+        escolhido = st.selectbox("Detalhar rerun", range(len(reruns)), key="met_rerun",
+                                 format_func=lambda i: f"{resumo[i]['inicio']} - {resumo[i]['pagina']}")
+        metricas = reruns[escolhido]
+    else:
+        metricas = get_metricas() if escopo == "Processo" else st.session_state.metricas_sessao
+
+    tabela = metricas.tabela()
+    st.dataframe(tabela, use_container_width=True, hide_index=True)
+
+    operacoes = metricas.operacoes()
+    if operacoes:
+        op = st.selectbox("Histograma de latência", sorted(operacoes), key="met_op")
+        rotulos = [f"≤{int(l * 1000)} ms" for l in BALDES_LATENCIA] + [f">{int(BALDES_LATENCIA[-1] * 1000)} ms"]
+        st.bar_chart(pd.DataFrame({'chamadas': operacoes[op]['baldes']}, index=pd.Index(rotulos, name='latência')))
+
+    # --- EXPORTAÇÃO ---
+    c_prom, c_csv, c_arq = st.columns(3)
+    texto_prom = metricas.prometheus(extras)
+    c_prom.download_button("⬇️ Prometheus (.prom)", texto_prom, "urb_metricas.prom", "text/plain", key="met_prom")
+    c_csv.download_button("⬇️ CSV", tabela.to_csv(index=False), "urb_metricas.csv", "text/csv", key="met_csv")
+    caminho = st.secrets.get("metricas_prometheus_path")
+    if caminho and c_arq.button("Gravar para o node_exporter", key="met_arquivo"):
+        # Escrita atômica: o coletor nunca lê um arquivo pela metade
+        temporario = f"{caminho}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            f.write(get_metricas().prometheus(extras))
+        os.replace(temporario, caminho)
+        st.success(f"Métricas do processo gravadas em {caminho}")
@@ -0,0 +1,784 @@
+"""Benchmark offline do app.py, sem acessar a planilha de verdade.
+
+Troca o gspread por uma planilha em memória (AbaFalsa) com latência
+configurável por chamada, gera denúncias e reincidências sintéticas com as
+opções do próprio app (OPCOES_*) e mede os caminhos mais usados em 1k, 10k
+e 100k linhas:
+
+- dashboard: primeira carga (espelho vazio, puxa tudo da planilha) e
+  reruns com o cache quente;
+- historico: troca para a página (listagem paginada) e filtro por rua;
+- indice_historico: montagem do IndiceHistorico e latência de filtrar()
+  sem o AppTest, já que na página o desenho domina o tempo;
+- registro: envio do formulário, com e sem OS parecidas, e o tempo até a
+  linha chegar na planilha pelo Sincronizador;
+- reincidencia: busca da OS pelo número e gravação do novo relato;
+- pdf: PDFs por segundo e pico de memória gerando uma OS por vez
+  (descrição curta e longa) e exportação em lote (PDF único e ZIP) das OS
+  de um bairro.
+
+As páginas rodam de verdade pelo streamlit.testing (AppTest); as pausas de
+interface do app (time.sleep de 0,5 s ou mais antes do st.rerun) são
+puladas para não entrarem na medida. Os resultados vão para um JSON, um
+registro por cenário e tamanho, para comparar execuções:
+
+    python benchmark.py
+    python benchmark.py --tamanhos 1000 10000 --latencia 0.15 --saida atual.json
+    python benchmark.py --tamanhos 1000 --comparar base.json
+
+Para medir o antes e depois de uma mudança no PDF, rode o cenário pdf
+contra o app.py de outro commit (versões sem exportação em lote medem só
+a geração por OS):
+
+    git show <commit>:app.py > /tmp/app_antes.py
+    python benchmark.py --app /tmp/app_antes.py --cenarios pdf --tamanhos 1000 --saida antes.json
+    python benchmark.py --cenarios pdf --tamanhos 1000 --comparar antes.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+import warnings
+from collections import Counter
+from datetime import datetime, timedelta
+from unittest import mock
+
+import gspread
+import pandas as pd
+import streamlit as st
+import streamlit.logger
+from google.oauth2 import service_account
+from gspread.exceptions import WorksheetNotFound
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+MARCADOR_FIM_DEFINICOES = "# TELA LOGIN" # a partir daqui o app.py desenha as páginas
+TAMANHOS_PADRAO = [1000, 10000, 100000]
+REPETICOES_PADRAO = 3
+MAX_PDFS_PADRAO = 300
+PDFS_POR_OS_PADRAO = 1000
+TAMANHO_DESCRICAO_LONGA = 450
+TOLERANCIA_PADRAO = 1.2
+PAUSA_UI_MINIMA = 0.5
+TIMEOUT_APPTEST = 600
+TIMEOUT_SINCRONIZACAO = 120
+PROPORCAO_REINCIDENCIAS = 0.2
+CONSULTAS_POR_FILTRO = 200
+# Mesma lista da página de registro: só essas origens têm nº de protocolo
+ORIGENS_COM_PROTOCOLO = ["Ouvidoria", "Ministério Publico", "Disk Denuncia"]
+CENTRO_LAT, CENTRO_LON = -8.2835, -35.9761 # Caruaru
+
+_dormir = time.sleep # a latência falsa não pode ser pulada junto com as pausas de UI
+
+# ============================================================
+# GSPREAD FALSO
+# ============================================================
+class Celula:
+    def __init__(self, valor):
+        self.value = valor
+
+class AbaFalsa:
+    """Worksheet do gspread em memória, com os métodos que o app usa.
+
+    Toda chamada espera `latencia` segundos, mais `por_mil_celulas` a cada
+    1000 células lidas ou gravadas, como a ida e volta até a API. Os
+    valores ficam como texto, do jeito que get_values devolve.
+    """
+
+    def __init__(self, titulo, linhas=None, latencia=0.0, por_mil_celulas=0.0):
+        self.title = titulo
+        self.latencia = latencia
+        self.por_mil_celulas = por_mil_celulas
+        self.chamadas = Counter()
+        self._linhas = [[_texto(v) for v in linha] for linha in (linhas or [])]
+        self._lock = threading.Lock()
+
+    def _api(self, nome, celulas=0):
+        self.chamadas[nome] += 1
+        espera = self.latencia + self.por_mil_celulas * celulas / 1000
+        if espera > 0:
+            _dormir(espera)
+
+    def __len__(self):
+        return len(self._linhas)
+
+    @property
+    def row_count(self):
+        return max(len(self._linhas), 1000)
+
+    @property
+    def col_count(self):
+        return max((len(linha) for linha in self._linhas), default=26)
+
+    # --- Leitura ---
+    def _faixa(self, faixa):
+        """(linha0, linha1, col0, col1) 0-based e exclusivos no fim."""
+        grade = gspread.utils.a1_range_to_grid_range(faixa.split('!')[-1])
+        return (grade.get('startRowIndex', 0), grade.get('endRowIndex', len(self._linhas)),
+                grade.get('startColumnIndex', 0), grade.get('endColumnIndex', self.col_count))
+
+    def _recorte(self, faixa):
+        with self._lock:
+            if faixa is None:
+                valores = [list(linha) for linha in self._linhas]
+            else:
+                l0, l1, c0, c1 = self._faixa(faixa)
+                valores = [linha[c0:c1] for linha in self._linhas[l0:l1]]
+        # A API corta células e linhas vazias no fim
+        for linha in valores:
+            while linha and linha[-1] == '':
+                linha.pop()
+        while valores and not valores[-1]:
+            valores.pop()
+        return valores
+
+    def get_values(self, range_name=None, **kwargs):
+        valores = self._recorte(range_name)
+        self._api('get_values', sum(map(len, valores)))
+        return valores
+
+    def get_all_values(self, **kwargs):
+        return self.get_values()
+
+    def get_all_records(self, **kwargs):
+        valores = self.get_values()
+        if not valores: return []
+        cabecalho = valores[0]
+        return [{c: gspread.utils.numericise(linha[i] if i < len(linha) else '', default_blank='')
+                 for i, c in enumerate(cabecalho)} for linha in valores[1:]]
+
+    def batch_get(self, ranges, major_dimension=None, **kwargs):
+        blocos = []
+        for faixa in ranges:
+            valores = self._recorte(faixa)
+            if major_dimension == 'COLUMNS':
+                largura = max((len(linha) for linha in valores), default=0)
+                valores = [[linha[j] if j < len(linha) else '' for linha in valores] for j in range(largura)]
+                for coluna in valores:
+                    while coluna and coluna[-1] == '':
+                        coluna.pop()
+            blocos.append(valores)
+        self._api('batch_get', sum(len(v) for bloco in blocos for v in bloco))
+        return blocos
+
+    def row_values(self, row, **kwargs):
+        with self._lock:
+            valores = list(self._linhas[row - 1]) if row <= len(self._linhas) else []
+        while valores and valores[-1] == '':
+            valores.pop()
+        self._api('row_values', len(valores))
+        return valores
+
+    def col_values(self, col, **kwargs):
+        with self._lock:
+            valores = [linha[col - 1] if col - 1 < len(linha) else '' for linha in self._linhas]
+        while valores and valores[-1] == '':
+            valores.pop()
+        self._api('col_values', len(valores))
+        return valores
+
+    def cell(self, row, col, **kwargs):
+        with self._lock:
+            linha = self._linhas[row - 1] if row <= len(self._linhas) else []
+            valor = linha[col - 1] if col - 1 < len(linha) else None
+        self._api('cell', 1)
+        return Celula(valor or None)
+
+    def acell(self, label, **kwargs):
+        row, col = gspread.utils.a1_to_rowcol(label)
+        return self.cell(row, col)
+
+    # --- Escrita ---
+    def _gravar(self, l0, c0, valores):
+        for i, linha in enumerate(valores):
+            while len(self._linhas) <= l0 + i:
+                self._linhas.append([])
+            destino = self._linhas[l0 + i]
+            for j, valor in enumerate(linha):
+                while len(destino) <= c0 + j:
+                    destino.append('')
+                destino[c0 + j] = _texto(valor)
+
+    def update(self, *args, **kwargs):
+        # Aceita update(valores), update(valores, faixa) e a ordem antiga update(faixa, valores)
+        if args and isinstance(args[0], str):
+            faixa, valores = args[0], args[1] if len(args) > 1 else kwargs.get('values')
+        else:
+            valores = args[0] if args else kwargs.get('values')
+            faixa = args[1] if len(args) > 1 else kwargs.get('range_name') or 'A1'
+        with self._lock:
+            l0, _, c0, _ = self._faixa(faixa)
+            self._gravar(l0, c0, valores)
+        self._api('update', sum(map(len, valores)))
+
+    def batch_update(self, data, **kwargs):
+        with self._lock:
+            for item in data:
+                l0, _, c0, _ = self._faixa(item['range'])
+                self._gravar(l0, c0, item['values'])
+        self._api('batch_update', sum(len(v) for item in data for v in item['values']))
+
+    def append_rows(self, values, **kwargs):
+        with self._lock:
+            while self._linhas and not any(self._linhas[-1]):
+                self._linhas.pop()
+            inicio = len(self._linhas) + 1
+            self._gravar(inicio - 1, 0, values)
+            fim = len(self._linhas)
+        largura = max((len(v) for v in values), default=1)
+        self._api('append_rows', sum(map(len, values)))
+        faixa = f"'{self.title}'!A{inicio}:{gspread.utils.rowcol_to_a1(fim, max(largura, 1))}"
+        return {'updates': {'updatedRange': faixa}}
+
+    def append_row(self, values, **kwargs):
+        return self.append_rows([values], **kwargs)
+
+    def batch_clear(self, ranges):
+        with self._lock:
+            for faixa in ranges:
+                l0, l1, c0, c1 = self._faixa(faixa)
+                for linha in self._linhas[l0:l1]:
+                    for j in range(c0, min(c1, len(linha))):
+                        linha[j] = ''
+        self._api('batch_clear')
+
+    def clear(self):
+        with self._lock:
+            self._linhas = []
+        self._api('clear')
+
+    def delete_rows(self, start_index, end_index=None):
+        with self._lock:
+            del self._linhas[start_index - 1:(end_index or start_index)]
+        self._api('delete_rows')
+
+class PlanilhaFalsa:
+    def __init__(self, abas=None, latencia=0.0, por_mil_celulas=0.0):
+        self.latencia = latencia
+        self.por_mil_celulas = por_mil_celulas
+        self.abas = {}
+        for titulo, linhas in (abas or {}).items():
+            self.abas[titulo] = AbaFalsa(titulo, linhas, latencia, por_mil_celulas)
+
+    def worksheet(self, titulo):
+        if titulo not in self.abas:
+            raise WorksheetNotFound(titulo)
+        return self.abas[titulo]
+
+    def add_worksheet(self, title, rows=100, cols=20, **kwargs):
+        self.abas[title] = AbaFalsa(title, [], self.latencia, self.por_mil_celulas)
+        return self.abas[title]
+
+    def worksheets(self):
+        return list(self.abas.values())
+
+    def chamadas(self):
+        """Total de chamadas por método, somando todas as abas."""
+        total = Counter()
+        for aba in self.abas.values():
+            total.update(aba.chamadas)
+        return total
+
+class ClienteFalso:
+    def __init__(self, planilha):
+        self.planilha = planilha
+
+    def open_by_key(self, key):
+        return self.planilha
+
+@contextlib.contextmanager
+def backend_falso(planilha):
+    """Faz o gspread.authorize do app devolver a planilha falsa."""
+    with mock.patch.object(gspread, 'authorize', lambda *args, **kwargs: ClienteFalso(planilha)), \
+         mock.patch.object(service_account.Credentials, 'from_service_account_info',
+                           lambda *args, **kwargs: object()):
+        yield
+
+@contextlib.contextmanager
+def sem_pausas_de_interface():
+    """Pula os time.sleep de PAUSA_UI_MINIMA ou mais (mensagem de sucesso
+    antes do st.rerun); os curtos, do próprio Streamlit, continuam."""
+    with mock.patch.object(time, 'sleep', lambda s: None if s >= PAUSA_UI_MINIMA else _dormir(s)):
+        yield
+
+def _texto(valor):
+    return '' if valor is None else str(valor)
+
+# ============================================================
+# DADOS SINTÉTICOS
+# ============================================================
+_NOMES_RUA = ['São João', 'Vigário Freire', 'Quinze de Novembro', 'Martins Júnior', 'Sete de Setembro',
+              'Duque de Caxias', 'Frei Caneca', 'Siqueira Campos', 'Barão do Rio Branco', 'Azevedo Coutinho',
+              'das Flores', 'do Rosário', 'José Bonifácio', 'Leão Dourado', 'Agamenon Magalhães']
+_TIPOS_RUA = ['Rua', 'Rua', 'Rua', 'Avenida', 'Travessa']
+_BAIRROS = ['Centro', 'Salgado', 'Maurício de Nassau', 'Universitário', 'Indianópolis', 'Boa Vista',
+            'Petrópolis', 'Divinópolis', 'São Francisco', 'Kennedy', 'Vassoural', 'Caiucá', 'Rendeiras',
+            'Nova Caruaru', 'Cidade Jardim', 'Santa Rosa', 'Morro Bom Jesus', 'Cedro', 'Serranópolis',
+            'Jardim Panorama']
+_OCORRENCIAS = ['Poda de árvore sem autorização', 'Som alto em estabelecimento', 'Obra sem alvará',
+                'Descarte irregular de entulho', 'Ocupação de calçada', 'Terreno baldio com lixo',
+                'Queimada em lote', 'Lançamento de esgoto na via', 'Comércio ambulante irregular',
+                'Construção em área de preservação']
+_DETALHES = ['desde a semana passada', 'segundo vizinhos, todos os dias', 'no período da noite',
+             'próximo à escola', 'com risco para pedestres', 'já denunciado antes', 'em frente ao nº indicado']
+
+def _rua(rng, quantidade):
+    i = rng.randrange(quantidade)
+    return f"{_TIPOS_RUA[i % len(_TIPOS_RUA)]} {_NOMES_RUA[i % len(_NOMES_RUA)]} {i // len(_NOMES_RUA) or ''}".strip()
+
+def gerar_denuncias(app, n, rng, ano=None):
+    """n linhas de denuncias_registro (cabeçalho incluso), com as opções
+    do app e datas espalhadas nos últimos dois anos."""
+    ano = ano or datetime.now().year
+    agora = datetime.now()
+    ruas = max(20, n // 25)
+    linhas = [list(app['DENUNCIA_SCHEMA'])]
+    for i in range(1, n + 1):
+        origem = rng.choice(app['OPCOES_ORIGEM'])
+        com_coordenada = rng.random() < 0.8
+        lat = f"{CENTRO_LAT + rng.uniform(-0.04, 0.04):.6f}" if com_coordenada else ''
+        lon = f"{CENTRO_LON + rng.uniform(-0.04, 0.04):.6f}" if com_coordenada else ''
+        registro = {
+            'id': i, 'external_id': f"{i:04d}/{ano}",
+            'created_at': (agora - timedelta(minutes=rng.randrange(2 * 365 * 24 * 60))).strftime("%Y-%m-%d %H:%M:%S"),
+            'origem': origem, 'tipo': rng.choice(app['OPCOES_TIPO']),
+            'num_encaminhamento': str(rng.randrange(1000, 99999)) if origem in ORIGENS_COM_PROTOCOLO else '',
+            'rua': _rua(rng, ruas), 'numero': str(rng.randrange(1, 2000)) if rng.random() < 0.9 else 'S/N',
+            'bairro': rng.choice(_BAIRROS), 'zona': rng.choice(app['OPCOES_ZONA']),
+            'ponto_referencia': rng.choice(['', 'Perto da praça', 'Ao lado do mercado', 'Em frente à igreja']),
+            'latitude': lat, 'longitude': lon,
+            'link maps': f"https://www.google.com/maps?q={lat},{lon}" if com_coordenada else '',
+            'descricao': f"{rng.choice(_OCORRENCIAS)} {rng.choice(_DETALHES)}.",
+            'quem_recebeu': rng.choice(app['OPCOES_FISCAIS_SELECT']),
+            'status': rng.choices(app['OPCOES_STATUS'], weights=[3, 2, 6, 1])[0],
+            'acao_noturna': 'FALSE',
+        }
+        linhas.append([registro.get(c, '') for c in linhas[0]])
+    return linhas
+
+def gerar_reincidencias(app, denuncias, rng, proporcao=PROPORCAO_REINCIDENCIAS):
+    """Linhas de reincidencias para uma fração das denúncias (algumas com
+    mais de uma), sempre depois da data da original."""
+    cabecalho = denuncias[0]
+    i_ext, i_data = cabecalho.index('external_id'), cabecalho.index('created_at')
+    linhas = [list(app['REINCIDENCIA_SCHEMA'])]
+    for linha in rng.sample(denuncias[1:], int((len(denuncias) - 1) * proporcao)):
+        data = datetime.strptime(linha[i_data], "%Y-%m-%d %H:%M:%S")
+        for _ in range(rng.choice([1, 1, 1, 2, 3])):
+            data += timedelta(days=rng.randrange(1, 60))
+            registro = {'external_id': linha[i_ext], 'data_hora': data.strftime("%Y-%m-%d %H:%M:%S"),
+                        'origem': rng.choice(app['OPCOES_ORIGEM']),
+                        'descricao': f"Voltou a acontecer: {rng.choice(_DETALHES)}.",
+                        'registrado_por': rng.choice(app['OPCOES_FISCAIS_SELECT'])}
+            linhas.append([registro[c] for c in linhas[0]])
+    return linhas
+
+def montar_planilha(app, n, rng, latencia=0.0, por_mil_celulas=0.0):
+    denuncias = gerar_denuncias(app, n, rng)
+    return PlanilhaFalsa({
+        app['SHEET_DENUNCIAS']: denuncias,
+        app['SHEET_REINCIDENCIAS']: gerar_reincidencias(app, denuncias, rng),
+        # A sessão já começa logada (nova_sessao), a senha não é conferida
+        app['SHEET_USUARIOS']: [['username', 'password', 'name', 'role'],
+                                ['benchmark', '', 'Benchmark', 'admin']],
+        app['SHEET_CONFIG']: [[n]],
+    }, latencia, por_mil_celulas)
+
+# ============================================================
+# CARGA DO APP E SESSÕES
+# ============================================================
+def carregar_app(caminho=APP_PATH):
+    """Definições do app.py (tudo antes da tela de login) num dicionário,
+    para usar as funções de PDF e as opções sem abrir nenhuma página."""
+    with open(caminho, encoding='utf-8') as f:
+        fonte = f.read()
+    fonte = fonte[:fonte.index(MARCADOR_FIM_DEFINICOES)]
+    app = {'__name__': 'app_benchmark', '__file__': caminho}
+    exec(compile(fonte, caminho, 'exec'), app)
+    return app
+
+def nova_sessao(ctx):
+    """AppTest já logado como admin, pronto para a primeira execução."""
+    at = AppTest.from_file(ctx.app_path, default_timeout=TIMEOUT_APPTEST)
+    for chave, valor in ctx.segredos.items():
+        at.secrets[chave] = valor
+    at.session_state['user'] = {'username': 'benchmark', 'name': 'Benchmark', 'role': 'admin', 'password': ''}
+    return at
+
+def _widget(lista, rotulo):
+    return next(w for w in lista if w.label == rotulo)
+
+def _verificar(at, cenario):
+    if at.exception:
+        raise RuntimeError(f"{cenario}: {at.exception[0].value}")
+
+def _rodar(at, cenario):
+    inicio = time.perf_counter()
+    at.run()
+    segundos = time.perf_counter() - inicio
+    _verificar(at, cenario)
+    return segundos
+
+def ir_para(at, pagina):
+    _widget(at.sidebar.radio, "Menu").set_value(pagina)
+    return _rodar(at, f"abrir {pagina}")
+
+# ============================================================
+# CENÁRIOS
+# ============================================================
+class Medicao:
+    """Tempos de um cenário num tamanho, com as chamadas feitas à planilha
+    falsa durante as medidas."""
+
+    def __init__(self, cenario, tamanho, planilha):
+        self.cenario = cenario
+        self.tamanho = tamanho
+        self.planilha = planilha
+        self.tempos = []
+        self.chamadas = Counter()
+        self.extras = {}
+
+    @contextlib.contextmanager
+    def medir(self):
+        antes = self.planilha.chamadas()
+        inicio = time.perf_counter()
+        yield
+        self.tempos.append(time.perf_counter() - inicio)
+        self.chamadas.update(self.planilha.chamadas() - antes)
+
+    def adicionar(self, segundos, chamadas=None):
+        self.tempos.append(segundos)
+        self.chamadas.update(chamadas or {})
+
+    def resultado(self):
+        return {
+            'cenario': self.cenario, 'tamanho': self.tamanho, 'repeticoes': len(self.tempos),
+            'min_s': round(min(self.tempos), 4), 'mediana_s': round(statistics.median(self.tempos), 4),
+            'max_s': round(max(self.tempos), 4),
+            'chamadas_api': dict(sorted(self.chamadas.items())),
+            **self.extras,
+        }
+
+def cenario_dashboard(ctx):
+    frio = Medicao('dashboard_frio', ctx.tamanho, ctx.planilha)
+    with frio.medir():
+        at = nova_sessao(ctx)
+        at.run()
+    _verificar(at, 'dashboard_frio')
+    quente = Medicao('dashboard_quente', ctx.tamanho, ctx.planilha)
+    for _ in range(ctx.repeticoes):
+        with quente.medir():
+            at.run()
+        _verificar(at, 'dashboard_quente')
+    return [frio, quente]
+
+def cenario_historico(ctx):
+    pagina = Medicao('historico_listagem', ctx.tamanho, ctx.planilha)
+    filtro = Medicao('historico_filtro_rua', ctx.tamanho, ctx.planilha)
+    for _ in range(ctx.repeticoes):
+        at = nova_sessao(ctx)
+        at.run()
+        with pagina.medir():
+            ir_para(at, "Histórico / Editar")
+        _widget(at.text_input, "Rua").input(ctx.amostra('rua'))
+        with filtro.medir():
+            _rodar(at, 'historico_filtro_rua')
+    return [pagina, filtro]
+
+def cenario_indice_historico(ctx):
+    """IndiceHistorico(df) sobre a aba tipada como no app e filtrar() com
+    CONSULTAS_POR_FILTRO valores sorteados por tipo de filtro; cada filtro
+    informa a latência média por consulta."""
+    app = ctx.app
+    if 'IndiceHistorico' not in app:
+        return []
+    df = app['tipar_df'](app['SHEET_DENUNCIAS'], pd.DataFrame(ctx.linhas[1:], columns=ctx.linhas[0]))
+    montagem = Medicao('indice_historico_montagem', ctx.tamanho, ctx.planilha)
+    for _ in range(ctx.repeticoes):
+        with montagem.medir():
+            indice = app['IndiceHistorico'](df)
+
+    filtros = {
+        'rua': lambda: {'rua': ctx.amostra('rua')},
+        'bairro_status': lambda: dict(zip(('bairro', 'status'), ctx.amostra('bairro', 'status'))),
+        'zona_status': lambda: dict(zip(('zona', 'status'), ctx.amostra('zona', 'status'))),
+        'numero_os': lambda: {'numero_os': ctx.amostra('external_id').split('/')[0]},
+    }
+    medicoes = [montagem]
+    for nome, sortear in filtros.items():
+        consultas = [sortear() for _ in range(CONSULTAS_POR_FILTRO)]
+        medicao = Medicao(f'indice_historico_filtro_{nome}', ctx.tamanho, ctx.planilha)
+        for _ in range(ctx.repeticoes):
+            with medicao.medir():
+                for consulta in consultas:
+                    indice.filtrar(**consulta)
+        medicao.extras = {'consultas': len(consultas),
+                          'ms_por_consulta': round(statistics.median(medicao.tempos) / len(consultas) * 1000, 3)}
+        medicoes.append(medicao)
+    return medicoes
+
+def _preencher_registro(at, rua, numero, bairro):
+    _widget(at.text_input, "Rua").input(rua)
+    _widget(at.text_input, "Número").input(numero)
+    _widget(at.text_input, "Bairro").input(bairro)
+    _widget(at.text_area, "Descrição da Ocorrência").input("Som alto em estabelecimento no período da noite.")
+    _widget(at.button, "💾 Salvar Denúncia").click()
+
+def cenario_registro(ctx):
+    novo = Medicao('registro', ctx.tamanho, ctx.planilha)
+    parecido = Medicao('registro_com_duplicata', ctx.tamanho, ctx.planilha)
+    sincronizado = Medicao('registro_ate_planilha', ctx.tamanho, ctx.planilha)
+    aba = ctx.planilha.worksheet(ctx.app['SHEET_DENUNCIAS'])
+    at = nova_sessao(ctx)
+    at.run()
+    ir_para(at, "Registrar Denúncia")
+    for i in range(ctx.repeticoes):
+        # Endereço inédito: salva direto
+        linhas_antes = len(aba)
+        _preencher_registro(at, f"Rua Benchmark {ctx.tamanho}-{i}", str(i + 1), "Bairro Benchmark")
+        inicio = time.perf_counter()
+        antes = ctx.planilha.chamadas()
+        novo.adicionar(_rodar(at, 'registro'))
+        while len(aba) <= linhas_antes:
+            if time.perf_counter() - inicio > TIMEOUT_SINCRONIZACAO:
+                raise RuntimeError("registro: a linha não chegou à planilha")
+            _dormir(0.01)
+        sincronizado.adicionar(time.perf_counter() - inicio, ctx.planilha.chamadas() - antes)
+
+        # Endereço de uma OS existente: mostra as candidatas antes de salvar
+        rua, numero, bairro = ctx.amostra('rua', 'numero', 'bairro')
+        _preencher_registro(at, rua, numero, bairro)
+        with parecido.medir():
+            _rodar(at, 'registro_com_duplicata')
+        if any("Salvar como nova OS" == b.label for b in at.button):
+            _widget(at.button, "Cancelar").click()
+            _rodar(at, 'registro_com_duplicata')
+    return [novo, parecido, sincronizado]
+
+def cenario_reincidencia(ctx):
+    busca = Medicao('reincidencia_busca', ctx.tamanho, ctx.planilha)
+    gravacao = Medicao('reincidencia_gravacao', ctx.tamanho, ctx.planilha)
+    at = nova_sessao(ctx)
+    at.run()
+    ir_para(at, "Reincidências")
+    for _ in range(ctx.repeticoes):
+        _widget(at.text_input, "Buscar OS (nº ou endereço)").input(ctx.amostra('external_id'))
+        with busca.medir():
+            _rodar(at, 'reincidencia_busca')
+        _widget(at.text_area, "Novo Relato").input("Voltou a acontecer no fim de semana.")
+        _widget(at.button, "Salvar").click()
+        with gravacao.medir():
+            _rodar(at, 'reincidencia_gravacao')
+    return [busca, gravacao]
+
+def _registro_pdf(cabecalho, linha, reincidencias=()):
+    return dict(zip(cabecalho, linha), link_maps=linha[cabecalho.index('link maps')],
+                reincidencias=list(reincidencias))
+
+def _pdfs_por_os(ctx, cenario, registros):
+    """gerar_pdf uma OS por vez, sem cache: tempo das repetições e, numa
+    passada à parte (o tracemalloc deixa tudo mais lento), o pico de memória."""
+    gerar_pdf = ctx.app['gerar_pdf']
+    medicao = Medicao(cenario, ctx.tamanho, ctx.planilha)
+    for _ in range(ctx.repeticoes):
+        with medicao.medir():
+            for dados in registros:
+                pdf = gerar_pdf(dados)
+        if not isinstance(pdf, bytes):
+            raise RuntimeError(f"{cenario}: {pdf}")
+    tracemalloc.start()
+    try:
+        for dados in registros:
+            gerar_pdf(dados)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    medicao.extras = {'pdfs': len(registros),
+                      'pdfs_por_s': round(len(registros) / statistics.median(medicao.tempos), 1),
+                      'pico_memoria_mb': round(pico / 2**20, 2)}
+    return medicao
+
+def cenario_pdf(ctx):
+    """gerar_pdf sobre pdfs_por_os denúncias, com descrição curta e longa,
+    e exportação das OS de um bairro (como no filtro do Histórico),
+    limitada a max_pdfs, com as reincidências de cada uma."""
+    app = ctx.app
+    cabecalho = ctx.linhas[0]
+    # Sem reincidências, para comparar com versões do app que não as desenham
+    curtas = [_registro_pdf(cabecalho, linha) for linha in ctx.linhas[1:ctx.pdfs_por_os + 1]]
+    texto_longo = " ".join(_DETALHES * 10)[:TAMANHO_DESCRICAO_LONGA]
+    longas = [dict(r, descricao=texto_longo) for r in curtas]
+    medicoes = [_pdfs_por_os(ctx, 'pdf_por_os_curta', curtas),
+                _pdfs_por_os(ctx, 'pdf_por_os_longa', longas)]
+    if 'gerar_pdf_lote' not in app:
+        return medicoes
+
+    bairro = ctx.amostra('bairro')
+    i_bairro, i_ext = cabecalho.index('bairro'), cabecalho.index('external_id')
+    reinc = ctx.planilha.worksheet(app['SHEET_REINCIDENCIAS'])._linhas
+    por_os = {}
+    for linha in reinc[1:]:
+        por_os.setdefault(linha[0], []).append(dict(zip(reinc[0], linha)))
+    registros = [_registro_pdf(cabecalho, linha, por_os.get(linha[i_ext], []))
+                 for linha in ctx.linhas[1:] if linha[i_bairro] == bairro][:ctx.max_pdfs]
+
+    unico = Medicao(f'pdf_unico_{len(registros)}_os', ctx.tamanho, ctx.planilha)
+    zip_frio = Medicao(f'pdf_zip_{len(registros)}_os', ctx.tamanho, ctx.planilha)
+    for _ in range(ctx.repeticoes):
+        with unico.medir():
+            pdf = app['gerar_pdf_lote'](registros)
+        if not isinstance(pdf, bytes):
+            raise RuntimeError(f"pdf: {pdf}")
+    # O ZIP passa pelo cache de PDFs: a primeira rodada gera, as outras reaproveitam
+    for i in range(ctx.repeticoes):
+        registros_rodada = [dict(r, descricao=f"{r['descricao']} ({i})") for r in registros]
+        with zip_frio.medir():
+            app['gerar_zip_lote'](registros_rodada)
+    return medicoes + [unico, zip_frio]
+
+CENARIOS = {
+    'dashboard': cenario_dashboard,
+    'historico': cenario_historico,
+    'indice_historico': cenario_indice_historico,
+    'registro': cenario_registro,
+    'reincidencia': cenario_reincidencia,
+    'pdf': cenario_pdf,
+}
+
+class Contexto:
+    """O que os cenários de um tamanho compartilham."""
+
+    def __init__(self, app, app_path, tamanho, planilha, segredos, repeticoes, max_pdfs, pdfs_por_os, rng):
+        self.app = app
+        self.app_path = app_path
+        self.tamanho = tamanho
+        self.planilha = planilha
+        self.linhas = [list(l) for l in planilha.worksheet(app['SHEET_DENUNCIAS'])._linhas]
+        self.segredos = segredos
+        self.repeticoes = repeticoes
+        self.max_pdfs = max_pdfs
+        self.pdfs_por_os = pdfs_por_os
+        self.rng = rng
+
+    def amostra(self, *colunas):
+        """Valores de uma denúncia sorteada (um só valor se pedir uma coluna)."""
+        linha = self.rng.choice(self.linhas[1:])
+        valores = [linha[self.linhas[0].index(c)] for c in colunas]
+        return valores[0] if len(valores) == 1 else valores
+
+# ============================================================
+# EXECUÇÃO E COMPARAÇÃO
+# ============================================================
+def executar(tamanhos, cenarios, repeticoes=REPETICOES_PADRAO, latencia=0.0, por_mil_celulas=0.0,
+             max_pdfs=MAX_PDFS_PADRAO, pdfs_por_os=PDFS_POR_OS_PADRAO, semente=42,
+             app_path=APP_PATH, log=print):
+    app = carregar_app(app_path)
+    resultados = []
+    for tamanho in tamanhos:
+        rng = random.Random(semente + tamanho)
+        planilha = montar_planilha(app, tamanho, rng, latencia, por_mil_celulas)
+        segredos = {
+            'gcp_service_account': {'spreadsheet_key': 'benchmark', 'private_key': ''},
+            'espelho_path': ':memory:',
+            # O Sincronizador só roda quando o app grava (acordar); assim as
+            # threads de tamanhos anteriores não disputam CPU com as medidas
+            'sync_intervalo_segundos': 3600,
+        }
+        ctx = Contexto(app, app_path, tamanho, planilha, segredos, repeticoes, max_pdfs, pdfs_por_os, rng)
+        # Espelho, caches e Sincronizador começam do zero em cada tamanho
+        st.cache_resource.clear()
+        with backend_falso(planilha), sem_pausas_de_interface():
+            for nome in cenarios:
+                for medicao in CENARIOS[nome](ctx):
+                    resultado = medicao.resultado()
+                    resultados.append(resultado)
+                    extras = (f", {resultado['pdfs_por_s']} PDFs/s, pico {resultado['pico_memoria_mb']} MB"
+                              if 'pdfs_por_s' in resultado else "")
+                    if 'ms_por_consulta' in resultado:
+                        extras = f", {resultado['ms_por_consulta']} ms por consulta"
+                    log(f"{tamanho:>7} {resultado['cenario']:<28} mediana {resultado['mediana_s']:8.3f} s "
+                        f"(min {resultado['min_s']:.3f}, max {resultado['max_s']:.3f}, "
+                        f"{sum(resultado['chamadas_api'].values())} chamadas{extras})")
+    return {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'app': app_path,
+        'parametros': {'tamanhos': tamanhos, 'cenarios': cenarios, 'repeticoes': repeticoes,
+                       'latencia': latencia, 'por_mil_celulas': por_mil_celulas,
+                       'max_pdfs': max_pdfs, 'pdfs_por_os': pdfs_por_os, 'semente': semente},
+        'resultados': resultados,
+    }
+
+def comparar(atual, base, tolerancia=TOLERANCIA_PADRAO):
+    """Linhas (cenário, tamanho, base, atual, razão) e quais passaram da
+    tolerância (atual > base * tolerancia)."""
+    anteriores = {(r['cenario'], r['tamanho']): r for r in base['resultados']}
+    linhas, regressoes = [], []
+    for r in atual['resultados']:
+        anterior = anteriores.get((r['cenario'], r['tamanho']))
+        if anterior is None: continue
+        razao = r['mediana_s'] / anterior['mediana_s'] if anterior['mediana_s'] else float('inf')
+        linha = (r['cenario'], r['tamanho'], anterior['mediana_s'], r['mediana_s'], razao)
+        linhas.append(linha)
+        if razao > tolerancia:
+            regressoes.append(linha)
+    return linhas, regressoes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tamanhos', type=int, nargs='+', default=TAMANHOS_PADRAO)
+    parser.add_argument('--cenarios', nargs='+', choices=list(CENARIOS), default=list(CENARIOS))
+    parser.add_argument('--repeticoes', type=int, default=REPETICOES_PADRAO)
+    parser.add_argument('--latencia', type=float, default=0.0, help="segundos por chamada à planilha falsa")
+    parser.add_argument('--por-mil-celulas', type=float, default=0.0,
+                        help="segundos extras por 1000 células lidas ou gravadas")
+    parser.add_argument('--max-pdfs', type=int, default=MAX_PDFS_PADRAO,
+                        help="limite de OS na exportação em lote")
+    parser.add_argument('--pdfs-por-os', type=int, default=PDFS_POR_OS_PADRAO,
+                        help="denúncias geradas uma a uma no cenário pdf (PDFs/s e pico de memória)")
+    parser.add_argument('--app', default=APP_PATH, help="app.py a medir (ex.: de um commit anterior)")
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', default=f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    parser.add_argument('--comparar', metavar='BASE_JSON', help="resultado anterior para comparar")
+    parser.add_argument('--tolerancia', type=float, default=TOLERANCIA_PADRAO,
+                        help="razão atual/base acima da qual o cenário conta como regressão")
+    args = parser.parse_args(argv)
+    saida = os.path.abspath(args.saida)
+    base_path = os.path.abspath(args.comparar) if args.comparar else None
+    app_path = os.path.abspath(args.app)
+    # O app abre logo.png e outros arquivos relativos à pasta do projeto,
+    # como no `streamlit run app.py`
+    os.chdir(os.path.dirname(APP_PATH))
+
+    # Sem servidor, o Streamlit avisa a cada chamada que está em modo "bare";
+    # o nível vai para o config porque o AppTest reaplica o logger.level
+    warnings.filterwarnings('ignore')
+    st.config.set_option('logger.level', 'error')
+    streamlit.logger.set_log_level('error')
+    resultado = executar(args.tamanhos, args.cenarios, args.repeticoes, args.latencia,
+                         args.por_mil_celulas, args.max_pdfs, args.pdfs_por_os, args.semente, app_path)
+    with open(saida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"Resultados gravados em {saida}")
+
+    if base_path:
+        with open(base_path, encoding='utf-8') as f:
+            base = json.load(f)
+        linhas, regressoes = comparar(resultado, base, args.tolerancia)
+        for cenario, tamanho, antes, depois, razao in linhas:
+            marca = "  <-- regressão" if razao > args.tolerancia else ""
+            print(f"{tamanho:>7} {cenario:<28} {antes:8.3f} s -> {depois:8.3f} s ({razao:5.2f}x){marca}")
+        if regressoes:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,18 @@
+import os
+import sys
+import warnings
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import benchmark  # noqa: E402
+import streamlit as st  # noqa: E402
+
+@pytest.fixture(scope="session")
+def app():
+    """Definições do app.py (sem as páginas), como no benchmark."""
+    warnings.filterwarnings('ignore')
+    st.config.set_option('logger.level', 'error')
+    return benchmark.carregar_app()
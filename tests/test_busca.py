@@ -0,0 +1,16 @@
+ABA = "denuncias_registro"
+CABECALHO = ["id", "external_id", "rua", "bairro", "descricao"]
+
+def test_busca_traz_todas_as_os_para_cruzar_com_os_filtros(app):
+    espelho = app['LocalMirror'](":memory:")
+    linhas = [[str(i), f"{i:04d}/2025", f"Rua {i}", "Centro" if i < 500 else "Salgado", "poda de árvore"]
+              for i in range(1, 511)]
+    espelho.substituir(ABA, CABECALHO, [linhas])
+
+    achadas = espelho.pesquisar("poda")
+    assert len(achadas) == 510
+    assert {"0500/2025", "0510/2025"} <= set(achadas)
+
+    trechos = espelho.trechos("arvore", ["0505/2025", "0999/2025"])
+    assert list(trechos) == ["0505/2025"]
+    assert "**árvore**" in trechos["0505/2025"]
@@ -0,0 +1,82 @@
+import itertools
+import threading
+from collections import Counter
+
+import pytest
+
+from benchmark import AbaFalsa
+
+PROCESSOS = 8
+IDS_POR_PROCESSO = 25
+
+class AbaComCorrida(AbaFalsa):
+    """Segura quem lê o cabeçalho vazio até todos lerem, para os processos
+    decidirem a base ao mesmo tempo."""
+
+    def __init__(self, participantes, latencia=0.0):
+        super().__init__("sequencia_os", latencia=latencia)
+        self._barreira = threading.Barrier(participantes)
+
+    def row_values(self, row, **kwargs):
+        valores = super().row_values(row, **kwargs)
+        if row == 1 and not valores:
+            self._barreira.wait(timeout=10)
+        return valores
+
+def _rodar_processos(app, aba, bloco, processos=PROCESSOS, ids=IDS_POR_PROCESSO):
+    """Um IdAllocator por thread, como processos separados no mesmo Sheets."""
+    alocados, erros = [], []
+    lock = threading.Lock()
+    inicio = threading.Barrier(processos)
+
+    def processo():
+        alocador = app['IdAllocator'](bloco)
+        try:
+            inicio.wait(timeout=10)
+            meus = [alocador.novo_id() for _ in range(ids)]
+        except Exception as e:  # noqa: BLE001 - o teste mostra o erro
+            erros.append(e)
+            return
+        with lock:
+            alocados.extend(meus)
+
+    threads = [threading.Thread(target=processo) for _ in range(processos)]
+    for t in threads: t.start()
+    for t in threads: t.join(timeout=60)
+    assert not erros, erros
+    return alocados
+
+@pytest.fixture
+def sequencia(app, monkeypatch):
+    def preparar(aba, legados):
+        monkeypatch.setitem(app, 'get_worksheet', lambda nome: aba)
+        monkeypatch.setitem(app, '_ultimo_id_legado', lambda: next(legados))
+        return aba
+    return preparar
+
+@pytest.mark.parametrize("bloco", [1, 5])
+def test_ids_unicos_com_varios_processos(app, sequencia, bloco):
+    aba = sequencia(AbaFalsa("sequencia_os", latencia=0.001), itertools.repeat(10))
+    alocados = _rodar_processos(app, aba, bloco)
+
+    repetidos = [i for i, n in Counter(alocados).items() if n > 1]
+    assert not repetidos
+    assert len(alocados) == PROCESSOS * IDS_POR_PROCESSO
+    assert min(alocados) > 10
+
+def test_bases_diferentes_no_primeiro_uso_nao_sobrepoem(app, sequencia):
+    # Cada processo acha um maior id diferente (10, 12, 14...) com o
+    # cabeçalho ainda vazio; todos têm que usar a base que ficou na linha 1.
+    aba = sequencia(AbaComCorrida(PROCESSOS), itertools.count(10, 2))
+    alocados = _rodar_processos(app, aba, 1)
+
+    assert len(set(alocados)) == len(alocados)
+    base = int(aba.row_values(1)[1])
+    assert min(alocados) > base
+
+def test_cabecalho_existente_nao_e_sobrescrito(app, sequencia):
+    aba = sequencia(AbaFalsa("sequencia_os", [["base", 40, "bloco", 2]]), itertools.repeat(999))
+    alocador = app['IdAllocator'](1)
+
+    assert [alocador.novo_id() for _ in range(3)] == [41, 42, 43]
+    assert aba.row_values(1) == ["base", "40", "bloco", "2"]
@@ -0,0 +1,26 @@
+import time
+
+def test_bloqueia_depois_do_maximo_e_libera_na_janela(app):
+    limite = app['LimiteTentativas'](max_falhas=2, janela=0.2)
+    limite.falhou("ana")
+    assert limite.espera("ana") == 0
+    limite.falhou("ana")
+    assert limite.espera("ana") == 1
+
+    time.sleep(0.25)
+    assert limite.espera("ana") == 0
+    assert limite._falhas == {}
+
+def test_consultas_e_nomes_abandonados_nao_acumulam(app, monkeypatch):
+    monkeypatch.setitem(app, 'VARRER_TENTATIVAS_MIN', 50)
+    limite = app['LimiteTentativas'](janela=0.05)
+    for i in range(1000):
+        assert limite.espera(f"consulta{i}") == 0
+    assert limite._falhas == {}
+
+    for i in range(40):
+        limite.falhou(f"antigo{i}")
+    time.sleep(0.1)
+    for i in range(200):
+        limite.falhou(f"novo{i}")
+    assert not any(chave.startswith("antigo") for chave in limite._falhas)
@@ -0,0 +1,17 @@
+import pandas as pd
+
+def test_registros_por_os_em_ordem_de_data(app):
+    df = pd.DataFrame({"external_id": ["0002/2025", " 0001/2025", "0001/2025"],
+                       "data_hora": ["2025-01-05 10:00:00", "2025-03-01 08:00:00", "2025-02-01 09:30:00"],
+                       "descricao": ["b", "c", "a"]})
+    app['tipar_df']("reincidencias", df)
+    reincidencias = app['ReincidenciasPorOS'](df)
+
+    registros = reincidencias.registros("0001/2025")
+    assert [r["descricao"] for r in registros] == ["a", "c"]
+    assert registros[0]["data_hora"] == "2025-02-01 09:30:00"
+    assert reincidencias.contagem("0002/2025") == 1
+    assert reincidencias.registros("0003/2025") == []
+
+    registros.clear()
+    assert reincidencias.contagem("0001/2025") == 2
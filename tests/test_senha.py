@@ -0,0 +1,35 @@
+import pytest
+
+from benchmark import AbaFalsa
+
+ABA = "usuarios"
+CABECALHO = ["username", "password", "name", "role"]
+
+@pytest.fixture
+def usuarios(app, monkeypatch):
+    """Aba usuarios falsa já espelhada; a planilha pode mudar sem o espelho
+    saber, como quando outro processo grava."""
+    aba = AbaFalsa(ABA, [CABECALHO, ["ana", "hash-0", "Ana", "user"]])
+    espelho = app['LocalMirror'](":memory:")
+    app['Sincronizador'](espelho, abrir_aba=lambda nome: aba, cabecalhos=lambda nome: CABECALHO,
+                         abas=[ABA]).puxar(ABA)
+    cache = app['ReadCache'](60, tipar=app['tipar_df'])
+    monkeypatch.setitem(app, 'get_espelho', lambda: espelho)
+    monkeypatch.setitem(app, 'get_read_cache', lambda: cache)
+    monkeypatch.setitem(app, 'get_worksheet', lambda nome: aba)
+    monkeypatch.setitem(app, '_iteracoes_senha', lambda: 1000)
+    monkeypatch.setattr(app['SheetsClient'], 'get_headers', classmethod(lambda cls, nome: CABECALHO))
+    return aba, espelho
+
+def test_troca_conferida_na_planilha_e_nao_no_espelho(app, usuarios):
+    aba, espelho = usuarios
+    aba.update([["hash-outro-processo"]], "B2")
+
+    assert app['change_password']("ana", "nova", "hash-0") is False
+    assert aba.row_values(2)[1] == "hash-outro-processo"
+
+    assert app['change_password']("ana", "nova", "hash-outro-processo") is True
+    gravado = aba.row_values(2)[1]
+    assert app['verificar_senha']("nova", gravado)[0]
+    assert espelho.buscar(ABA, "username", "ana")[0]["password"] == gravado
+    assert espelho.contagem_fila() == {}
@@ -0,0 +1,83 @@
+import pytest
+
+from benchmark import AbaFalsa
+
+ABA = "denuncias_registro"
+CABECALHO = ["id", "external_id", "rua", "status"]
+
+@pytest.fixture
+def sync(app):
+    """Espelho em memória e Sincronizador contra uma aba falsa; mudancas
+    guarda as chamadas de ao_mudar (a invalidação do cache de leitura)."""
+    aba = AbaFalsa(ABA, [CABECALHO] + [[i, f"OS-{i}", f"Rua {i}", "Pendente"] for i in range(1, 6)])
+    espelho = app['LocalMirror'](":memory:")
+    mudancas = []
+    sincronizador = app['Sincronizador'](espelho, abrir_aba=lambda nome: aba, cabecalhos=lambda nome: CABECALHO,
+                                         abas=[ABA], ao_mudar=mudancas.append)
+    sincronizador.puxar(ABA)
+    mudancas.clear()
+    return aba, espelho, sincronizador, mudancas
+
+def _status(espelho, chave):
+    return espelho.buscar(ABA, "id", chave)[0]["status"]
+
+def test_insercao_propria_nao_invalida(sync):
+    aba, espelho, sincronizador, mudancas = sync
+    valores = ["6", "OS-6", "Rua 6", "Pendente"]
+    espelho.enfileirar_insercao(ABA, valores, dict(zip(CABECALHO, valores)))
+
+    sincronizador.ciclo()
+    assert mudancas == []
+    assert espelho.contagem_fila() == {}
+
+    aba.append_rows([["7", "OS-7", "Rua 7", "Pendente"]])
+    sincronizador.ciclo()
+    assert mudancas == [ABA]
+
+def test_alteracao_e_exclusao_proprias_nao_invalidam_na_carga_completa(sync):
+    aba, espelho, sincronizador, mudancas = sync
+    sincronizador.completo_a_cada = 0
+    espelho.enfileirar(ABA, "alterar", "id", 2, {"status": "Concluído"})
+    espelho.enfileirar(ABA, "excluir", "id", 4)
+
+    sincronizador.ciclo()
+    assert mudancas == []
+    assert _status(espelho, 2) == "Concluído"
+    assert espelho.buscar(ABA, "id", 4) == []
+
+    aba.update([["Cancelado"]], "D3")
+    sincronizador.ciclo()
+    assert mudancas == [ABA]
+    assert _status(espelho, 2) == "Cancelado"
+
+def test_conflito_recarrega_a_aba_e_pode_ser_dispensado(sync):
+    aba, espelho, sincronizador, mudancas = sync
+    espelho.enfileirar(ABA, "alterar", "id", 3, {"status": "Concluído"})
+    aba.update([["Em análise"]], "D4")
+
+    sincronizador.ciclo()
+    assert espelho.contagem_fila() == {"conflito": 1}
+    assert _status(espelho, 3) == "Em análise"
+    assert mudancas == [ABA]
+
+    sincronizador.ciclo()
+    assert mudancas == [ABA]
+
+    assert espelho.descartar_conflitos() == 1
+    assert espelho.contagem_fila() == {}
+
+def test_abas_espelhadas_nao_expiram_pelo_ttl(app, sync):
+    aba, espelho, sincronizador, mudancas = sync
+    cache = app['ReadCache'](0, sem_ttl=[ABA])
+    sincronizador.ao_mudar = cache.invalidate
+    cache.put(ABA, espelho.ler(ABA))
+    cache.put("outra", espelho.ler(ABA))
+
+    assert cache.get(ABA) is not None
+    assert cache.get("outra") is None
+
+    sincronizador.ciclo()
+    assert cache.get(ABA) is not None
+    aba.append_rows([["6", "OS-6", "Rua 6", "Pendente"]])
+    sincronizador.ciclo()
+    assert cache.get(ABA) is None
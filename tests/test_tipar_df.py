@@ -0,0 +1,17 @@
+import pandas as pd
+
+ABA = "denuncias_registro"
+
+def test_coordenadas_com_virgula_e_todos_os_digitos(app):
+    df = pd.DataFrame({"id": [1, 2, 3, 4], "latitude": ["-8,2835", -8.28351234, "", "sem"],
+                       "longitude": ["-35,9761", -35.97612345, "", ""]})
+    app['tipar_df'](ABA, df)
+
+    assert df["latitude"].iloc[0] == -8.2835
+    assert df["longitude"].iloc[1] == -35.97612345
+    assert df["latitude"].iloc[2:].isna().all()
+
+    registros = app['registros_de'](df)
+    assert (registros[0]["latitude"], registros[0]["longitude"]) == ("-8.2835", "-35.9761")
+    assert (registros[1]["latitude"], registros[1]["longitude"]) == ("-8.28351234", "-35.97612345")
+    assert registros[2]["latitude"] == ""